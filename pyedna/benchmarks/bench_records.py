@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of data record encoding. Compares the records/second of
+the dictionary/JSON path used by Datafile.add_record with the
+precompiled RecordEncoder path used by Datafile.add_values.
+"""
+import sys
+import time
+import argparse
+from collections import OrderedDict
+from edna.sample import Datafile, register_event, SampleFields
+from edna.binrec import BinaryDatafile
+
+
+class NullFile(object):
+    def write(self, s):
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def sample(i: int):
+    return (i*0.1, i*0.00123, 4.1 + (i % 7)*0.0137, (i % 11) != 0, 24.0 + (i % 5)*0.01)
+
+
+def dict_path(df: Datafile, n: int, t0: float):
+    for i in range(n):
+        secs, amount, pr, pr_ok, depth = sample(i)
+        df.add_record("sample.1", OrderedDict(elapsed=round(secs, 3),
+                                              amount=round(amount, 3),
+                                              pr=round(pr, 3),
+                                              pr_ok=pr_ok,
+                                              depth=round(depth, 3)), ts=t0+i*0.1)
+
+
+def encoder_path(df: Datafile, n: int, t0: float):
+    enc = register_event("sample.1", SampleFields)
+    for i in range(n):
+        df.add_values(enc, sample(i), ts=t0+i*0.1)
+
+
+def run(name: str, fn, df: Datafile, n: int) -> float:
+    t = time.perf_counter()
+    fn(df, n, 1600000000.0)
+    rate = n/(time.perf_counter() - t)
+    print("{:<28s} {:>12,.0f} records/s".format(name, rate))
+    return rate
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark data record encoding")
+    parser.add_argument("-n", type=int, default=200000,
+                        help="number of records (default: %(default)d)")
+    args = parser.parse_args()
+
+    before = run("add_record (ndjson)", dict_path, Datafile(NullFile()), args.n)
+    after = run("add_values (ndjson)", encoder_path, Datafile(NullFile()), args.n)
+    run("add_record (binary)", dict_path, BinaryDatafile(NullFile()), args.n)
+    run("add_values (binary)", encoder_path, BinaryDatafile(NullFile()), args.n)
+    print("ndjson speedup: {:.1f}x".format(after/before))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
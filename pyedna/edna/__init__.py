@@ -1,4 +1,4 @@
-import time
+from .clock import get_clock
 try:
     from importlib import metadata # type: ignore
 except ImportError:
@@ -8,17 +8,20 @@ except ImportError:
 __version__ = metadata.version(__name__)
 
 
-def ticker(interval, fsleep=time.sleep):
+def ticker(interval, fsleep=None, clock=None):
     """
     Timer tick generator. Can be used to iterate at a fixed rate.
     Returns a series of time values.
 
     @param interval: time between ticks in seconds
-    @param fsleep: sleep function
+    @param fsleep: sleep function, defaults to the clock's
+    @param clock: time source, defaults to edna.clock.get_clock()
     """
-    t0 = time.time()
+    clock = clock or get_clock()
+    fsleep = fsleep or clock.sleep
+    t0 = clock.time()
     while True:
-        t1 = time.time()
+        t1 = clock.time()
         yield t1
         if interval > 0:
             t0 += interval
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.acq
+     :platform: Linux (Raspberry Pi)
+     :synopsis: sensor acquisition in a separate process
+
+An :class:`Acquisition` runs the sensor reads (A/D channels, Smart
+Battery registers and GPIO pulse counters) in a child process, so the
+sampling times are not affected by logging, record encoding or
+archiving in the main process. The child writes timestamped samples to
+a :class:`SampleRing` in shared memory and the main process reads them
+through objects with the same interface as the hardware, so the
+sensor classes from :mod:`edna.periph` are used unchanged::
+
+    >>> acq = Acquisition(20., adc=partial(ADS1115, address=0x48, busnum=1),
+    ...                   adc_chans=[(0, 1), (1, 2./3)])
+    >>> with acq:
+    ...     pr = PrSensor(acq.adc(), 0, 1)
+    ...     psi = pr.read()
+
+The A/D values returned are the latest samples, taken at the gain given
+in *adc_chans*. Requires Python 3.8 or later (multiprocessing.shared_memory).
+"""
+from . import periph
+from .clock import RealClock
+from .rt import RtPolicy, configure_thread, get_policy
+from .timing import Ticker
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Mapping, Optional, \
+    Sequence, Tuple
+import logging
+import multiprocessing
+import struct
+import time
+
+
+# Header; record count, number of channels, missed ticks and maximum
+# tick lateness in nanoseconds of the acquisition loop.
+_HDR = struct.Struct("<qqqq")
+_HDRSIZE = 64
+# Latest value of each channel; sequence number, time and value. The
+# sequence number is -1 while the slot is being written.
+_SLOT = struct.Struct("<qdd")
+_SEQ = struct.Struct("<q")
+_VAL = struct.Struct("<dd")
+# Ring buffer records; sequence number, time, channel and value
+_REC = struct.Struct("<qdqd")
+
+
+class SampleRing(object):
+    """
+    Fixed-size ring buffer of timestamped samples in shared memory, with
+    a single writer. Readers can fetch the latest sample of a channel or
+    all of the samples since a given record number. Sequence numbers in
+    the buffer start at 1, zero marks an empty entry.
+    """
+    def __init__(self, name: Optional[str] = None, channels: int = 0,
+                 size: int = 4096):
+        """
+        :param name: name of an existing ring, if None a new ring is created
+        :param channels: number of channels of a new ring
+        :param size: number of records of a new ring
+        """
+        from multiprocessing import shared_memory
+        if name is None:
+            nbytes = _HDRSIZE + channels*_SLOT.size + size*_REC.size
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            _HDR.pack_into(self.shm.buf, 0, 0, channels, 0, 0)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.channels = _HDR.unpack_from(self.buf, 0)[1]
+        self.ring = _HDRSIZE + self.channels*_SLOT.size
+        self.size = (len(self.buf) - self.ring)//_REC.size
+        self.n = self.count
+
+    @property
+    def count(self) -> int:
+        """
+        Total number of records written.
+        """
+        return _HDR.unpack_from(self.buf, 0)[0]
+
+    def append(self, chan: int, t: float, value: float):
+        """
+        Write a sample.
+        """
+        n = self.n
+        seq = n + 1
+        _REC.pack_into(self.buf, self.ring + (n % self.size)*_REC.size,
+                       seq, t, chan, value)
+        off = _HDRSIZE + chan*_SLOT.size
+        _SEQ.pack_into(self.buf, off, -1)
+        _VAL.pack_into(self.buf, off + _SEQ.size, t, value)
+        _SEQ.pack_into(self.buf, off, seq)
+        self.n = seq
+        _SEQ.pack_into(self.buf, 0, seq)
+
+    def set_timing(self, missed: int, late_max: int):
+        """
+        Store the acquisition loop statistics.
+        """
+        struct.pack_into("<qq", self.buf, 16, missed, late_max)
+
+    def timing(self) -> Tuple[int, int]:
+        """
+        Return the missed ticks and maximum lateness in nanoseconds of
+        the acquisition loop.
+        """
+        return _HDR.unpack_from(self.buf, 0)[2:]
+
+    def latest(self, chan: int) -> Optional[Tuple[float, float]]:
+        """
+        Return the time and value of the latest sample of a channel or
+        None if there is none.
+        """
+        off = _HDRSIZE + chan*_SLOT.size
+        for i in range(100):
+            seq, t, value = _SLOT.unpack_from(self.buf, off)
+            if seq == 0:
+                break
+            if seq > 0 and _SEQ.unpack_from(self.buf, off)[0] == seq:
+                return t, value
+        return None
+
+    def read(self, start: int) -> Tuple[List[Tuple[float, int, float]], int, int]:
+        """
+        Return the samples written since record number start as a list of
+        (time, channel, value) tuples, the next record number and the
+        number of records which were overwritten before they were read.
+        """
+        end = self.count
+        first = max(start, end - self.size)
+        dropped = first - start
+        recs = []
+        for n in range(first, end):
+            seq, t, chan, value = _REC.unpack_from(self.buf,
+                                                   self.ring + (n % self.size)*_REC.size)
+            if seq != n + 1:
+                dropped += 1
+                continue
+            recs.append((t, chan, value))
+        return recs, end, dropped
+
+    def close(self):
+        """
+        Detach from the shared memory, the owner also removes it.
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _acquire(name: str, rate: float,
+             adc: Optional[Callable[[], Any]], adc_chans: Sequence[Tuple[int, float]],
+             smbus: Optional[Callable[[int], Any]], smbus_reads: Sequence[Tuple[int, int, int]],
+             smbus_interval: float, counters: Sequence[int],
+             rt: Optional[RtPolicy], stop: Any):
+    logger = logging.getLogger("edna.acq")
+    ring = SampleRing(name)
+    try:
+        configure_thread("acquisition", rt)
+        dev = adc() if adc_chans else None
+        buses: Dict[int, Any] = dict()
+        for bus, addr, cmd in smbus_reads:
+            if bus not in buses:
+                buses[bus] = smbus(bus)  # type: ignore
+        if counters:
+            periph.GPIO.setmode(periph.GPIO.BCM)
+        ctrs = [periph.Counter(line, clock=RealClock()) for line in counters]
+        k_smbus = len(adc_chans)
+        k_ctr = k_smbus + len(smbus_reads)
+        t_smbus = 0.
+        tkr = Ticker(1./rate, clock=RealClock())
+        for tick in tkr:
+            for key, (chan, gain) in enumerate(adc_chans):
+                try:
+                    ring.append(key, time.time(), dev.read_adc(chan, gain=gain))
+                except IOError:
+                    continue
+            for key, c in enumerate(ctrs, k_ctr):
+                count, _ = c.read()
+                ring.append(key, time.time(), count)
+            if smbus_reads and tick.t >= t_smbus:
+                t_smbus = tick.t + smbus_interval
+                for key, (bus, addr, cmd) in enumerate(smbus_reads, k_smbus):
+                    try:
+                        val = buses[bus].read_i2c_block_data(addr, cmd, 2)
+                    except IOError:
+                        # Device busy, keep the previous value
+                        continue
+                    ring.append(key, time.time(), val[0] + val[1]*256)
+            ring.set_timing(tkr.missed, tkr.late_max)
+            if stop.is_set():
+                break
+    except Exception:
+        logger.exception("Acquisition process failed")
+    finally:
+        ring.close()
+
+
+class RingAdc(object):
+    """
+    Adafruit_ADS1x15 A/D converter interface which returns the latest
+    samples acquired by an Acquisition process.
+    """
+    def __init__(self, ring: SampleRing, chans: Mapping[int, int]):
+        """
+        :param ring: sample buffer
+        :param chans: ring channel of each A/D channel
+        """
+        self.ring = ring
+        self.chans = chans
+        self.chan = -1
+
+    def read_adc(self, chan: int, gain: float = 1, data_rate: Any = None) -> int:
+        s = self.ring.latest(self.chans[chan])
+        if s is None:
+            raise IOError("no samples for A/D channel {:d}".format(chan))
+        return int(s[1])
+
+    def start_adc(self, chan: int, gain: float = 1, data_rate: Any = None) -> int:
+        self.chan = chan
+        return self.read_adc(chan)
+
+    def get_last_result(self) -> int:
+        if self.chan == -1:
+            return 0
+        return self.read_adc(self.chan)
+
+    def stop_adc(self):
+        self.chan = -1
+
+
+class RingSMBus(object):
+    """
+    SMBus interface which returns the latest 16-bit register values
+    acquired by an Acquisition process. An IOError is raised, like a
+    NAK from the device, if a register has not been read yet.
+    """
+    def __init__(self, ring: SampleRing, regs: Mapping[Tuple[int, int], int]):
+        """
+        :param ring: sample buffer
+        :param regs: ring channel of each (address, command) pair
+        """
+        self.ring = ring
+        self.regs = regs
+
+    def read_i2c_block_data(self, addr: int, cmd: int, n: int) -> List[int]:
+        key = self.regs.get((addr, cmd))
+        s = None if key is None else self.ring.latest(key)
+        if s is None:
+            raise IOError("no data for register 0x{:02x}:0x{:02x}".format(addr, cmd))
+        val = int(s[1])
+        return [val & 0xff, (val >> 8) & 0xff][:n]
+
+
+class RingCounter(object):
+    """
+    Pulse counter with the interface of periph.Counter which returns the
+    counts acquired by an Acquisition process.
+    """
+    def __init__(self, ring: SampleRing, key: int, name: str = ""):
+        self.ring = ring
+        self.key = key
+        self.name = name
+        self.reset()
+
+    def __str__(self):
+        return self.name
+
+    def _latest(self) -> Tuple[float, int]:
+        s = self.ring.latest(self.key)
+        return (time.time(), 0) if s is None else (s[0], int(s[1]))
+
+    def reset(self):
+        self.t0, self.base = self._latest()
+
+    def read(self) -> Tuple[int, float]:
+        """
+        Return a tuple of the transition count and elapsed time.
+        """
+        t, count = self._latest()
+        return count - self.base, max(t - self.t0, 0.)
+
+
+class Acquisition(object):
+    """
+    Class to run sensor reads in a child process. This class is a
+    Context Manager which starts the process on entry and stops it on
+    exit.
+    """
+    def __init__(self, rate: float,
+                 adc: Optional[Callable[[], Any]] = None,
+                 adc_chans: Sequence[Tuple[int, float]] = (),
+                 smbus: Optional[Callable[[int], Any]] = None,
+                 smbus_reads: Sequence[Tuple[int, int, int]] = (),
+                 smbus_interval: float = 10.,
+                 counters: Sequence[int] = (),
+                 size: int = 4096,
+                 rt: Optional[RtPolicy] = None):
+        """
+        :param rate: A/D and counter sampling rate in Hz
+        :param adc: function to create the A/D converter
+        :param adc_chans: A/D channels to sample as (channel, gain) tuples
+        :param smbus: function to create the SMBus interface for a bus number
+        :param smbus_reads: 16-bit registers to read as (bus, address,
+                            command) tuples
+        :param smbus_interval: register read interval in seconds
+        :param counters: GPIO lines of the pulse counters
+        :param size: ring buffer size in records
+        :param rt: CPU affinity and priority of the process, defaults to
+                   the edna.rt sampling thread policy
+
+        The device functions are called in the child process so they,
+        like the rest of the arguments, must be picklable.
+        """
+        self.logger = logging.getLogger("edna.acq")
+        self.adc_chans = tuple(adc_chans)
+        self.smbus_reads = tuple(smbus_reads)
+        self.counters = tuple(counters)
+        self.ring = SampleRing(channels=len(self.adc_chans) + len(self.smbus_reads) +
+                               len(self.counters), size=size)
+        # The process is spawned rather than forked because the main
+        # process may already be running other threads.
+        ctx = multiprocessing.get_context("spawn")
+        self.stopev = ctx.Event()
+        self.proc = ctx.Process(target=_acquire,
+                                args=(self.ring.name, rate, adc, self.adc_chans,
+                                      smbus, self.smbus_reads, smbus_interval,
+                                      self.counters, rt or get_policy(),
+                                      self.stopev),
+                                name="edna-acq",
+                                daemon=True)
+
+    def start(self, timeout: float = 10.):
+        """
+        Start the acquisition process and wait for the first A/D samples.
+        """
+        self.proc.start()
+        t_end = time.monotonic() + timeout
+        while any(self.ring.latest(key) is None for key in range(len(self.adc_chans))):
+            if not self.proc.is_alive() or time.monotonic() > t_end:
+                self.stop()
+                raise RuntimeError("acquisition process did not start")
+            time.sleep(0.01)
+        self.logger.info("Acquisition process started; pid = %d", self.proc.pid)
+
+    def stop(self):
+        """
+        Stop the acquisition process.
+        """
+        if self.proc.pid is not None and self.proc.exitcode is None:
+            self.stopev.set()
+            self.proc.join(timeout=2)
+            if self.proc.exitcode is None:
+                self.proc.terminate()
+                self.proc.join()
+            self.logger.info("Acquisition process stopped; %s",
+                             " ".join("{}={}".format(k, v)
+                                      for k, v in self.stats().items()))
+
+    def close(self):
+        """
+        Stop the process and release the shared memory.
+        """
+        self.stop()
+        self.ring.close()
+
+    def adc(self) -> RingAdc:
+        """
+        Return the A/D converter interface.
+        """
+        return RingAdc(self.ring, dict((chan, key)
+                                       for key, (chan, gain) in enumerate(self.adc_chans)))
+
+    def smbus(self, bus: int) -> RingSMBus:
+        """
+        Return the SMBus interface for a bus number.
+        """
+        k = len(self.adc_chans)
+        return RingSMBus(self.ring, dict(((addr, cmd), key)
+                                         for key, (b, addr, cmd) in enumerate(self.smbus_reads, k)
+                                         if b == bus))
+
+    def counter(self, line: int) -> RingCounter:
+        """
+        Return the pulse counter for a GPIO line.
+        """
+        k = len(self.adc_chans) + len(self.smbus_reads)
+        return RingCounter(self.ring, k + self.counters.index(line),
+                           name="Counter({:d})".format(line))
+
+    def stats(self) -> Mapping[str, Any]:
+        """
+        Return the number of samples and the timing statistics of the
+        acquisition loop.
+        """
+        missed, late_max = self.ring.timing()
+        return OrderedDict(samples=self.ring.count,
+                           missed=missed,
+                           late_max=late_max/1e9)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.close()
+        # Allow exceptions to propogate out
+        return False
+
+
+def battery_reads(buses: Sequence[int],
+                  regs: Sequence[str] = ()) -> List[Tuple[int, int, int]]:
+    """
+    Return the Smart Battery registers read by periph.Battery for each
+    bus, and the extra registers named in regs, in the form of the
+    Acquisition smbus_reads argument.
+    """
+    cmds = list(periph.Battery.msgs.values())
+    for name in regs:
+        cmd = periph.Battery.registers[name].cmd
+        if cmd not in cmds:
+            cmds.append(cmd)
+    return [(bus, periph.Battery.bus_addr, cmd)
+            for bus in buses for cmd in cmds]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Convert a binary eDNA data file to newline-delimited JSON.
+"""
+import sys
+import argparse
+from edna.binrec import to_ndjson, FormatError
+
+
+def parse_cmdline() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert a binary eDNA data file to NDJSON")
+    parser.add_argument("infile", metavar="FILE",
+                        type=argparse.FileType("rb"),
+                        help="binary data file")
+    parser.add_argument("--out", metavar="FILE",
+                        type=argparse.FileType("w"),
+                        default=sys.stdout,
+                        help="output file (default: standard output)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_cmdline()
+    try:
+        n = to_ndjson(args.infile, args.out)
+    except FormatError as e:
+        print("{}: {}".format(args.infile.name, str(e)), file=sys.stderr)
+        return 1
+    print("{:d} records converted".format(n), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Export eDNA data records to CSV. From each eDNA data file, deployment
+directory or OUTBOX archive, the following CSV files are produced:
+
+   - sample_$ID.csv
+   - result_$ID.csv
+   - depth_$ID.csv
+   - battery_$ID.csv
+
+Each input is read exactly once, archives are read in place without
+unpacking them to disk.
+"""
+import sys
+import os
+import os.path
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, List, Any, Tuple
+from edna.archive import records, deployment_id
+
+
+# CSV columns for each record type
+COLUMNS: Dict[str, List[str]] = {
+    "sample": ["time", "sample", "elapsed", "amount", "pr", "depth"],
+    "result": ["time", "sample", "elapsed", "vwater", "vethanol",
+               "overpressure", "deptherror"],
+    "battery": ["time", "battery", "voltage", "current", "soc"],
+    "depth": ["time", "depth"]
+}
+
+
+def value(x: Any) -> Any:
+    if isinstance(x, bool):
+        return "true" if x else "false"
+    return x
+
+
+def export(path: str, outdir: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Export the records from a single input to CSV files in outdir and
+    return the deployment ID and the number of rows in each file.
+    """
+    id = deployment_id(path)
+    counts = dict.fromkeys(COLUMNS, 0)
+    with ExitStack() as stack:
+        writers = dict()
+        for kind, cols in COLUMNS.items():
+            name = os.path.join(outdir, "{}_{}.csv".format(kind, id))
+            f = stack.enter_context(open(name, "w", newline=""))
+            writers[kind] = csv.writer(f)
+            writers[kind].writerow(cols)
+
+        for t, event, data in records(path):
+            kind, sep, index = event.partition(".")
+            if kind == "sample":
+                row = [t, index, data["elapsed"], data["amount"],
+                       data["pr"], data["depth"]]
+            elif kind == "result":
+                row = [t, index, data["elapsed"], data["vwater"],
+                       data.get("vethanol"), data["overpressure"],
+                       data.get("deptherror", False)]
+            elif kind == "depth":
+                row = [t, data["depth"]]
+            else:
+                kind, sep, index = event.partition("-")
+                if kind != "battery":
+                    continue
+                row = [t, index, data["v"], data["a"], data["soc"]]
+            writers[kind].writerow([value(x) for x in row])
+            counts[kind] += 1
+    return id, counts
+
+
+def parse_cmdline() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export eDNA data records to CSV")
+    parser.add_argument("infile", metavar="FILE",
+                        nargs="+",
+                        help="data file, deployment directory or OUTBOX archive")
+    parser.add_argument("--outdir", metavar="DIR",
+                        default=os.curdir,
+                        help="directory for the CSV files (default: current directory)")
+    parser.add_argument("--jobs", metavar="N",
+                        type=int,
+                        default=1,
+                        help="number of inputs to process in parallel (default: %(default)d)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_cmdline()
+    os.makedirs(args.outdir, exist_ok=True)
+    status = 0
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures = [(path, pool.submit(export, path, args.outdir))
+                   for path in args.infile]
+        for path, fut in futures:
+            try:
+                id, counts = fut.result()
+            except Exception as e:
+                print("{}: {}".format(path, str(e)), file=sys.stderr)
+                status = 1
+                continue
+            print("{}: {}".format(id, " ".join("{}={:d}".format(k, v)
+                                               for k, v in counts.items())),
+                  file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
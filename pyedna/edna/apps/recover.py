@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Validate the segments of one or more eDNA deployment directories and
+join the valid segments into a single NDJSON data file.
+"""
+import sys
+import os
+import os.path
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from edna.archive import deployment_id
+from edna.segment import segments, recover, SegmentStatus
+
+
+def join(path: str, outdir: str) -> Tuple[str, List[SegmentStatus]]:
+    """
+    Recover the data from the segments in a deployment directory and
+    return the output file name and the status of each segment.
+    """
+    names = segments(path)
+    if not names:
+        raise ValueError("no data segments found")
+    outfile = os.path.join(outdir, "edna_" + deployment_id(path) + ".ndjson")
+    with open(outfile, "wb") as out:
+        status = recover(names, out)
+    return outfile, status
+
+
+def parse_cmdline() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Recover segmented eDNA data files")
+    parser.add_argument("dirs", metavar="DIR",
+                        nargs="+",
+                        help="deployment directory")
+    parser.add_argument("--outdir", metavar="DIR",
+                        default=os.curdir,
+                        help="directory for the recovered files (default: current directory)")
+    parser.add_argument("--jobs", metavar="N",
+                        type=int,
+                        default=1,
+                        help="number of directories to process in parallel (default: %(default)d)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_cmdline()
+    os.makedirs(args.outdir, exist_ok=True)
+    status = 0
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures = [(path, pool.submit(join, path, args.outdir))
+                   for path in args.dirs]
+        for path, fut in futures:
+            try:
+                outfile, segs = fut.result()
+            except Exception as e:
+                print("{}: {}".format(path, str(e)), file=sys.stderr)
+                status = 1
+                continue
+            for seg in segs:
+                if not seg.ok:
+                    state = "CORRUPT, skipped"
+                    status = 1
+                elif not seg.complete:
+                    state = "unterminated, recovered"
+                else:
+                    state = "ok"
+                print("{}: {:d} records; {}".format(seg.name, seg.records, state),
+                      file=sys.stderr)
+            print("{}: {:d} records".format(outfile,
+                                            sum(s.records for s in segs if s.ok)),
+                  file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
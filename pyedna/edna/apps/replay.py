@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded eDNA deployment through the sampling code and
+compare the results with the recorded samples.
+"""
+import sys
+import argparse
+import logging
+from edna.config import Config
+from edna.sample import Datafile
+from edna.replay import Recording, Replay, load_config
+
+
+def parse_cmdline() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay an eDNA deployment")
+    parser.add_argument("path", metavar="PATH",
+                        help="deployment directory, OUTBOX archive or data file")
+    parser.add_argument("--cfg", metavar="FILE",
+                        help="configuration file (default: the deployment deploy.cfg)")
+    parser.add_argument("--speed", metavar="X",
+                        type=float,
+                        default=0.,
+                        help="run X times faster than real time (default: simulate time)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the replayed records to an NDJSON file")
+    parser.add_argument("--debug", action="store_true",
+                        help="log the sampling sequence")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_cmdline()
+    logging.basicConfig(level=logging.INFO if args.debug else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        cfg = Config(args.cfg) if args.cfg else load_config(args.path)
+        rec = Recording(args.path)
+    except Exception as e:
+        print("{}: {}".format(args.path, str(e)), file=sys.stderr)
+        return 1
+
+    replay = Replay(rec, cfg, speed=args.speed)
+    if args.output:
+        with open(args.output, "w") as f:
+            results = replay.run(Datafile(f))
+    else:
+        results = replay.run()
+
+    recorded = set(s.index for s in rec.samples)
+    for r in results:
+        s = rec.sample(r.index)
+        print("sample {:d}: depth={:.2f} amount={:.3f} overpressure={} deptherror={}"
+              " (recorded: {})".format(r.index, r.depth, r.amount, r.overpressure,
+                                       r.outofrange,
+                                       "depth={:.2f} amount={:.3f}".format(s.depth, s.amount)
+                                       if s else "none"))
+    return 0 if len(results) == len(recorded) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
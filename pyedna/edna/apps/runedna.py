@@ -8,10 +8,11 @@ import os.path
 import argparse
 import logging
 import datetime
-import tarfile
 import signal
-from typing import Callable, Tuple, NamedTuple
+import asyncio
+from typing import Callable, List, Tuple, NamedTuple, Optional
 from functools import partial
+from contextlib import ExitStack
 # Mock some of the RPi specific packages for local
 # integration testing.
 try:
@@ -28,10 +29,23 @@ try:
 except ImportError:
     from edna.mocksmbus import SMBus
 from edna import __version__
-from edna.sample import Datafile, FlowLimits, collect, seekdepth
+from edna.sample import Datafile, BufferedDatafile, FlushPolicy, \
+    FlowLimits, collect, seekdepth
 from edna.periph import Valve, Pump, AnalogFlowMeter, LED, \
-    Battery, PrSensor, psi_to_dbar, blinker
+    Battery, BatteryMonitor, PrSensor, AdcArbiter, psi_to_dbar, blinker
+import edna.asample as asample
+from edna.binrec import BinaryDatafile
+from edna.compress import writers as block_writers
+from edna.segment import SegmentedFile
+from edna.archive import ArchiveWriter
 from edna.config import Config, BadEntry
+from edna.clock import ScaledClock, SimClock, set_clock
+from edna.timing import COALESCE, POLICIES
+from edna.sched import Scheduler
+from edna.acq import Acquisition, battery_reads
+from edna.rt import RtPolicy, set_policy
+from edna.energy import EnergyAccountant
+import edna.mockgpio as mockgpio
 from edna.ema import EMA
 
 
@@ -98,6 +112,13 @@ def parse_cmdline() -> argparse.Namespace:
     parser.add_argument("--alpha", type=float,
                         default=0.22,
                         help="moving-average filter coefficient (default: %(default)f)")
+    parser.add_argument("--format", choices=("ndjson", "binary"),
+                        help="data file format (default: DataFile/Format or ndjson)")
+    parser.add_argument("--speed", metavar="X",
+                        type=float,
+                        default=1.,
+                        help="run X times faster than real time, 0 simulates time "
+                        "(for testing with mock hardware only)")
     return parser.parse_args()
 
 
@@ -121,10 +142,168 @@ def init_logging(datadir: str, id: str, debug: bool = False):
     logger.addHandler(ch)
 
 
+def data_format(cfg: Config, args: argparse.Namespace) -> str:
+    """
+    Return the data file format, the command-line overrides the
+    configuration.
+    """
+    fmt = args.format or cfg.get_string("DataFile", "Format", "ndjson").lower()
+    if fmt not in ("ndjson", "binary"):
+        raise BadEntry("DataFile/Format", "must be ndjson or binary")
+    return fmt
+
+
+def data_compression(cfg: Config) -> str:
+    """
+    Return the data file compression method or an empty string if the
+    data file is not compressed.
+    """
+    method = cfg.get_string("DataFile", "Compress", "none").lower()
+    if method == "none":
+        return ""
+    if method not in block_writers:
+        raise BadEntry("DataFile/Compress",
+                       "must be none, " + " or ".join(block_writers))
+    return method
+
+
+def rt_policy(cfg: Config) -> Optional[RtPolicy]:
+    """
+    Return the CPU affinity and real-time priority of the sampling
+    threads from the optional Acquisition section of the configuration,
+    None if neither is set.
+    """
+    try:
+        cpus = tuple(int(c) for c in cfg.get_list("Acquisition", "Cpus", []))
+    except ValueError:
+        raise BadEntry("Acquisition/Cpus", "must be a list of CPU numbers")
+    priority = cfg.get_int("Acquisition", "RtPriority", 0)
+    if not 0 <= priority <= 99:
+        raise BadEntry("Acquisition/RtPriority", "must be between 0 and 99")
+    if not cpus and priority == 0:
+        return None
+    return RtPolicy(cpus=cpus, priority=priority)
+
+
+def battery_registers(cfg: Config) -> List[str]:
+    """
+    Return the extra Smart Battery registers to log, from the optional
+    Battery section of the configuration.
+    """
+    regs = cfg.get_list("Battery", "Registers", [])
+    for name in regs:
+        if name not in Battery.registers:
+            raise BadEntry("Battery/Registers",
+                           "unknown register '{}'".format(name))
+    return regs
+
+
+def open_datafile(cfg: Config, stack: ExitStack, path: str,
+                  fmt: str = "ndjson", compress: str = "",
+                  onclose: Optional[Callable[[str], None]] = None) -> Datafile:
+    """
+    Create the deployment Datafile using the settings from the optional
+    DataFile section of the configuration. Path is the file name without
+    the format suffix. The files are closed when the stack exits and, if
+    onclose is specified, it is called with the name of each file after
+    it is closed.
+    """
+    logger = logging.getLogger()
+
+    def open_file(name: str, mode: str):
+        if onclose is not None:
+            stack.callback(onclose, name)
+        return stack.enter_context(open(name, mode))
+
+    segsize = cfg.get_float("DataFile", "SegmentSize", 0)
+    segtime = cfg.get_float("DataFile", "SegmentTime", 0)
+    segmented = segsize > 0 or segtime > 0
+    if segmented and (compress or fmt == "binary"):
+        logger.warning("Only uncompressed NDJSON data files can be segmented")
+        segmented = False
+
+    base = path
+    path += ".bin" if fmt == "binary" else ".ndjson"
+    if compress:
+        writer = block_writers[compress]
+        raw = open_file(path + writer.suffix, "wb")
+        fp = writer(raw, blocksize=cfg.get_int("DataFile", "BlockSize", 65536))
+        stack.callback(fp.close)
+    elif segmented:
+        fp = SegmentedFile(base, maxbytes=int(segsize*1e6), maxage=segtime*60,
+                           callback=onclose)
+        stack.callback(fp.close)
+    elif fmt == "binary":
+        fp = open_file(path, "wb")
+    else:
+        fp = open_file(path, "w")
+
+    if fmt == "binary":
+        df = BinaryDatafile(fp)
+    else:
+        index = None
+        if cfg.get_bool("DataFile", "Index"):
+            if compress or segmented:
+                logger.warning("Compressed or segmented data files are not indexed")
+            else:
+                index = open_file(path + ".idx", "w")
+        df = Datafile(fp, index=index)
+    if not cfg.get_bool("DataFile", "Buffered"):
+        return df
+    defaults = FlushPolicy()
+    policy = FlushPolicy(
+        records=cfg.get_int("DataFile", "FlushRecords", defaults.records),
+        interval=cfg.get_float("DataFile", "FlushInterval", defaults.interval),
+        events=tuple(cfg.get_list("DataFile", "SyncEvents",
+                                  list(defaults.events))),
+        sync=cfg.get_bool("DataFile", "Sync"))
+    return BufferedDatafile(df,
+                            maxsize=cfg.get_int("DataFile", "QueueSize", 1024),
+                            policy=policy)
+
+
+def flow_adc(cfg: Config) -> Optional[Tuple[int, int]]:
+    """
+    Return the I2C address and bus of the flow sensor ADC, from the
+    optional AnalogFlowSensor Addr and Bus entries, or None if the flow
+    sensor shares the ADC of the pressure sensors.
+    """
+    main = (cfg.get_int('Adc', 'Addr'), cfg.get_int('Adc', 'Bus'))
+    addr = (cfg.get_int('AnalogFlowSensor', 'Addr', main[0]),
+            cfg.get_int('AnalogFlowSensor', 'Bus', main[1]))
+    return None if addr == main else addr
+
+
+def start_acquisition(cfg: Config) -> Acquisition:
+    """
+    Start a process to read the A/D channels and the batteries using the
+    settings from the optional Acquisition section of the configuration.
+    """
+    keys = ['Pressure.Filter', 'Pressure.Env']
+    if flow_adc(cfg) is None:
+        keys.append('AnalogFlowSensor')
+    chans = [(cfg.get_int(key, 'Chan'), cfg.get_expr(key, 'Gain'))
+             for key in keys]
+    acq = Acquisition(cfg.get_float('Acquisition', 'Rate', 20.),
+                      adc=partial(ADS1115,
+                                  address=cfg.get_int('Adc', 'Addr'),
+                                  busnum=cfg.get_int('Adc', 'Bus')),
+                      adc_chans=chans,
+                      smbus=SMBus,
+                      smbus_reads=battery_reads([0, 1], battery_registers(cfg)),
+                      smbus_interval=cfg.get_float('Acquisition', 'BatteryInterval', 10.))
+    acq.start()
+    return acq
+
+
 def runedna(cfg: Config,
             deployment: Deployment,
             df: Datafile,
-            prfilt: Callable[[float], float]) -> bool:
+            prfilt: Callable[[float], float],
+            sched: Optional[Scheduler] = None,
+            acq: Optional[Acquisition] = None,
+            arbiter: Optional[AdcArbiter] = None,
+            monitor: Optional[BatteryMonitor] = None) -> bool:
     logger = logging.getLogger()
     logger.info("Starting deployment: %s", deployment.id)
 
@@ -138,8 +317,13 @@ def runedna(cfg: Config,
     # Extract parameters from configuration files
     try:
         pr = dict()
-        adc = ADS1115(address=cfg.get_int('Adc', 'Addr'),
-                      busnum=cfg.get_int('Adc', 'Bus'))
+        if acq is not None:
+            adc = acq.adc()
+        elif arbiter is not None:
+            adc = arbiter
+        else:
+            adc = ADS1115(address=cfg.get_int('Adc', 'Addr'),
+                          busnum=cfg.get_int('Adc', 'Bus'))
         pr["Filter"] = PrSensor(adc,
                                 cfg.get_int('Pressure.Filter', 'Chan'),
                                 cfg.get_expr('Pressure.Filter', 'Gain'),
@@ -174,12 +358,29 @@ def runedna(cfg: Config,
                                 lopen=cfg.get_string(vkey, 'open'),
                                 lclose=cfg.get_string(vkey, 'close'))
 
-        fm = AnalogFlowMeter(adc,
+        rdy = cfg.get_int('AnalogFlowSensor', 'ReadyGPIO', 0)
+        data_rate = cfg.get_int('AnalogFlowSensor', 'DataRate', 128)
+        fm_addr = flow_adc(cfg)
+        if rdy and fm_addr is None:
+            # Continuous conversions stop when the pressure sensors make a
+            # single-shot read of the same chip.
+            logger.warning("ALERT/RDY sampling needs the flow sensor on its own "
+                           "ADC (AnalogFlowSensor/Addr); sampling on a timer")
+            rdy = 0
+        if rdy and GPIO is mockgpio:
+            # Simulated ALERT/RDY rate when testing with mock hardware
+            mockgpio.edge_freq[rdy] = data_rate
+        if fm_addr is not None:
+            fm_adc = ADS1115(address=fm_addr[0], busnum=fm_addr[1])
+        else:
+            fm_adc = adc
+        fm = AnalogFlowMeter(fm_adc,
                              cfg.get_int('AnalogFlowSensor', 'Chan'),
                              cfg.get_expr('AnalogFlowSensor', 'Gain'),
-                             cfg.get_array('AnalogFlowSensor', 'Coeff'))
+                             cfg.get_array('AnalogFlowSensor', 'Coeff'),
+                             sched=sched, rdy=rdy, data_rate=data_rate)
         sample_rate = cfg.get_float('FlowSensor', 'Rate')
-        ledctl = LedCtl(obj=LED(cfg.get_int("LED", "GPIO")),
+        ledctl = LedCtl(obj=LED(cfg.get_int("LED", "GPIO"), sched=sched),
                         fast=cfg.get_float("LED", "fast"),
                         slow=cfg.get_float("LED", "slow"),
                         fade=cfg.get_float("LED", "fade"))
@@ -194,6 +395,11 @@ def runedna(cfg: Config,
         deployment.pr_rate = cfg.get_float('Deployment', 'PrRate')
         deployment.seek_time = cfg.get_int('Deployment', 'SeekTime')
         deployment.downcast = cfg.get_bool('Deployment', 'Downcast')
+        catchup = cfg.get_string('Timing', 'CatchUp', COALESCE).lower()
+        if catchup not in POLICIES:
+            raise BadEntry('Timing/CatchUp', "must be " + ", ".join(POLICIES))
+        trace = cfg.get_bool('Timing', 'Trace')
+        blog = cfg.get_float('Battery', 'LogInterval', 0.)
 
         # Each entry in depths is a tuple containing the depth and
         # the sample index.
@@ -205,37 +411,115 @@ def runedna(cfg: Config,
         return False
 
     try:
-        batteries = [Battery(SMBus(0)), Battery(SMBus(1))]
+        regs = battery_registers(cfg)
+        if acq is not None:
+            batteries = [Battery(acq.smbus(0), regs), Battery(acq.smbus(1), regs)]
+        elif monitor is not None:
+            batteries = monitor.batteries()
+        else:
+            batteries = [Battery(SMBus(0), regs), Battery(SMBus(1), regs)]
     except Exception:
         logger.exception("Battery monitoring disabled")
         batteries = []
 
     # Samples are collected in depth order, not index order.
     depths.sort(key=lambda e: e[0], reverse=not deployment.downcast)
-    for target, index in depths:
-        logger.info("Seeking depth for sample %d; %.2f +/- %.2f",
-                    index, target, deployment.seek_err)
-        drange = (target-deployment.seek_err, target+deployment.seek_err)
-        with blinker(ledctl.obj, ledctl.slow):
-            depth, status = seekdepth(df,
-                                      partial(checkdepth, drange),
-                                      deployment.pr_rate,
-                                      deployment.seek_time)
-        if not status:
-            logger.critical("Depth seek time limit expired. Aborting.")
-            return False
-
-        logger.info("Collecting sample %d", index)
-        drange = (depth-deployment.depth_err, depth+deployment.depth_err)
-        status = collect(df, index,
-                         (pumps["Sample"], pumps["Ethanol"]),
-                         valves,
-                         fm, sample_rate,
-                         (limits["Sample"], limits["Ethanol"]),
-                         checkpr,
-                         partial(checkdepth, drange), batteries)
-
-    return True
+
+    acct = None
+    if batteries and cfg.get_bool('Battery', 'Energy'):
+        # Account for the battery energy used by each phase
+        acct = EnergyAccountant(batteries,
+                                cfg.get_float('Battery', 'Interval', 10.),
+                                sched=sched)
+    setphase = acct.set_phase if acct is not None else (lambda name: None)
+
+    async def arun() -> bool:
+        # Same sequence as run, on the event loop
+        for target, index in depths:
+            logger.info("Seeking depth for sample %d; %.2f +/- %.2f",
+                        index, target, deployment.seek_err)
+            drange = (target-deployment.seek_err, target+deployment.seek_err)
+            setphase("seek")
+            with blinker(ledctl.obj, ledctl.slow):
+                depth, status = await asample.seekdepth(df,
+                                                        partial(checkdepth, drange),
+                                                        deployment.pr_rate,
+                                                        deployment.seek_time,
+                                                        batteries,
+                                                        catchup=catchup,
+                                                        trace=trace,
+                                                        blog=blog)
+            if not status:
+                logger.critical("Depth seek time limit expired. Aborting.")
+                return False
+
+            logger.info("Collecting sample %d", index)
+            drange = (depth-deployment.depth_err, depth+deployment.depth_err)
+            await asample.collect(df, index,
+                                  (pumps["Sample"], pumps["Ethanol"]),
+                                  valves,
+                                  fm, sample_rate,
+                                  (limits["Sample"], limits["Ethanol"]),
+                                  checkpr,
+                                  partial(checkdepth, drange), batteries,
+                                  catchup=catchup,
+                                  trace=trace,
+                                  blog=blog,
+                                  phase=setphase)
+            if acct is not None:
+                await asample.offload(acct.update)
+                acct.write(df, "energy."+str(index), since_mark=True)
+        return True
+
+    def run() -> bool:
+        for target, index in depths:
+            logger.info("Seeking depth for sample %d; %.2f +/- %.2f",
+                        index, target, deployment.seek_err)
+            drange = (target-deployment.seek_err, target+deployment.seek_err)
+            setphase("seek")
+            with blinker(ledctl.obj, ledctl.slow):
+                depth, status = seekdepth(df,
+                                          partial(checkdepth, drange),
+                                          deployment.pr_rate,
+                                          deployment.seek_time,
+                                          batteries,
+                                          catchup=catchup,
+                                          trace=trace,
+                                          blog=blog)
+            if not status:
+                logger.critical("Depth seek time limit expired. Aborting.")
+                return False
+
+            logger.info("Collecting sample %d", index)
+            drange = (depth-deployment.depth_err, depth+deployment.depth_err)
+            status = collect(df, index,
+                             (pumps["Sample"], pumps["Ethanol"]),
+                             valves,
+                             fm, sample_rate,
+                             (limits["Sample"], limits["Ethanol"]),
+                             checkpr,
+                             partial(checkdepth, drange), batteries,
+                             catchup=catchup,
+                             trace=trace,
+                             blog=blog,
+                             phase=setphase)
+            if acct is not None:
+                acct.update()
+                acct.write(df, "energy."+str(index), since_mark=True)
+        return True
+
+    if acct is not None:
+        acct.start()
+    try:
+        if cfg.get_bool('Timing', 'Async'):
+            logger.info("Using the asyncio sampling engine")
+            return asyncio.run(arun())
+        return run()
+    finally:
+        if acct is not None:
+            setphase("idle")
+            acct.stop()
+            acct.write(df, "energy.deployment")
 
 
 def main() -> int:
@@ -259,6 +543,23 @@ def main() -> int:
         print("Missing configuration entries: {}".format(";".join(missing)))
         return 1
 
+    if args.speed < 0:
+        print("Invalid speed: {}".format(args.speed), file=sys.stderr)
+        return 1
+    if args.speed == 0:
+        set_clock(SimClock())
+    elif args.speed != 1:
+        set_clock(ScaledClock(args.speed))
+
+    try:
+        fmt = data_format(cfg, args)
+        compress = data_compression(cfg)
+        policy = rt_policy(cfg)
+        regs = battery_registers(cfg)
+    except BadEntry as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
     # Generate deployment ID and directory name
     id = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
     dir = os.path.join(args.datadir, "edna_" + id)
@@ -268,19 +569,36 @@ def main() -> int:
     os.makedirs(deployment.dir, exist_ok=True)
     # Initialize logging
     init_logging(deployment.dir, deployment.id, debug=args.debug)
+    logger = logging.getLogger()
+
+    # The deployment archive is built in the OUTBOX as each file
+    # is completed.
+    os.makedirs(args.outbox, exist_ok=True)
+    arpath = os.path.join(args.outbox, "edna_" + deployment.id + ".tar.gz")
+    logger.info("Archiving deployment directory to %s", arpath)
+    archive = ArchiveWriter(arpath, os.path.basename(deployment.dir))
+
+    if policy is not None:
+        logger.info("Sampling thread policy: cpus=%s priority=%d",
+                    ",".join(str(c) for c in policy.cpus) or "any", policy.priority)
+        set_policy(policy)
+
     # Save configuration to deployment directory
-    with open(os.path.join(deployment.dir, "deploy.cfg"), "w") as fp:
+    cfgfile = os.path.join(deployment.dir, "deploy.cfg")
+    with open(cfgfile, "w") as fp:
         cfg.write(fp)
+    archive.add(cfgfile)
 
     # Save deployment ID if specified
     if args.id != "":
-        with open(os.path.join(deployment.dir, "id"), "w") as fp:
+        idfile = os.path.join(deployment.dir, "id")
+        with open(idfile, "w") as fp:
             print(args.id, file=fp)
+        archive.add(idfile)
 
     signal.signal(signal.SIGINT, abort)
     signal.signal(signal.SIGTERM, abort)
 
-    logger = logging.getLogger()
     # eDNA uses the Broadcom SOC pin numbering scheme
     GPIO.setmode(GPIO.BCM)
     # If we don't suppress warnings, a message will be printed to stderr
@@ -296,20 +614,70 @@ def main() -> int:
 
     status = False
     try:
-        name = "edna_" + deployment.id + ".ndjson"
-        with open(os.path.join(deployment.dir, name), "w") as fp:
-            status = runedna(cfg, deployment, Datafile(fp), prfilt)
+        path = os.path.join(deployment.dir, "edna_" + deployment.id)
+        with ExitStack() as stack:
+            df = open_datafile(cfg, stack, path, fmt, compress,
+                               onclose=archive.add)
+            sched = None
+            if cfg.get_bool("Timing", "Scheduler"):
+                # Run the periodic peripheral tasks from a single thread
+                sched = stack.enter_context(Scheduler())
+                if GPIO is mockgpio:
+                    # Run the simulated GPIO edges from the scheduler too
+                    mockgpio.scheduler = sched
+            acq = None
+            if cfg.get_bool("Acquisition", "Process"):
+                if args.speed != 1:
+                    logger.warning("The acquisition process runs in real time only")
+                else:
+                    try:
+                        acq = start_acquisition(cfg)
+                        stack.callback(acq.close)
+                    except Exception:
+                        logger.exception("Cannot start the acquisition process")
+            arbiter = None
+            if cfg.get_bool("Adc", "Arbiter") and acq is None:
+                # Share the ADC between the pressure sensors and the
+                # flow meter
+                arbiter = stack.enter_context(
+                    AdcArbiter(ADS1115(address=cfg.get_int('Adc', 'Addr'),
+                                       busnum=cfg.get_int('Adc', 'Bus')),
+                               cfg.get_float('Adc', 'Rate', 60.), sched=sched))
+            monitor = None
+            if cfg.get_bool("Battery", "Monitor") and acq is None:
+                # Poll the batteries in the background and log the
+                # cached values
+                try:
+                    monitor = stack.enter_context(
+                        BatteryMonitor([Battery(SMBus(0), regs),
+                                        Battery(SMBus(1), regs)],
+                                       cfg.get_float('Battery', 'Interval', 10.),
+                                       sched=sched))
+                except Exception:
+                    logger.exception("Cannot start the battery monitor")
+            try:
+                status = runedna(cfg, deployment, df, prfilt, sched=sched, acq=acq,
+                                 arbiter=arbiter, monitor=monitor)
+            finally:
+                df.close()
+                if isinstance(df, BufferedDatafile):
+                    logger.info("Data file statistics: %s",
+                                " ".join("{}={}".format(k, v)
+                                         for k, v in df.stats().items()))
+                if sched is not None:
+                    for st in sched.stats():
+                        logger.info("Task statistics: %s",
+                                    " ".join("{}={}".format(k, v)
+                                             for k, v in st.items()))
     except Exception:
         logger.exception("Deployment aborted with an exception")
 
-    os.makedirs(args.outbox, exist_ok=True)
-    # Archive the deployment directory to the OUTBOX
-    arpath = os.path.join(args.outbox, "edna_" + deployment.id + ".tar.gz")
-    logger.info("Archiving deployment directory to %s", arpath)
-    with tarfile.open(arpath, "w:gz") as tar:
-        head, tail = os.path.split(deployment.dir)
-        os.chdir(head)
-        tar.add(tail)
+    # Finish the archive with the deployment log
+    logger.info("Closing archive %s", arpath)
+    for h in logger.handlers:
+        h.flush()
+    archive.add(os.path.join(deployment.dir, "edna_" + deployment.id + ".log"))
+    archive.close()
 
     if args.clean:
         GPIO.cleanup()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.archive
+     :platform: any
+     :synopsis: access to deployment directories and OUTBOX archives
+"""
+from .sample import Record
+from . import binrec
+from .compress import decompressor, strip_suffix
+from typing import Iterator, List, Tuple, IO, Optional
+import gzip
+import json
+import logging
+import os
+import os.path
+import shutil
+import tarfile
+import time
+
+
+def is_datafile(name: str) -> bool:
+    """
+    Return True if name is the name of a deployment data file.
+    """
+    base = strip_suffix(os.path.basename(name))
+    return base.startswith("edna_") and base.endswith((".ndjson", ".bin"))
+
+
+def deployment_id(name: str) -> str:
+    """
+    Extract the deployment ID from a data file, directory or archive name.
+    """
+    base = os.path.basename(name.rstrip("/")).split(".")[0]
+    return base.split("_")[1] if "_" in base else base
+
+
+def datafiles(path: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """
+    Generate a (name, file) tuple for every data file in a deployment
+    directory, OUTBOX archive, or a single data file. Files are opened in
+    binary mode, compressed files are decompressed, and are closed when
+    the generator advances.
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if is_datafile(name):
+                with open(os.path.join(path, name), "rb") as fp:
+                    yield name, decompressor(name, fp)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, "r:*") as tar:
+            for member in tar:
+                if member.isfile() and is_datafile(member.name):
+                    fp = tar.extractfile(member)
+                    if fp is not None:
+                        name = os.path.basename(member.name)
+                        yield name, decompressor(name, fp)
+                        fp.close()
+    else:
+        with open(path, "rb") as fp:
+            name = os.path.basename(path)
+            yield name, decompressor(name, fp)
+
+
+def read_records(name: str, fp: IO[bytes]) -> Iterator[Tuple[str, str, Record]]:
+    """
+    Generate the (time, event, data) tuples from a data file, the format
+    is determined from the file name. The time is an ISO-8601 string.
+    Reading stops at the end of the last complete record of a truncated
+    compressed file.
+    """
+    if strip_suffix(name).endswith(".bin"):
+        for ms, event, data in binrec.read_records(fp):
+            yield binrec.format_ms(ms), event, data
+    else:
+        lines = iter(fp)
+        while True:
+            try:
+                line = next(lines)
+            except (StopIteration, EOFError):
+                break
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # Skip a partial record
+                continue
+            yield rec["t"], rec["event"], rec["data"]
+
+
+def records(path: str) -> Iterator[Tuple[str, str, Record]]:
+    """
+    Generate the (time, event, data) tuples from every data file in a
+    deployment directory, OUTBOX archive, or a single data file.
+    """
+    for name, fp in datafiles(path):
+        yield from read_records(name, fp)
+
+
+class ArchiveWriter(object):
+    """
+    Class to build a deployment archive (a gzip compressed tar file)
+    incrementally. Each file is appended to the archive, as a separate
+    gzip member, as soon as it is complete so the cost of archiving is
+    spread over the deployment and the archive contains all of the
+    completed files if the deployment is interrupted. Closing the archive
+    only writes the end-of-archive marker. Files which are already
+    compressed are stored without further compression.
+    """
+    fp: Optional[IO[bytes]]
+
+    def __init__(self, path: str, root: str, compresslevel: int = 6):
+        """
+        :param path: archive file name
+        :param root: name of the top-level archive directory
+        :param compresslevel: gzip compression level
+        """
+        self.path = path
+        self.root = root
+        self.compresslevel = compresslevel
+        self.logger = logging.getLogger("edna.archive")
+        self.names: List[str] = []
+        self.fp = open(path, "wb")
+        info = tarfile.TarInfo(root)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = int(time.time())
+        self._append(info, None)
+
+    def _append(self, info: tarfile.TarInfo, src: Optional[IO[bytes]]):
+        if self.fp is None:
+            raise ValueError("ArchiveWriter is closed")
+        level = self.compresslevel
+        if strip_suffix(info.name) != info.name:
+            level = 0
+        with gzip.GzipFile(fileobj=self.fp, mode="wb", compresslevel=level,
+                           mtime=info.mtime) as z:
+            z.write(info.tobuf(tarfile.DEFAULT_FORMAT, "utf-8", "surrogateescape"))
+            if src is not None:
+                shutil.copyfileobj(src, z)
+                remainder = info.size % tarfile.BLOCKSIZE
+                if remainder:
+                    z.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def add(self, name: str, arcname: str = ""):
+        """
+        Append a completed file to the archive, by default it is stored
+        in the top-level directory.
+        """
+        st = os.stat(name)
+        info = tarfile.TarInfo(arcname or
+                               "/".join([self.root, os.path.basename(name)]))
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = st.st_mode & 0o777
+        with open(name, "rb") as src:
+            self._append(info, src)
+        self.names.append(info.name)
+        self.logger.info("Added %s to archive", info.name)
+
+    def close(self):
+        """
+        Write the end-of-archive marker and close the archive.
+        """
+        if self.fp is None:
+            return
+        with gzip.GzipFile(fileobj=self.fp, mode="wb", mtime=0) as z:
+            z.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        self.fp.close()
+        self.fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.close()
+        return False
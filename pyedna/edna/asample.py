@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.asample
+     :platform: any
+     :synopsis: asyncio versions of the eDNA data collection functions
+
+The coroutines in this module run the sampling sequence on a single
+event loop. Blocking I2C and GPIO operations run in the loop's default
+executor and all waits use the clock's *asleep*, so battery reads,
+including their retries, overlap with the pressure sampling rather
+than delaying the sampling tick. Other activities (telemetry, status
+LED, health checks) can be added as tasks on the same loop without
+starting more threads::
+
+    >>> depth, ok = asyncio.run(seekdepth(df, chkdepth, 1., 300.))
+
+The check functions passed to :func:`seekdepth`, :func:`flow_monitor`
+and :func:`collect` may be coroutine functions or plain functions, the
+latter are run in the executor. The data records are the same as those
+written by :mod:`edna.sample`. Records are written from the event loop
+so a :class:`edna.sample.BufferedDatafile` should be used to keep file
+I/O off the loop.
+"""
+from . import periph
+from .clock import Clock, get_clock
+from .timing import Ticker, COALESCE
+from .trace import Tracer, NullTracer
+from .sample import Datafile, FlowLimits, SampleIdx, EthanolIdx, \
+    SampleFields, BatteryFields, DepthFields, GapFields, FlowStages, \
+    DepthStages, StreamRate, register_event, sbs_fields, split_registers, \
+    report_timing, report_trace
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Callable, List, Mapping, \
+    Optional, Tuple, TypeVar
+import asyncio
+import logging
+
+
+T = TypeVar("T")
+
+# Type hint for the check functions
+Check = Callable[[], Any]
+
+
+async def offload(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Run a blocking function in the event loop's default executor and
+    return its result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args))
+
+
+def _get_clock(clock: Optional[Clock]) -> Clock:
+    # Return clock, or the default, attached to the running loop
+    clock = clock or get_clock()
+    clock.attach(asyncio.get_running_loop())
+    return clock
+
+
+def _is_async(fn: Callable) -> bool:
+    while isinstance(fn, partial):
+        fn = fn.func
+    return asyncio.iscoroutinefunction(fn)
+
+
+async def check(fn: Check) -> Tuple[float, bool]:
+    """
+    Call a check function, which returns a value and a status flag.
+    """
+    if _is_async(fn):
+        return await fn()
+    return await offload(fn)
+
+
+async def read_pr(sensor: periph.PrSensor) -> float:
+    """
+    Return the pressure sensor value in psi.
+    """
+    return await offload(sensor.read)
+
+
+async def read_battery(b: periph.Battery, tries: int = 4,
+                       clock: Optional[Clock] = None) -> Tuple[float, float, int]:
+    """
+    Return voltage, current, and state of charge from a Smart Battery. See
+    edna.sample.read_battery.
+    """
+    clock = _get_clock(clock)
+
+    async def read(fn: Callable[[], Any], default: Any) -> Any:
+        for i in range(tries):
+            try:
+                return await offload(fn)
+            except IOError:
+                await clock.asleep(0.1)
+        return default
+
+    v = await read(b.voltage, float(0))
+    a = await read(b.current, float(0))
+    soc = await read(b.charge, int(0))
+    return v, a, soc
+
+
+async def read_sbs(b: periph.Battery, tries: int = 4,
+                   clock: Optional[Clock] = None) -> \
+        Tuple[Tuple[float, float, int], Tuple[float, ...]]:
+    """
+    Return the battery-N and sbs-N values of a Smart Battery. See
+    edna.sample.read_sbs.
+    """
+    if b.regs:
+        return split_registers(b, await offload(b.read_registers, tries, clock))
+    return await read_battery(b, tries, clock=clock), ()
+
+
+async def open_valve(v: periph.Valve):
+    """
+    Open a solenoid valve.
+    """
+    await offload(v.open)
+
+
+async def close_valve(v: periph.Valve):
+    """
+    Close a solenoid valve.
+    """
+    await offload(v.close)
+
+
+@asynccontextmanager
+async def opened(v: periph.Valve) -> AsyncIterator[periph.Valve]:
+    """
+    Asynchronous context manager which keeps a valve open within the
+    context.
+    """
+    await open_valve(v)
+    try:
+        yield v
+    finally:
+        await close_valve(v)
+
+
+async def _write_batteries(df: Datafile, batts: List[periph.Battery],
+                           clock: Clock, ts: float, tr: Tracer,
+                           brate: Optional[StreamRate] = None):
+    t = tr.mark()
+    t0 = clock.time()
+    readings = await asyncio.gather(*[read_sbs(b, clock=clock) for b in batts])
+    for i, (b, (bvals, svals)) in enumerate(zip(batts, readings)):
+        df.add_values(register_event("battery-"+str(i), BatteryFields),
+                      bvals, ts=ts)
+        if b.regs:
+            df.add_values(register_event("sbs-"+str(i), sbs_fields(b.regs)),
+                          svals, ts=ts)
+    if batts:
+        tr.lap("battery", t)
+    if brate is not None:
+        brate.updated(ts, t0)
+
+
+async def flow_monitor(df: Optional[Datafile], event: str,
+                       pump: periph.Pump,
+                       fm: periph.AnalogFlowMeter,
+                       rate: float, stop: FlowLimits,
+                       checkpr: Check,
+                       checkdepth: Check,
+                       batts: List[periph.Battery] = [],
+                       clock: Optional[Clock] = None,
+                       catchup: str = COALESCE,
+                       trace: bool = False,
+                       blog: float = 0.) -> Tuple[float, float, bool, bool]:
+    """
+    Coroutine version of edna.sample.flow_monitor. The periodic battery
+    reads run in the background.
+    """
+    clock = _get_clock(clock)
+    period = 1./rate
+    overpressure, outofrange = False, False
+    m_stop = clock.monotonic() + stop.time
+    if df is not None:
+        enc = register_event(event, SampleFields)
+        genc = register_event("gap."+event, GapFields)
+    tkr = Ticker(period, clock=clock, catchup=catchup)
+    tr = Tracer(FlowStages) if trace else NullTracer()
+    brate = StreamRate(blog, clock=clock)
+    breader: Optional[asyncio.Future] = None
+    fm.reset()
+    with pump:
+        async for tick, skipped, mtick in tkr:
+            t = tr.mark()
+            amount, secs = fm.amount()
+            t = tr.lap("amount", t)
+            pr, pr_ok = await check(checkpr)
+            t = tr.lap("pr", t)
+            depth, depth_ok = await check(checkdepth)
+            t = tr.lap("depth", t)
+            if df is not None:
+                if skipped:
+                    df.add_values(genc, (skipped, period), ts=tick)
+                df.add_values(enc, (secs, amount, pr, pr_ok, depth), ts=tick)
+                tr.lap("write", t)
+                if (batts and blog > 0 and (breader is None or breader.done())
+                        and brate.ready(tick)):
+                    breader = asyncio.ensure_future(
+                        _write_batteries(df, batts, clock, tick, tr, brate))
+            if not overpressure:
+                overpressure = not pr_ok
+            if not outofrange:
+                outofrange = not depth_ok
+            if amount >= stop.amount:
+                break
+            if mtick > m_stop:
+                break
+        if breader is not None:
+            await breader
+        if df is not None:
+            await _write_batteries(df, batts, clock, tick, tr)
+
+    report_timing(df, event, rate, tkr, tick)
+    if tr:
+        report_trace(df, event, tr, tick)
+    return amount, secs, overpressure, outofrange
+
+
+async def seekdepth(df: Optional[Datafile],
+                    chkdepth: Check,
+                    rate: float,
+                    tlimit: float,
+                    batts: List[periph.Battery] = [],
+                    clock: Optional[Clock] = None,
+                    catchup: str = COALESCE,
+                    trace: bool = False,
+                    blog: float = 0.) -> Tuple[float, bool]:
+    """
+    Coroutine version of edna.sample.seekdepth. The batteries are read
+    in the background, a new read is started on each tick, once blog
+    seconds have passed since the last one, unless the previous one is
+    still running.
+    """
+    clock = _get_clock(clock)
+    m0 = clock.monotonic()
+    period = 1./rate
+    if df is not None:
+        denc = register_event("depth", DepthFields)
+        genc = register_event("gap.depth", GapFields)
+    tr = Tracer(DepthStages) if trace else NullTracer()
+    brate = StreamRate(blog, clock=clock)
+    breader: Optional[asyncio.Future] = None
+    reached = True
+    try:
+        async for tick, skipped, mtick in Ticker(period, clock=clock, catchup=catchup):
+            t = tr.mark()
+            depth, ok = await check(chkdepth)
+            t = tr.lap("depth", t)
+            if df is not None:
+                if skipped:
+                    df.add_values(genc, (skipped, period), ts=tick)
+                df.add_values(denc, (depth,), ts=tick)
+                tr.lap("write", t)
+                if (batts and (breader is None or breader.done())
+                        and brate.ready(tick)):
+                    breader = asyncio.ensure_future(
+                        _write_batteries(df, batts, clock, tick, tr, brate))
+            if ok:
+                break
+            if tlimit > 0 and (mtick - m0) > tlimit:
+                reached = False
+                break
+    finally:
+        if breader is not None:
+            await breader
+    if tr:
+        report_trace(df, "depth", tr, tick)
+    return depth, reached
+
+
+async def collect(df: Datafile, index: int,
+                  pumps: Tuple[periph.Pump, periph.Pump],
+                  valves: Mapping[str, periph.Valve],
+                  fm: periph.AnalogFlowMeter,
+                  rate: float,
+                  limits: Tuple[FlowLimits, FlowLimits],
+                  checkpr: Check,
+                  checkdepth: Check,
+                  batts: List[periph.Battery] = [],
+                  bphold: float = 5.0,
+                  clock: Optional[Clock] = None,
+                  catchup: str = COALESCE,
+                  trace: bool = False,
+                  blog: float = 0.,
+                  phase: Optional[Callable[[str], None]] = None) -> bool:
+    """
+    Coroutine version of edna.sample.collect.
+    """
+    logger = logging.getLogger("edna.sample")
+    clock = _get_clock(clock)
+    setphase = phase or (lambda name: None)
+    logger.info("Starting sample %d", index)
+    # Valve key
+    vkey = str(index)
+    setphase("sample")
+    try:
+        async with opened(valves[vkey]):
+            vwater, w_secs, w_ovp, oor = await flow_monitor(df, "sample."+str(index),
+                                                            pumps[SampleIdx],
+                                                            fm,
+                                                            rate,
+                                                            limits[SampleIdx],
+                                                            checkpr,
+                                                            checkdepth, batts,
+                                                            clock=clock,
+                                                            catchup=catchup,
+                                                            trace=trace,
+                                                            blog=blog)
+
+        if w_ovp:
+            logger.warning("Overpressure event during sample pumping")
+        if oor:
+            logger.warning("Depth out of range during sample")
+    except Exception:
+        logger.exception("Error during sample collection")
+        setphase("idle")
+        return False
+
+    setphase("ethanol")
+    async with opened(valves[vkey]):
+        async with opened(valves["Ethanol"]):
+            vethanol, e_secs, e_ovp, _ = await flow_monitor(None, "",
+                                                            pumps[EthanolIdx],
+                                                            fm,
+                                                            rate,
+                                                            limits[EthanolIdx],
+                                                            checkpr,
+                                                            lambda: (0.0, True), batts,
+                                                            clock=clock,
+                                                            catchup=catchup)
+            # Open all valves to relieve back-pressure
+            setphase("hold")
+            for key, obj in valves.items():
+                if not obj.isopened():
+                    await open_valve(obj)
+            await clock.asleep(bphold)
+            for key, obj in valves.items():
+                if (key == vkey) or (key == "Ethanol"):
+                    continue
+                await close_valve(obj)
+
+    setphase("idle")
+    if e_ovp:
+        logger.warning("Overpressure event during ethanol pumping")
+
+    df.add_record("result."+str(index),
+                  OrderedDict(elapsed=round(w_secs+e_secs, 3),
+                              vwater=round(vwater, 3),
+                              vethanol=round(vethanol, 3),
+                              overpressure=w_ovp,
+                              deptherror=oor))
+    return True
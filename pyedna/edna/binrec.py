@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.binrec
+     :platform: any
+     :synopsis: compact binary data file format
+
+A binary data file starts with an 8-byte signature followed by a series
+of frames. Every frame starts with a little-endian 16-bit tag:
+
+- tag 0 defines a schema, it is followed by a 16-bit length and a JSON
+  object describing the event name and fields of a new record tag.
+- tag 1 is a record which does not fit any schema, it is followed by a
+  32-bit length and the record encoded as a JSON object.
+- any other tag is a fixed-layout record; a 64-bit timestamp in
+  milliseconds since the epoch followed by the packed field values.
+
+Fields are stored as booleans, 64-bit integers or 32-bit integers
+holding a floating-point value in thousandths. Records are converted
+back into exactly the NDJSON text that :class:`edna.sample.Datafile`
+would have written.
+"""
+from .sample import Datafile, Record, RecordEncoder, FLOAT, BOOL
+from .clock import get_clock
+from collections import OrderedDict
+from typing import Mapping, Any, Tuple, Dict, Iterator, Optional, IO
+import datetime
+import json
+import math
+import struct
+
+
+MAGIC = b"EDNABIN1"
+
+SchemaTag: int = 0
+JsonTag: int = 1
+
+_tag = struct.Struct("<H")
+_slen = struct.Struct("<H")
+_jlen = struct.Struct("<I")
+_epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_msec = datetime.timedelta(milliseconds=1)
+
+# Field type codes
+BOOL = "?"
+INT = "q"
+MILLI = "i"
+
+
+class FormatError(Exception):
+    pass
+
+
+def timestamp_ms(ts: float = 0) -> int:
+    """
+    Convert a timestamp in seconds to milliseconds since the epoch,
+    truncated exactly as in the ISO-8601 timestamps of an NDJSON Datafile.
+    If ts is zero, the current time is used.
+    """
+    t = datetime.datetime.fromtimestamp(ts or get_clock().time(),
+                                        tz=datetime.timezone.utc)
+    return (t - _epoch) // _msec
+
+
+def format_ms(ms: int) -> str:
+    """
+    Format a timestamp in milliseconds since the epoch as ISO-8601.
+    """
+    t = _epoch + ms*_msec
+    return t.isoformat(sep='T', timespec='milliseconds')
+
+
+def _typecode(val: Any) -> Optional[str]:
+    if isinstance(val, bool):
+        return BOOL
+    if isinstance(val, int):
+        return INT
+    if isinstance(val, float):
+        return MILLI
+    return None
+
+
+class Schema(object):
+    """
+    Fixed layout of the records for one event type.
+    """
+    def __init__(self, tag: int, event: str, fields: Tuple[Tuple[str, str], ...]):
+        self.tag = tag
+        self.event = event
+        self.fields = fields
+        self.names = tuple(f[0] for f in fields)
+        self.codes = tuple(f[1] for f in fields)
+        self.st = struct.Struct("<Hq" + "".join(self.codes))
+
+    def header(self) -> bytes:
+        desc = json.dumps(OrderedDict(tag=self.tag, event=self.event,
+                                      fields=self.fields)).encode("utf-8")
+        return _tag.pack(SchemaTag) + _slen.pack(len(desc)) + desc
+
+    def pack(self, ms: int, values: Tuple[Any, ...]) -> bytes:
+        """
+        Pack a record, raises ValueError if a value cannot be stored
+        exactly.
+        """
+        packed = []
+        for code, val in zip(self.codes, values):
+            if code == MILLI:
+                try:
+                    k = round(val*1000)
+                except OverflowError:
+                    raise ValueError("value out of range")
+                if k/1000. != val or (k == 0 and math.copysign(1., val) < 0):
+                    raise ValueError("inexact value")
+                packed.append(k)
+            else:
+                packed.append(val)
+        try:
+            return self.st.pack(self.tag, ms, *packed)
+        except struct.error:
+            raise ValueError("value out of range")
+
+    def unpack(self, buf: bytes) -> Tuple[int, Mapping[str, Any]]:
+        vals = self.st.unpack(buf)
+        data: Dict[str, Any] = OrderedDict()
+        for name, code, val in zip(self.names, self.codes, vals[2:]):
+            data[name] = val/1000. if code == MILLI else val
+        return vals[1], data
+
+
+class BinaryDatafile(Datafile):
+    """
+    Class to implement a binary data file. The file must be opened in
+    binary mode.
+    """
+    def __init__(self, file):
+        super().__init__(file)
+        self.schemas: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Schema] = dict()
+        self.encoders: Dict[RecordEncoder, Tuple[Schema, Tuple[int, ...]]] = dict()
+        self.file.write(MAGIC)
+
+    def _schema(self, event: str, data: Mapping[str, Any]) -> Optional[Schema]:
+        fields = []
+        for key, val in data.items():
+            code = _typecode(val)
+            if code is None:
+                return None
+            fields.append((key, code))
+        key = (event, tuple(fields))
+        schema = self.schemas.get(key)
+        if schema is None:
+            schema = Schema(len(self.schemas) + 2, event, key[1])
+            if schema.tag > 0xffff:
+                return None
+            self.schemas[key] = schema
+            self.file.write(schema.header())
+        return schema
+
+    def add_record(self, event: str, data: Record, ts: float = 0):
+        """
+        Append a record to the file. If the timestamp, ts, is zero, the
+        current time is used.
+        """
+        ms = timestamp_ms(ts)
+        if isinstance(data, Mapping):
+            schema = self._schema(event, data)
+            if schema is not None:
+                try:
+                    self.file.write(schema.pack(ms, tuple(data.values())))
+                    return
+                except ValueError:
+                    pass
+        rec = json.dumps(OrderedDict(t=ms, event=event, data=data)).encode("utf-8")
+        self.file.write(_tag.pack(JsonTag) + _jlen.pack(len(rec)) + rec)
+
+    def add_values(self, enc: RecordEncoder, values: Tuple[Any, ...], ts: float = 0):
+        """
+        Append a record encoded from a sequence of values. Floating-point
+        values are stored with three decimal places.
+        """
+        entry = self.encoders.get(enc)
+        if entry is None:
+            codes = {FLOAT: MILLI, BOOL: BOOL}
+            fields = tuple((name, codes.get(kind, INT)) for name, kind in enc.fields)
+            key = (enc.event, fields)
+            schema = self.schemas.get(key)
+            if schema is None:
+                schema = Schema(len(self.schemas) + 2, enc.event, fields)
+                self.schemas[key] = schema
+                self.file.write(schema.header())
+            entry = (schema, tuple(i for i, f in enumerate(fields) if f[1] == MILLI))
+            self.encoders[enc] = entry
+        schema, milli = entry
+        vals = list(values)
+        try:
+            for i in milli:
+                vals[i] = round(vals[i]*1000)
+            self.file.write(schema.st.pack(schema.tag, timestamp_ms(ts), *vals))
+        except (struct.error, ValueError, OverflowError):
+            self.add_record(enc.event, enc.asdict(values), ts=ts)
+
+
+def _read(fp: IO[bytes], n: int) -> bytes:
+    buf = fp.read(n)
+    if len(buf) != n:
+        raise EOFError()
+    return buf
+
+
+def read_records(fp: IO[bytes]) -> Iterator[Tuple[int, str, Record]]:
+    """
+    Generate the (timestamp, event, data) tuples stored in a binary data
+    file. Timestamps are in milliseconds since the epoch. A truncated
+    final record is ignored.
+    """
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise FormatError("not an eDNA binary data file")
+    schemas: Dict[int, Schema] = dict()
+    while True:
+        try:
+            tag, = _tag.unpack(_read(fp, _tag.size))
+            if tag == SchemaTag:
+                n, = _slen.unpack(_read(fp, _slen.size))
+                desc = json.loads(_read(fp, n).decode("utf-8"))
+                schemas[desc["tag"]] = Schema(desc["tag"], desc["event"],
+                                              tuple(tuple(f) for f in desc["fields"]))
+            elif tag == JsonTag:
+                n, = _jlen.unpack(_read(fp, _jlen.size))
+                rec = json.loads(_read(fp, n).decode("utf-8"),
+                                 object_pairs_hook=OrderedDict)
+                yield rec["t"], rec["event"], rec["data"]
+            else:
+                schema = schemas.get(tag)
+                if schema is None:
+                    raise FormatError("undefined record tag {:d}".format(tag))
+                body = _read(fp, schema.st.size - _tag.size)
+                ms, data = schema.unpack(_tag.pack(tag) + body)
+                yield ms, schema.event, data
+        except EOFError:
+            break
+
+
+def to_ndjson(fin: IO[bytes], fout: IO[str]) -> int:
+    """
+    Convert a binary data file to the NDJSON format and return the
+    number of records written.
+    """
+    count = 0
+    for ms, event, data in read_records(fin):
+        rec = OrderedDict(t=format_ms(ms), event=event, data=data)
+        fout.write(json.dumps(rec) + "\n")
+        count += 1
+    return count
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.clock
+     :platform: any
+     :synopsis: pluggable time sources
+
+All of the timing in the sampling code (tickers, sleeps, elapsed times
+and record timestamps) goes through a clock object. The real clock is
+the default, a simulated clock runs a deployment as fast as the code
+allows and a scaled clock runs it at a fixed multiple of real time::
+
+    >>> from edna.clock import SimClock, set_clock
+    >>> set_clock(SimClock())
+
+Clocks provide *time* (seconds since the epoch), *monotonic*,
+*monotonic_ns* and *sleep* with the same semantics as the functions in
+the time module, and *asleep*, a coroutine version of *sleep* for use
+with asyncio. A thread which waits for another one to do something on
+the clock uses *join*, or *waiting* around other blocking calls, so a
+simulated clock keeps running while it waits::
+
+    >>> with clock.waiting(done.is_set):
+    ...     done.wait(timeout=5)
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+
+class Clock(object):
+    """
+    Time source interface.
+    """
+    def time(self) -> float:
+        raise NotImplementedError
+
+    def monotonic(self) -> float:
+        raise NotImplementedError
+
+    def monotonic_ns(self) -> int:
+        return int(round(self.monotonic()*1e9))
+
+    def sleep(self, secs: float):
+        raise NotImplementedError
+
+    async def asleep(self, secs: float):
+        """
+        Sleep without blocking the event loop. The default runs *sleep*
+        in the loop's executor.
+        """
+        if secs > 0:
+            await asyncio.get_running_loop().run_in_executor(None, self.sleep, secs)
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """
+        Prepare an event loop to run coroutines which use the clock.
+        """
+
+    @contextmanager
+    def waiting(self, done: Callable[[], bool]) -> Iterator[None]:
+        """
+        Context manager around a blocking call of the current thread,
+        which returns once done() is True.
+        """
+        yield
+
+    def start_thread(self, thread: threading.Thread):
+        """
+        Start a thread which uses the clock.
+        """
+        thread.start()
+
+    def join(self, thread: threading.Thread, timeout: Optional[float] = None):
+        """
+        Wait for a thread to finish, see threading.Thread.join.
+        """
+        with self.waiting(lambda: not thread.is_alive()):
+            thread.join(timeout)
+
+
+class RealClock(Clock):
+    """
+    Wall clock time.
+    """
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def monotonic_ns(self) -> int:
+        return time.monotonic_ns()
+
+    def sleep(self, secs: float):
+        if secs > 0:
+            time.sleep(secs)
+
+    async def asleep(self, secs: float):
+        await asyncio.sleep(max(secs, 0))
+
+
+class ScaledClock(Clock):
+    """
+    Clock which runs *speed* times faster than real time, starting from
+    t0 (default: the current time).
+    """
+    def __init__(self, speed: float, t0: Optional[float] = None):
+        if speed <= 0:
+            raise ValueError("clock speed must be positive")
+        self.speed = speed
+        self.t0 = time.time() if t0 is None else t0
+        self.m0 = time.monotonic()
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self.m0)*self.speed
+
+    def time(self) -> float:
+        return self.t0 + self.monotonic()
+
+    def sleep(self, secs: float):
+        if secs > 0:
+            time.sleep(secs/self.speed)
+
+    async def asleep(self, secs: float):
+        await asyncio.sleep(max(secs, 0)/self.speed)
+
+
+class _Sleeper(object):
+    """
+    Pending wake-up of a thread or, if *fut* is set, of a coroutine
+    running in *loop*.
+    """
+    def __init__(self, wake: float, seq: int, thread: threading.Thread,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 fut: Optional[asyncio.Future] = None):
+        self.wake = wake
+        self.seq = seq
+        self.thread = thread
+        self.loop = loop
+        self.fut = fut
+        self.woken = False
+
+    def __lt__(self, other: "_Sleeper") -> bool:
+        return (self.wake, self.seq) < (other.wake, other.seq)
+
+
+def _resolve(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class _IdleSelector(object):
+    """
+    Wrapper for the selector of an event loop which tells a SimClock when
+    the loop has nothing to do but wait.
+    """
+    def __init__(self, clock: "SimClock", selector: Any):
+        self.clock = clock
+        self.selector = selector
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.selector, name)
+
+    def select(self, timeout: Optional[float] = None) -> Any:
+        if timeout is not None and timeout <= 0:
+            return self.selector.select(timeout)
+        # Return regularly, so the clock notices threads which have
+        # exited
+        poll = self.clock.poll
+        self.clock._set_idle(True)
+        try:
+            return self.selector.select(poll if timeout is None else min(timeout, poll))
+        finally:
+            self.clock._set_idle(False)
+
+
+class _Hold(object):
+    """
+    Executor job which holds simulated time back from when it is
+    submitted until the loop has seen its result. The worker thread
+    uses the clock while the job runs, and once it has finished the
+    loop counts as busy until it has taken the result.
+    """
+    def __init__(self, clock: "SimClock"):
+        self.clock = clock
+        self.loop_thread = threading.current_thread()
+        self.state = "queued"
+        with clock.cv:
+            clock.holds += 1
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        clock = self.clock
+        me = threading.current_thread()
+        with clock.cv:
+            clock.holds -= 1
+            clock.threads.add(me)
+            self.state = "running"
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with clock.cv:
+                clock.threads.discard(me)
+                clock.results[self.loop_thread] = clock.results.get(self.loop_thread, 0) + 1
+                self.state = "done"
+
+    def release(self):
+        clock = self.clock
+        with clock.cv:
+            if self.state == "queued":
+                # Cancelled before it ran
+                clock.holds -= 1
+            elif self.state == "done":
+                clock.results[self.loop_thread] -= 1
+            else:
+                return
+            self.state = "released"
+            clock._dispatch()
+
+
+class _SimExecutor(ThreadPoolExecutor):
+    """
+    Default executor of an event loop which uses a SimClock. Simulated
+    time stands still while a job is queued or running, and until the
+    loop has taken its result.
+    """
+    def __init__(self, clock: "SimClock"):
+        super().__init__(thread_name_prefix="edna-sim")
+        self.clock = clock
+
+    def submit(self, fn, *args, **kwargs):  # type: ignore
+        hold = _Hold(self.clock)
+        try:
+            cf = super().submit(hold.run, fn, *args, **kwargs)
+        except BaseException:
+            hold.release()
+            raise
+        loop = asyncio.get_running_loop()
+
+        def done(f: Future):
+            try:
+                loop.call_soon_threadsafe(hold.release)
+            except RuntimeError:
+                # The loop is closed
+                hold.release()
+
+        # Queue the release behind the callback which passes the result
+        # to the loop, run_in_executor adds that one after submit returns.
+        loop.call_soon(cf.add_done_callback, done)
+        return cf
+
+
+class SimClock(Clock):
+    """
+    Discrete-event clock. Simulated time only advances when every
+    thread which uses the clock is asleep on it; time then jumps to the
+    earliest wake-up time and that sleeper, and no other, is woken. A
+    thread uses the clock from its start if it is started with
+    *start_thread*, otherwise from its first sleep (the thread which
+    creates the clock from the start), until it exits. While it runs,
+    or blocks on something other than the clock, time stands still,
+    unless it blocks through *join* or *waiting*. No real-time timeouts
+    are involved, so threads which only interact through the clock run
+    the same way every time.
+
+    Coroutines sleep in simulated time too. The event loop counts as
+    asleep while it waits for events, and jobs in its default executor
+    hold time back until their results are delivered.
+    """
+    def __init__(self, t0: Optional[float] = None, poll: float = 0.05):
+        """
+        :param t0: initial time, default is the current time
+        :param poll: real time between checks on the threads which are
+                     blocked through *join* or *waiting*
+        """
+        self.now = time.time() if t0 is None else t0
+        self.start = self.now
+        self.poll = poll
+        self.cv = threading.Condition()
+        self.sleepers: List[_Sleeper] = []
+        # Threads which use the clock, including the one which created it
+        self.threads: Set[threading.Thread] = set([threading.current_thread()])
+        # Threads which are asleep (None) or blocked until a condition
+        # is true
+        self.idle: Dict[threading.Thread, Optional[Callable[[], bool]]] = {}
+        # Executor jobs which have not started yet, and the number of
+        # results which each event loop thread has still to take
+        self.holds = 0
+        self.results: Dict[threading.Thread, int] = {}
+        self.loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+        self.seq = itertools.count()
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now - self.start
+
+    def advance(self, secs: float):
+        """
+        Move simulated time forward, waking every sleeper which is due.
+        """
+        with self.cv:
+            self.now += max(secs, 0)
+            while self.sleepers and self.sleepers[0].wake <= self.now:
+                self._wake(heapq.heappop(self.sleepers))
+
+    def _wake_time(self, secs: float) -> float:
+        # Always move time on, even if secs is below the resolution of now
+        return max(self.now + secs, math.nextafter(self.now, math.inf))
+
+    def _wake(self, s: _Sleeper):
+        s.woken = True
+        self.idle.pop(s.thread, None)
+        if s.fut is None:
+            self.cv.notify_all()
+        else:
+            try:
+                s.loop.call_soon_threadsafe(_resolve, s.fut)  # type: ignore
+            except RuntimeError:
+                # The loop is closed
+                pass
+
+    def _running(self, t: threading.Thread) -> bool:
+        if t not in self.idle:
+            return True
+        done = self.idle[t]
+        return done is not None and done()
+
+    def _dispatch(self):
+        # Wake the earliest sleeper if nothing else can happen first.
+        # Called with the lock held.
+        if self.holds or not self.sleepers:
+            return
+        self.threads = set(t for t in self.threads if t.is_alive())
+        if any(self._running(t) for t in self.threads):
+            return
+        s = heapq.heappop(self.sleepers)
+        self.now = max(self.now, s.wake)
+        self._wake(s)
+
+    def _set_idle(self, idle: bool):
+        me = threading.current_thread()
+        with self.cv:
+            if me not in self.threads:
+                return
+            if idle:
+                # The loop is busy again once a job has finished
+                self.idle[me] = lambda: self.results.get(me, 0) > 0
+                self._dispatch()
+            else:
+                self.idle.pop(me, None)
+
+    def start_thread(self, thread: threading.Thread):
+        """
+        Start a thread which uses the clock. Simulated time stands still
+        until the thread sleeps, rather than until its first use of the
+        clock.
+        """
+        thread.start()
+        with self.cv:
+            self.threads.add(thread)
+
+    @contextmanager
+    def waiting(self, done: Callable[[], bool]) -> Iterator[None]:
+        """
+        Context manager around a blocking call of the current thread,
+        which returns once done() is True. Simulated time advances during
+        the call as if the thread was asleep, until done() is True.
+        """
+        me = threading.current_thread()
+        with self.cv:
+            if me not in self.threads:
+                registered = False
+            else:
+                registered = True
+                self.idle[me] = done
+                self._dispatch()
+        try:
+            yield
+        finally:
+            if registered:
+                with self.cv:
+                    self.idle.pop(me, None)
+
+    def sleep(self, secs: float):
+        me = threading.current_thread()
+        with self.cv:
+            self.threads.add(me)
+            if secs <= 0:
+                return
+            s = _Sleeper(self._wake_time(secs), next(self.seq), me)
+            heapq.heappush(self.sleepers, s)
+            self.idle[me] = None
+            try:
+                self._dispatch()
+                while not s.woken:
+                    # Check again in case a thread has exited
+                    if not self.cv.wait(self.poll):
+                        self._dispatch()
+            finally:
+                self.idle.pop(me, None)
+                if not s.woken:
+                    self.sleepers.remove(s)
+                    heapq.heapify(self.sleepers)
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """
+        Let the clock see when the event loop is idle and hold time back
+        for the jobs in its default executor. Call this before the loop
+        runs jobs which sleep on the clock; *asleep* does it too.
+        """
+        if loop in self.loops:
+            return
+        selector = getattr(loop, "_selector", None)
+        if selector is None:
+            raise RuntimeError("SimClock needs a selector event loop")
+        loop._selector = _IdleSelector(self, selector)  # type: ignore
+        prev = getattr(loop, "_default_executor", None)
+        loop.set_default_executor(_SimExecutor(self))
+        if prev is not None:
+            prev.shutdown(wait=False)
+        self.loops.add(loop)
+
+    async def asleep(self, secs: float):
+        """
+        Sleep in simulated time, without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        self.attach(loop)
+        with self.cv:
+            self.threads.add(threading.current_thread())
+            if secs <= 0:
+                return
+            s = _Sleeper(self._wake_time(secs), next(self.seq), threading.current_thread(),
+                         loop, loop.create_future())
+            heapq.heappush(self.sleepers, s)
+        try:
+            await s.fut  # type: ignore
+        finally:
+            with self.cv:
+                if not s.woken:
+                    self.sleepers.remove(s)
+                    heapq.heapify(self.sleepers)
+
+
+# Process-wide default clock
+_clock: Clock = RealClock()
+
+
+def get_clock() -> Clock:
+    """
+    Return the default clock.
+    """
+    return _clock
+
+
+def set_clock(clock: Clock) -> Clock:
+    """
+    Set the default clock and return the previous one.
+    """
+    global _clock
+    prev, _clock = _clock, clock
+    return prev
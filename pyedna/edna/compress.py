@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.compress
+     :platform: any
+     :synopsis: incremental data file compression
+
+Data written to a block writer is compressed in independent blocks, each
+a complete gzip member or zstd frame. Concatenated members and frames
+form a valid compressed stream so a file can be decompressed with the
+standard tools at any point and a crash loses, at most, the block which
+was being accumulated.
+"""
+import gzip
+import io
+from typing import Any, List, Union
+
+
+class BlockWriter(object):
+    """
+    File-like object to compress its input in blocks and write them to
+    an underlying binary file. A block is written when *blocksize* bytes
+    of input have accumulated or when the writer is flushed. Blocks are
+    only split between calls to write so a block always contains whole
+    data records.
+    """
+    suffix: str = ""
+    buf: List[bytes]
+
+    def __init__(self, file: Any, blocksize: int = 65536):
+        """
+        :param file: output file opened in binary mode
+        :param blocksize: uncompressed block size in bytes
+        """
+        self.file = file
+        self.blocksize = blocksize
+        self.buf = []
+        self.size = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.blocks = 0
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def write(self, s: Union[str, bytes]) -> int:
+        b = s.encode("utf-8") if isinstance(s, str) else s
+        self.buf.append(b)
+        self.size += len(b)
+        if self.size >= self.blocksize:
+            self._emit()
+        return len(s)
+
+    def _emit(self):
+        if self.size == 0:
+            return
+        data = b"".join(self.buf)
+        block = self.compress(data)
+        self.file.write(block)
+        self.bytes_in += len(data)
+        self.bytes_out += len(block)
+        self.blocks += 1
+        self.buf = []
+        self.size = 0
+
+    def flush(self):
+        """
+        Compress and write the current block.
+        """
+        self._emit()
+        self.file.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        """
+        Write the final block. The underlying file is not closed.
+        """
+        self.flush()
+
+    def ratio(self) -> float:
+        """
+        Return the compression ratio of the blocks written so far.
+        """
+        return float(self.bytes_in)/self.bytes_out if self.bytes_out else 0.
+
+
+class GzipBlockWriter(BlockWriter):
+    """
+    Write blocks as gzip members.
+    """
+    suffix = ".gz"
+
+    def __init__(self, file: Any, blocksize: int = 65536, level: int = 6):
+        super().__init__(file, blocksize)
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level)
+
+
+class ZstdBlockWriter(BlockWriter):
+    """
+    Write blocks as zstd frames. Requires the zstandard package.
+    """
+    suffix = ".zst"
+
+    def __init__(self, file: Any, blocksize: int = 65536, level: int = 3):
+        import zstandard  # type: ignore
+        super().__init__(file, blocksize)
+        self.cctx = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.cctx.compress(data)
+
+
+# Block writers by compression method name
+writers = {
+    "gzip": GzipBlockWriter,
+    "zstd": ZstdBlockWriter
+}
+
+
+def decompressor(name: str, fp: Any) -> Any:
+    """
+    Return a binary file object to read the decompressed contents of
+    fp, the compression method is determined from the file name. If the
+    name has no compression suffix, fp is returned.
+    """
+    if name.endswith(GzipBlockWriter.suffix):
+        return gzip.GzipFile(fileobj=fp, mode="rb")
+    if name.endswith(ZstdBlockWriter.suffix):
+        import zstandard  # type: ignore
+        reader = zstandard.ZstdDecompressor().stream_reader(fp, read_across_frames=True)
+        return io.BufferedReader(reader)
+    return fp
+
+
+def strip_suffix(name: str) -> str:
+    """
+    Remove a compression suffix from a file name.
+    """
+    for suffix in (GzipBlockWriter.suffix, ZstdBlockWriter.suffix):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
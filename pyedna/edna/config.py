@@ -37,6 +37,9 @@ required: Dict[str, List[str]] = {
     "Deployment": ["seekerr", "deptherr", "prrate", "seektime"]
 }
 
+# Marker for a missing fallback value
+_UNSET: Any = object()
+
 
 class BadEntry(Exception):
     def __init__(self, key, msg=""):
@@ -82,17 +85,22 @@ class Config(ConfigParser):
                     missing.append("/".join([k, val]))
         return missing
 
-    def get_string(self, section: str, key: str) -> str:
+    def get_string(self, section: str, key: str, fallback: Any = _UNSET) -> str:
         """
-        Return a configuration entry.
+        Return a configuration entry. If fallback is supplied, it is
+        returned when the entry is missing.
         """
+        if fallback is not _UNSET and not self.has_option(section, key):
+            return fallback
         try:
             value = self.get(section, key)
         except Error:
             raise BadEntry("/".join([section, key]))
         return value
 
-    def get_int(self, section: str, key: str) -> int:
+    def get_int(self, section: str, key: str, fallback: Any = _UNSET) -> int:
+        if fallback is not _UNSET and not self.has_option(section, key):
+            return fallback
         s = self.get_string(section, key)
         try:
             value = int(s, base=0)
@@ -104,13 +112,24 @@ class Config(ConfigParser):
         s = self.get_string(section, key)
         return eval(s)
 
-    def get_float(self, section: str, key: str) -> float:
+    def get_float(self, section: str, key: str, fallback: Any = _UNSET) -> float:
+        if fallback is not _UNSET and not self.has_option(section, key):
+            return fallback
         try:
             value = self.getfloat(section, key)
-        except Error:
+        except (Error, ValueError):
             raise BadEntry("/".join([section, key]))
         return value
 
+    def get_list(self, section: str, key: str, fallback: Any = _UNSET) -> List[str]:
+        """
+        Return a comma separated configuration entry as a list of strings.
+        """
+        if fallback is not _UNSET and not self.has_option(section, key):
+            return fallback
+        s = self.get_string(section, key)
+        return [val.strip() for val in s.split(",") if val.strip()]
+
     def get_array(self, section: str, key: str) -> List[float]:
         s = self.get_string(section, key)
         f = []
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.data
+     :platform: any
+     :synopsis: load deployment data into NumPy arrays
+
+Records are grouped by event type and returned as NumPy structured
+arrays. Numbered events (``sample.N``, ``result.N``, ``battery-N``,
+``timing.sample.N``) are combined into a single array with an
+additional *index* field. Every array has a *t* field containing the
+record time as a datetime64[ms] value followed by one field for each
+data value. Values missing from some records are stored as False
+(booleans), an empty string (text) or NaN. Records with a list or
+object value are not tabular and are returned with the metadata::
+
+    >>> d = load("OUTBOX/edna_20210601T120000.tar.gz")
+    >>> d["sample"]["amount"]
+    >>> d["depth"]["t"]
+
+The parsed arrays are cached in a ``.npz`` file next to the source,
+the cache is rebuilt when the source size or modification time changes.
+Requires the numpy package.
+"""
+import numpy as np  # type: ignore
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, List, Iterator, Optional, Tuple
+import json
+import logging
+import os
+import os.path
+import re
+from .archive import records, is_datafile
+
+
+# Numbered event names
+_numbered = re.compile(r"^(.+)[.-](\d+)$")
+
+# Cache entry holding the source signature
+_SIG = "__source__"
+# Cache entry holding the non-tabular records
+_MISC = "__misc__"
+
+
+def event_type(event: str) -> Tuple[str, Optional[int]]:
+    """
+    Split an event name into its type and index.
+    """
+    m = _numbered.match(event)
+    if m:
+        return m.group(1), int(m.group(2))
+    return event, None
+
+
+def signature(path: str) -> np.ndarray:
+    """
+    Return the total size and latest modification time (in nanoseconds)
+    of a deployment source.
+    """
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(path, name))
+                 for name in os.listdir(path) if is_datafile(name)]
+    else:
+        stats = [os.stat(path)]
+    return np.array([sum(s.st_size for s in stats),
+                     max((s.st_mtime_ns for s in stats), default=0)],
+                    dtype="i8")
+
+
+def cache_name(path: str) -> str:
+    """
+    Return the name of the cache file for a deployment source.
+    """
+    return path.rstrip("/") + ".npz"
+
+
+class _Table(object):
+    """
+    Column accumulator for one event type.
+    """
+    def __init__(self, numbered: bool):
+        self.numbered = numbered
+        self.times: List[str] = []
+        self.index: List[int] = []
+        self.cols: Dict[str, List[Any]] = OrderedDict()
+
+    def add(self, t: str, index: Optional[int], data: Any):
+        n = len(self.times)
+        for key, val in data.items():
+            col = self.cols.get(key)
+            if col is None:
+                # Field missing from earlier records
+                col = self.cols[key] = [None] * n
+            col.append(val)
+        for key, col in self.cols.items():
+            if len(col) == n:
+                col.append(None)
+        self.times.append(t)
+        self.index.append(index or 0)
+
+    def array(self) -> np.ndarray:
+        # Timestamps are UTC, drop the offset before conversion.
+        fields = [("t", np.array([t[:23] for t in self.times],
+                                 dtype="datetime64[ms]"))]
+        if self.numbered:
+            fields.append(("index", np.array(self.index, dtype="i2")))
+        for key, col in self.cols.items():
+            vals = [v for v in col if v is not None]
+            if all(isinstance(v, bool) for v in vals):
+                fields.append((key, np.array([bool(v) for v in col], dtype="?")))
+            elif all(isinstance(v, int) for v in vals) and len(vals) == len(col):
+                fields.append((key, np.array(col, dtype="i8")))
+            elif any(isinstance(v, str) for v in vals):
+                # Text, or text mixed with numbers, is stored as strings
+                fields.append((key, np.array(["" if v is None else str(v) for v in col],
+                                             dtype=str)))
+            else:
+                fields.append((key, np.array([np.nan if v is None else v for v in col],
+                                             dtype="f8")))
+        arr = np.empty(len(self.times), dtype=[(name, a.dtype) for name, a in fields])
+        for name, a in fields:
+            arr[name] = a
+        return arr
+
+
+def _tabular(data: Any) -> bool:
+    """
+    Return True if a record's data is a mapping of scalar values.
+    """
+    return (isinstance(data, dict) and
+            all(v is None or isinstance(v, (bool, int, float, str))
+                for v in data.values()))
+
+
+def parse(path: str) -> Tuple[Dict[str, np.ndarray], List[Any]]:
+    """
+    Parse every record from a deployment source. Returns a dictionary
+    of arrays indexed by event type and a list of the [time, event, data]
+    entries of records which are not tabular (e.g. metadata).
+    """
+    tables: Dict[str, _Table] = OrderedDict()
+    misc = []
+    for t, event, data in records(path):
+        if not _tabular(data):
+            misc.append([t, event, data])
+            continue
+        kind, index = event_type(event)
+        table = tables.get(kind)
+        if table is None:
+            table = tables[kind] = _Table(index is not None)
+        table.add(t, index, data)
+    return OrderedDict((k, v.array()) for k, v in tables.items()), misc
+
+
+class Deployment(Mapping):
+    """
+    Read-only mapping of event types to NumPy structured arrays for a
+    deployment directory, data file or OUTBOX archive. Nothing is read
+    until the first access.
+    """
+    def __init__(self, path: str, cache: bool = True):
+        """
+        :param path: deployment source
+        :param cache: if True, read and write the ``.npz`` cache
+        """
+        self.path = path
+        self.cache = cache
+        self.logger = logging.getLogger("edna.data")
+        self._arrays: Optional[Mapping[str, np.ndarray]] = None
+        self._misc: List[Any] = []
+
+    def _load(self) -> Mapping[str, np.ndarray]:
+        if self._arrays is not None:
+            return self._arrays
+        sig = signature(self.path)
+        cname = cache_name(self.path)
+        if self.cache and os.path.isfile(cname):
+            npz = np.load(cname, allow_pickle=False)
+            if _SIG in npz.files and np.array_equal(npz[_SIG], sig):
+                self._misc = json.loads(str(npz[_MISC]))
+                self._arrays = npz
+                return npz
+            npz.close()
+        arrays, self._misc = parse(self.path)
+        if self.cache:
+            try:
+                with open(cname, "wb") as f:
+                    np.savez(f, **arrays, **{_SIG: sig,
+                                             _MISC: np.array(json.dumps(self._misc))})
+            except OSError as e:
+                self.logger.warning("Cannot write cache file %s: %s", cname, str(e))
+        self._arrays = arrays
+        return arrays
+
+    def __getitem__(self, kind: str) -> np.ndarray:
+        if kind in (_SIG, _MISC):
+            raise KeyError(kind)
+        return self._load()[kind]
+
+    def __iter__(self) -> Iterator[str]:
+        arrays = self._load()
+        keys = arrays.files if hasattr(arrays, "files") else arrays.keys()
+        return iter([k for k in keys if k not in (_SIG, _MISC)])
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    @property
+    def misc(self) -> List[Any]:
+        """
+        The [time, event, data] entries of the non-tabular records.
+        """
+        self._load()
+        return self._misc
+
+
+def load(path: str, cache: bool = True) -> Deployment:
+    """
+    Return the data arrays of a deployment directory, data file or
+    OUTBOX archive.
+    """
+    return Deployment(path, cache=cache)
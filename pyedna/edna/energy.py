@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.energy
+     :platform: any
+     :synopsis: battery energy accounting by deployment phase
+
+An :class:`EnergyAccountant` reads the voltage and current of the Smart
+Batteries at a fixed interval from a background thread (or a scheduler
+task) and integrates the charge and energy drawn from them with the
+trapezoidal rule, using the actual time of each reading. Batteries
+cached by a :class:`edna.periph.BatteryMonitor` are not read again,
+the monitor's latest reading is used with the time of its poll. The
+consumption is attributed to the deployment phase in progress; the
+phase is changed with :meth:`EnergyAccountant.set_phase`, which only
+records the time of the change, so it can be called from the sampling
+loops and coroutines.
+An interval between two readings which spans a phase change is split
+at the time of the change::
+
+    >>> with EnergyAccountant(batts, 10.) as acct:
+    ...     acct.set_phase("seek")
+    ...     seekdepth(...)
+    ...     acct.set_phase("idle")
+    >>> acct.write(df, "energy.deployment")
+
+Consumption is positive when the batteries discharge.
+"""
+from . import periph
+from .clock import Clock, get_clock
+from .sample import Datafile, FLOAT, register_event, read_sbs
+from .sched import Scheduler, Task
+from .timing import Ticker
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+
+# Deployment phases
+PHASES = ("seek", "sample", "ethanol", "hold", "idle")
+
+# Record shape of the energy.* records; the time in seconds, charge in
+# mAh and energy in Wh of each phase.
+EnergyFields = tuple((phase+"_"+q, FLOAT) for phase in PHASES
+                     for q in ("s", "mah", "wh"))
+
+
+class EnergyAccountant(object):
+    """
+    Integrate the charge and energy drawn from a set of Smart Batteries
+    and attribute them to deployment phases. This class is a Context
+    Manager which starts the battery readings on entry and stops them on
+    exit.
+    """
+    # Time between checks for a due reading and for a stop request
+    wake: float = 0.25
+
+    def __init__(self, batts: List[periph.Battery], interval: float = 10.,
+                 clock: Optional[Clock] = None,
+                 sched: Optional[Scheduler] = None):
+        """
+        :param batts: batteries to read
+        :param interval: time between readings in seconds
+        :param clock: time source
+        :param sched: if specified, read from this scheduler rather than
+                      a separate thread
+        """
+        self.batts = batts
+        self.interval = interval
+        self.clock = clock or get_clock()
+        self.sched = sched
+        self.logger = logging.getLogger("edna.energy")
+        self.lock = Lock()
+        # Serializes the readings, update is called from the background
+        # thread and from the sampling loops
+        self.rlock = Lock()
+        self.phase = "idle"
+        # Phase changes since the last reading
+        self.changes: List[Tuple[float, str]] = []
+        # Time, discharge current in amps and power in watts of the last
+        # reading
+        self.last: Optional[Tuple[float, float, float]] = None
+        self.totals: Dict[str, List[float]] = OrderedDict(
+            (phase, [0., 0., 0.]) for phase in PHASES)
+        self.marked = self.snapshot()
+        self.readings = 0
+        self.ev = Event()
+        self.tid: Any = None
+        self.task: Optional[Task] = None
+
+    def set_phase(self, phase: str):
+        """
+        Attribute the consumption from now on to a phase.
+        """
+        if phase not in self.totals:
+            raise ValueError("'{}': unknown deployment phase".format(phase))
+        with self.lock:
+            self.changes.append((self.clock.time(), phase))
+
+    def _integrate(self, t0: float, a0: float, p0: float,
+                   t1: float, a1: float, p1: float, phase: str):
+        dt = t1 - t0
+        tot = self.totals[phase]
+        tot[0] += dt
+        tot[1] += 0.5*(a0 + a1)*dt/3.6
+        tot[2] += 0.5*(p0 + p1)*dt/3600.
+
+    def add(self, t: float, vals: List[Tuple[float, float]]):
+        """
+        Add a reading of the voltage and current of each battery taken at
+        time t.
+        """
+        a = sum(-amps for v, amps in vals)
+        p = sum(-v*amps for v, amps in vals)
+        with self.lock:
+            changes, self.changes = self.changes, []
+            if self.last is None:
+                if changes:
+                    self.phase = changes[-1][1]
+                self.last = (t, a, p)
+                return
+            t0, a0, p0 = self.last
+            for tc, phase in changes:
+                tc = min(max(tc, t0), t)
+                # Interpolate the current and power at the phase change
+                f = (tc - t0)/(t - t0) if t > t0 else 1.
+                ac, pc = a0 + f*(a - a0), p0 + f*(p - p0)
+                self._integrate(t0, a0, p0, tc, ac, pc, self.phase)
+                t0, a0, p0 = tc, ac, pc
+                self.phase = phase
+            self._integrate(t0, a0, p0, t, a, p, self.phase)
+            self.last = (t, a, p)
+            self.readings += 1
+
+    def update(self) -> bool:
+        """
+        Read the batteries and integrate the consumption since the last
+        reading. Return False if a battery could not be read. A call made
+        while another is reading waits for it, so the readings are added
+        in time order. A reading which includes cached batteries is
+        timed by the oldest of their polls.
+        """
+        with self.clock.waiting(lambda: not self.rlock.locked()):
+            self.rlock.acquire()
+        try:
+            vals = []
+            times = []
+            for b in self.batts:
+                if isinstance(b, periph.CachedBattery):
+                    # The monitor's latest reading, at the time of the poll
+                    st = b.monitor.latest(b.index)
+                    v, amps = st.v, st.a
+                    times.append(st.t)
+                else:
+                    v, amps, soc = read_sbs(b, clock=self.clock)[0]
+                if v == 0:
+                    return False
+                vals.append((v, amps))
+            self.add(min(times + [self.clock.time()]), vals)
+        finally:
+            self.rlock.release()
+        return True
+
+    def _run(self):
+        due = self.clock.monotonic()
+        for tick in Ticker(self.wake, clock=self.clock):
+            if self.ev.is_set():
+                break
+            if self.clock.monotonic() >= due:
+                self.update()
+                due += self.interval
+
+    def start(self):
+        """
+        Start reading the batteries.
+        """
+        if self.sched is not None:
+            self.task = self.sched.add(self.update, self.interval,
+                                       name="energy", priority=-5)
+        else:
+            self.ev.clear()
+            self.tid = Thread(target=self._run, name="energy", daemon=True)
+            self.clock.start_thread(self.tid)
+
+    def stop(self):
+        """
+        Stop reading the batteries, after a final reading.
+        """
+        if self.task is not None:
+            assert self.sched is not None
+            self.sched.remove(self.task)
+            self.task = None
+        elif self.tid is not None:
+            self.ev.set()
+            self.clock.join(self.tid, timeout=2)
+            self.tid = None
+        self.update()
+
+    def snapshot(self) -> Dict[str, Tuple[float, float, float]]:
+        """
+        Return the time in seconds, charge in mAh and energy in Wh of
+        each phase.
+        """
+        with self.lock:
+            return OrderedDict((phase, (tot[0], tot[1], tot[2]))
+                               for phase, tot in self.totals.items())
+
+    def write(self, df: Datafile, event: str, since_mark: bool = False):
+        """
+        Write the consumption of each phase to an energy record, in
+        total or, if since_mark is True, since the previous call with
+        since_mark set.
+        """
+        snap = self.snapshot()
+        used: Dict[str, List[float]] = OrderedDict()
+        for phase, tot in snap.items():
+            base = self.marked[phase] if since_mark else (0., 0., 0.)
+            used[phase] = [round(x - x0, 4) for x, x0 in zip(tot, base)]
+        if since_mark:
+            self.marked = snap
+        df.add_values(register_event(event, EnergyFields),
+                      tuple(x for vals in used.values() for x in vals))
+        self.logger.info("Energy %s: %s", event,
+                         "; ".join("{} {:.1f} mAh {:.3f} Wh".format(phase, vals[1], vals[2])
+                                   for phase, vals in used.items()))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.stop()
+        # Allow exceptions to propogate out
+        return False
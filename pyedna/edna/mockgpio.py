@@ -3,6 +3,7 @@
 Mock the Raspberry Pi GPIO interface.
 """
 from . import ticker
+from .clock import get_clock
 import threading
 import logging
 from collections import namedtuple
@@ -17,11 +18,13 @@ class State(object):
     val: int
     thread: Any
     ev: Any
+    task: Any
     def __init__(self, type=0, val=0, thread=None, ev=None):
         self.type = type
         self.val = val
         self.thread = thread
         self.ev = ev
+        self.task = None
 
 _states: Dict[int, State] = dict()
 
@@ -37,11 +40,18 @@ PUD_DOWN = 0
 PUD_UP = 1
 
 detector_freq: float = 10
+# Event rates of individual pins, for example an ADC ALERT/RDY line at
+# the ADC data rate. Other pins use detector_freq.
+edge_freq: Dict[int, float] = dict()
+# If set to an edna.sched.Scheduler, event detectors run as scheduler
+# tasks rather than threads.
+scheduler: Any = None
 
 class Detector(threading.Thread):
-    def __init__(self, cb: Callable[[None], None], ev: threading.Event):
+    def __init__(self, cb: Callable[[None], None], ev: threading.Event,
+                 freq: float = 0):
         self.cb = cb
-        self.interval = 1./detector_freq
+        self.interval = 1./(freq or detector_freq)
         self.ev = ev
         super().__init__()
         self.daemon = True
@@ -81,17 +91,26 @@ def cleanup(*args):
 
 def add_event_detect(pin: int, which: int, callback: Callable[[None], None]):
     check_pin(pin, IN)
-    ev = threading.Event()
-    _states[pin].thread = Detector(callback, ev)
-    _states[pin].ev = ev
-    _states[pin].thread.start()
+    freq = edge_freq.get(pin, detector_freq)
+    if scheduler is not None:
+        _states[pin].task = scheduler.add(callback, 1./freq,
+                                          name="gpio-{:d}".format(pin))
+    else:
+        ev = threading.Event()
+        _states[pin].thread = Detector(callback, ev, freq)
+        _states[pin].ev = ev
+        get_clock().start_thread(_states[pin].thread)
     logging.getLogger("gpio").info("Event detector started on pin %d", pin)
 
 
 def remove_event_detect(pin: int):
     check_pin(pin, IN)
-    _states[pin].ev.set()
-    _states[pin].thread.join(timeout=1)
+    if _states[pin].task is not None:
+        scheduler.remove(_states[pin].task)
+        _states[pin].task = None
+    else:
+        _states[pin].ev.set()
+        get_clock().join(_states[pin].thread, timeout=1)
     logging.getLogger("gpio").info("Event detector stopped on pin %d", pin)
 
 
@@ -27,6 +27,14 @@ class Adc(object):
         self.gain = gain
         return self.read_adc(self.chan, self.gain)
 
+    def start_adc_comparator(self, chan: int, high_threshold: int, low_threshold: int,
+                             active_low: bool = True, traditional: bool = True,
+                             latching: bool = False, num_readings: int = 1,
+                             gain: float = 1, data_rate: int = 0) -> int:
+        # Comparator settings are ignored, the ALERT/RDY edges are
+        # simulated by edna.mockgpio (see edge_freq).
+        return self.start_adc(chan, gain)
+
     def get_last_result(self) -> int:
         if self.chan == -1:
             return 0
@@ -8,13 +8,21 @@ try:
     import RPi.GPIO as GPIO # type: ignore
 except ImportError:
     import edna.mockgpio as GPIO # type: ignore
-import time
 import logging
-from threading import Thread, Event
-from typing import Tuple, Any, Callable, Union, List
+from threading import Thread, Event, Lock, get_ident
+from typing import Tuple, Any, Callable, Union, List, Optional, Iterator, Dict, \
+    NamedTuple, Sequence
+from collections import OrderedDict
 from contextlib import contextmanager
+from functools import partial
 from collections import deque
+from array import array
+import bisect
 from . import ticker
+from .clock import Clock, get_clock
+from .sched import Scheduler, Task
+from .timing import Ticker
+from .rt import configure_thread
 
 
 logging.getLogger("edna").addHandler(logging.NullHandler())
@@ -39,13 +47,18 @@ class Counter(object):
     line: int
     name: str
 
-    def __init__(self, line: int, name: str = ""):
+    def __init__(self, line: int, name: str = "",
+                 clock: Optional[Clock] = None):
         """
         :param line: GPIO line to monitor
+        :param clock: time source, defaults to the edna.clock default
         """
         self.line = line
         self.name = name or "Counter({:d})".format(line)
+        self.clock = clock or get_clock()
         self.logger = logging.getLogger("edna.counter")
+        # Thread which runs the edge detection callbacks
+        self.cb_thread = 0
         GPIO.setup(self.line, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         self.reset()
 
@@ -61,32 +74,38 @@ class Counter(object):
         except Exception:
             pass
         self.count = 0
-        self.t0 = time.time()
+        self.t0 = self.clock.time()
         self.t = 0
         GPIO.add_event_detect(self.line, GPIO.RISING, callback=self._cb)
         self.logger.info("Counter '%s' reset", self.name)
 
     def _cb(self, *args):
+        if self.cb_thread != get_ident():
+            # The callbacks run in a thread started by the GPIO library,
+            # configure it on first use.
+            self.cb_thread = get_ident()
+            configure_thread(self.name)
         self.count += 1
 
     def read(self)-> Tuple[int, float]:
         """
         Return a tuple of the transition count and elapsed time.
         """
-        return self.count, time.time() - self.t0
+        return self.count, self.clock.time() - self.t0
 
 
 class FlowMeter(Counter):
     """
     Class to implement a flow meter from a digital pulse counter.
     """
-    def __init__(self, line: int, ppl: int):
+    def __init__(self, line: int, ppl: int, clock: Optional[Clock] = None):
         """
         :param line: GPIO line to monitor
         :param ppl: pulses per liter
+        :param clock: time source
         """
         self.scale = 1./float(ppl)
-        super().__init__(line, "flow-meter")
+        super().__init__(line, "flow-meter", clock=clock)
 
     def amount(self) -> Tuple[float, float]:
         pulses, t = self.read()
@@ -108,16 +127,19 @@ class Valve(object):
     _lopen: Union[int, None]
     _lclose: Union[int, None]
 
-    def __init__(self, enable: int, in1: int, in2: int, lopen: str = "in1", lclose: str = "in2"):
+    def __init__(self, enable: int, in1: int, in2: int, lopen: str = "in1", lclose: str = "in2",
+                 clock: Optional[Clock] = None):
         """
         :param enable: GPIO line to enable this valve
         :param in1: GPIO line connected to IN1
         :param in2: GPIO line connected to IN2
         :param lopen: H-bridge line which opens the valve
         :param lclose: H-bridge line which closes the valve
+        :param clock: time source
         """
         self.opened = False
         self.enable = enable
+        self.clock = clock or get_clock()
         self.logger = logging.getLogger("edna.valve")
         l = locals()
         self._lopen = l.get(lopen.lower())
@@ -144,7 +166,7 @@ class Valve(object):
         """
         GPIO.output(self._lclose, GPIO.LOW)
         GPIO.output(self._lopen, GPIO.HIGH)
-        time.sleep(0.1)
+        self.clock.sleep(0.1)
         GPIO.output(self._lopen, GPIO.LOW)
         self.opened = True
         self.logger.info("%s opened", str(self))
@@ -155,7 +177,7 @@ class Valve(object):
         """
         GPIO.output(self._lopen, GPIO.LOW)
         GPIO.output(self._lclose, GPIO.HIGH)
-        time.sleep(0.1)
+        self.clock.sleep(0.1)
         GPIO.output(self._lclose, GPIO.LOW)
         self.opened = False
         self.logger.info("%s closed", str(self))
@@ -173,6 +195,18 @@ class Valve(object):
         return False
 
 
+class SbsRegister(NamedTuple):
+    """
+    Smart Battery word register; command code, True if the value is a
+    signed 16-bit integer, and the scale and offset which convert the
+    raw value to engineering units.
+    """
+    cmd: int
+    signed: bool = False
+    scale: float = 1.
+    offset: float = 0.
+
+
 class Battery(object):
     """
     Class to represent a Smart Battery controller on an I2C bus.
@@ -183,41 +217,532 @@ class Battery(object):
         "current": 0x0a,
         "charge": 0x0e
     }
+    # Registers from the Smart Battery Data Specification converted to
+    # volts, amps, amp-hours, degrees C, percent and minutes. The cell
+    # voltages are manufacturer specific (TI bq20z gas gauges).
+    registers: Dict[str, SbsRegister] = OrderedDict([
+        ("temperature", SbsRegister(0x08, scale=0.1, offset=-273.15)),
+        ("voltage", SbsRegister(0x09, scale=0.001)),
+        ("current", SbsRegister(0x0a, signed=True, scale=0.001)),
+        ("avg_current", SbsRegister(0x0b, signed=True, scale=0.001)),
+        ("rel_charge", SbsRegister(0x0d)),
+        ("charge", SbsRegister(0x0e)),
+        ("remaining", SbsRegister(0x0f, scale=0.001)),
+        ("full_capacity", SbsRegister(0x10, scale=0.001)),
+        ("time_to_empty", SbsRegister(0x11)),
+        ("cell1", SbsRegister(0x3f, scale=0.001)),
+        ("cell2", SbsRegister(0x3e, scale=0.001)),
+        ("cell3", SbsRegister(0x3d, scale=0.001)),
+        ("cell4", SbsRegister(0x3c, scale=0.001)),
+    ])
     # Smart Batteries all have the same I2C address
     bus_addr = 0x0b
 
-    def __init__(self, bus: Any):
+    def __init__(self, bus: Any, regs: Sequence[str] = ()):
         """
         :param bus: the I2C (SMbus) interface
         :type bus: smbus.SMBus or smbus2.SMBus
+        :param regs: names of the extra registers read by read_registers
         """
         self.bus = bus
+        for name in regs:
+            if name not in self.registers:
+                raise ValueError("'{}': unknown battery register".format(name))
+        self.regs = tuple(regs)
+        # Registers read by read_registers, the voltage, current and
+        # charge first and each register only once.
+        self.reads = tuple(self.msgs) + tuple(name for name in self.regs
+                                              if name not in self.msgs)
+
+    @classmethod
+    def decode(cls, name: str, val: List[int]) -> float:
+        """
+        Convert the two bytes read from a register to engineering units.
+        """
+        reg = cls.registers[name]
+        x = val[0] + val[1]*256
+        # Convert to a signed 16-bit value
+        if reg.signed and x & 0x8000:
+            x = x - 0x10000
+        return x*reg.scale + reg.offset
+
+    def _read(self, name: str) -> float:
+        val = self.bus.read_i2c_block_data(self.bus_addr,
+                                           self.registers[name].cmd, 2)
+        return self.decode(name, val)
 
     def voltage(self) -> float:
         """
         Return battery voltage in volts
         """
-        val = self.bus.read_i2c_block_data(self.bus_addr, self.msgs["voltage"], 2)
-        return float((val[0] + val[1]*256.)/1000.)
+        return self._read("voltage")
 
     def current(self) -> float:
         """
         Return battery current in amps. A positive value means the battery
         is charging, negative means discharging.
         """
-        val = self.bus.read_i2c_block_data(self.bus_addr, self.msgs["current"], 2)
-        ma = val[0] + val[1]*256
-        # Convert to a signed 16-bit value
-        if ma & 0x8000:
-            ma = ma - 0x10000
-        return float(ma)/1000.
+        return self._read("current")
 
     def charge(self) -> int:
         """
         Return the battery charge state as a percentage.
         """
-        val = self.bus.read_i2c_block_data(self.bus_addr, self.msgs["charge"], 2)
-        return val[0] + val[1]*256
+        return int(self._read("charge"))
+
+    def read_registers(self, tries: int = 4, clock: Optional[Clock] = None,
+                       backoff: float = 0.1) -> Dict[str, float]:
+        """
+        Return the voltage, current, charge and the extra registers
+        selected when the battery was created, by name. The registers are
+        read in one pass, those which are NAKed (the battery is busy) are
+        read again in another pass after a delay, up to tries passes in
+        all. The delay is backoff seconds before the second pass and
+        doubles for each subsequent pass. The value of a register which
+        cannot be read is zero.
+        """
+        clock = clock or get_clock()
+        vals: Dict[str, float] = OrderedDict((name, 0.) for name in self.reads)
+        pending = list(self.reads)
+        delay = backoff
+        for i in range(tries):
+            if i > 0:
+                clock.sleep(delay)
+                delay *= 2
+            failed = []
+            for name in pending:
+                try:
+                    vals[name] = self._read(name)
+                except IOError:
+                    failed.append(name)
+            pending = failed
+            if not pending:
+                break
+        return vals
+
+
+class BatteryState(NamedTuple):
+    """
+    Latest reading of a Smart Battery; voltage in volts, current in
+    amps, state of charge in percent, time of the reading, age of the
+    reading in seconds and the number of failed polls.
+    """
+    v: float
+    a: float
+    soc: int
+    t: float
+    age: float
+    errors: int
+
+
+class CachedBattery(Battery):
+    """
+    Battery which returns the latest values polled by a BatteryMonitor
+    rather than accessing the I2C bus.
+    """
+    def __init__(self, monitor: "BatteryMonitor", index: int):
+        b = monitor.batts[index]
+        super().__init__(b.bus, b.regs)
+        self.monitor = monitor
+        self.index = index
+
+    def voltage(self) -> float:
+        return self.monitor.latest(self.index).v
+
+    def current(self) -> float:
+        return self.monitor.latest(self.index).a
+
+    def charge(self) -> int:
+        return self.monitor.latest(self.index).soc
+
+    def read_registers(self, tries: int = 4, clock: Optional[Clock] = None,
+                       backoff: float = 0.1) -> Dict[str, float]:
+        return self.monitor.regvals[self.index]
+
+
+class BatteryMonitor(object):
+    """
+    Class to poll a set of Smart Batteries from a background thread (or
+    scheduler tasks) and cache their latest readings, so the sampling
+    loops never wait on the I2C bus. Each battery is polled every
+    *interval* seconds, the polls of the batteries are spread evenly
+    across the interval. A read which is NAKed is retried with an
+    exponential backoff, a bounded number of times, before the poll is
+    counted as an error and the previous reading is kept. This class is
+    a Context Manager which starts polling on entry and stops on exit.
+    """
+    # Time between checks for due polls and for a stop request
+    wake: float = 0.25
+
+    def __init__(self, batts: List[Battery], interval: float = 10.,
+                 tries: int = 4, backoff: float = 0.1,
+                 clock: Optional[Clock] = None,
+                 sched: Optional[Scheduler] = None):
+        """
+        :param batts: batteries to poll
+        :param interval: time between polls of each battery in seconds
+        :param tries: maximum number of attempts for each register read
+        :param backoff: delay before the first retry, doubled for each
+                        subsequent retry
+        :param clock: time source
+        :param sched: if specified, poll from this scheduler rather than
+                      a separate thread
+        """
+        self.batts = batts
+        self.interval = interval
+        self.tries = max(tries, 1)
+        self.backoff = backoff
+        self.clock = clock or get_clock()
+        self.sched = sched
+        self.logger = logging.getLogger("edna.battery")
+        self.readings: List[Optional[Tuple[float, float, int, float]]] = [None] * len(batts)
+        # Latest register values of each battery with extra registers
+        self.regvals: List[Dict[str, float]] = [
+            OrderedDict((name, 0.) for name in b.reads) for b in batts]
+        self.errors = [0] * len(batts)
+        self.polls = 0
+        self.retries = 0
+        self.ev = Event()
+        self.tid: Any = None
+        self.tasks: List[Task] = []
+
+    def _read(self, fn: Callable[[], Any]) -> Any:
+        delay = self.backoff
+        for i in range(self.tries - 1):
+            try:
+                return fn()
+            except IOError:
+                self.retries += 1
+                self.clock.sleep(delay)
+                delay *= 2
+        return fn()
+
+    def poll(self, index: int) -> bool:
+        """
+        Read a battery and update its cached reading. Return False if the
+        battery could not be read.
+        """
+        b = self.batts[index]
+        self.polls += 1
+        if b.regs:
+            # Read everything in one pass, a battery which does not
+            # return its voltage is counted as unreadable.
+            vals = b.read_registers(self.tries, clock=self.clock,
+                                    backoff=self.backoff)
+            if vals["voltage"] == 0:
+                self.errors[index] += 1
+                return False
+            self.regvals[index] = vals
+            v, a, soc = vals["voltage"], vals["current"], int(vals["charge"])
+        else:
+            try:
+                v = self._read(b.voltage)
+                a = self._read(b.current)
+                soc = self._read(b.charge)
+            except IOError:
+                self.errors[index] += 1
+                return False
+        self.readings[index] = (v, a, soc, self.clock.time())
+        return True
+
+    def _run(self):
+        n = len(self.batts)
+        t0 = self.clock.monotonic()
+        due = [t0 + i*self.interval/n for i in range(n)]
+        for tick in Ticker(self.wake, clock=self.clock):
+            if self.ev.is_set():
+                break
+            for i in range(n):
+                if self.clock.monotonic() >= due[i]:
+                    self.poll(i)
+                    due[i] = max(due[i] + self.interval, self.clock.monotonic())
+
+    def start(self):
+        """
+        Start polling the batteries.
+        """
+        if not self.batts:
+            return
+        if self.sched is not None:
+            n = len(self.batts)
+            self.tasks = [self.sched.add(partial(self.poll, i), self.interval,
+                                         name="battery-{:d}".format(i),
+                                         priority=-5, delay=i*self.interval/n)
+                          for i in range(n)]
+        else:
+            self.ev.clear()
+            self.tid = Thread(target=self._run, name="battery-monitor", daemon=True)
+            self.clock.start_thread(self.tid)
+        self.logger.info("Start battery monitor; %d batteries every %.1f s",
+                         len(self.batts), self.interval)
+
+    def stop(self):
+        """
+        Stop polling the batteries.
+        """
+        if self.tasks:
+            assert self.sched is not None
+            for task in self.tasks:
+                self.sched.remove(task)
+            self.tasks = []
+        elif self.tid is not None:
+            self.ev.set()
+            self.clock.join(self.tid, timeout=2)
+            self.tid = None
+        else:
+            return
+        self.logger.info("Stop battery monitor; %s",
+                         " ".join("{}={}".format(k, v) for k, v in self.stats().items()))
+
+    def latest(self, index: int) -> BatteryState:
+        """
+        Return the latest reading of a battery. Before the first
+        successful poll the values are zero and the age is infinite.
+        """
+        val = self.readings[index]
+        if val is None:
+            return BatteryState(0., 0., 0, 0., float("inf"), self.errors[index])
+        v, a, soc, t = val
+        return BatteryState(v, a, soc, t, self.clock.time() - t, self.errors[index])
+
+    def batteries(self) -> List[Battery]:
+        """
+        Return Battery objects which read the cached values.
+        """
+        return [CachedBattery(self, i) for i in range(len(self.batts))]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the poll, retry and error counts.
+        """
+        return OrderedDict(polls=self.polls,
+                           retries=self.retries,
+                           errors=",".join(str(e) for e in self.errors))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.stop()
+        # Allow exceptions to propogate out
+        return False
+
+
+class ReadySampler(object):
+    """
+    Class to read an Adafruit_ADS1x15 ADC channel in continuous mode with
+    the ALERT/RDY pin, connected to a GPIO input line, signalling the end
+    of each conversion. Every conversion is passed to a callback, at the
+    ADC's data rate, from the GPIO edge detection thread. The ADC must
+    not be used by anything else while sampling, a single-shot
+    conversion switches it out of continuous mode.
+    """
+    # Comparator thresholds which make ALERT/RDY a conversion-ready
+    # signal (high threshold MSB set, low threshold MSB clear).
+    hi_thresh: int = 0x8000
+    lo_thresh: int = 0x0000
+
+    def __init__(self, adc: Any, line: int, chan: int, gain: float,
+                 data_rate: int, callback: Callable[[int], None]):
+        """
+        :param adc: ADC object
+        :param line: GPIO line connected to ALERT/RDY
+        :param chan: channel number
+        :param gain: gain value
+        :param data_rate: ADC samples per second
+        :param callback: function called with each conversion result
+        """
+        self.adc = adc
+        self.line = line
+        self.chan = chan
+        self.gain = gain
+        self.data_rate = data_rate
+        self.callback = callback
+        self.cb_thread = 0
+        self.logger = logging.getLogger("edna.adc")
+        # Serializes the ADC access of the GPIO thread and stop
+        self.lock = Lock()
+        self.running = False
+        GPIO.setup(self.line, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+
+    def start(self):
+        """
+        Start continuous conversions.
+        """
+        with self.lock:
+            self.adc.start_adc_comparator(self.chan, self.hi_thresh, self.lo_thresh,
+                                          active_low=False, traditional=True,
+                                          latching=False, num_readings=1,
+                                          gain=self.gain, data_rate=self.data_rate)
+            self.running = True
+        GPIO.add_event_detect(self.line, GPIO.RISING, callback=self._ready)
+        self.logger.info("Start ADC channel %d; %d samples/s, ALERT/RDY on GPIO %d",
+                         self.chan, self.data_rate, self.line)
+
+    def _ready(self, *args):
+        if self.cb_thread != get_ident():
+            self.cb_thread = get_ident()
+            configure_thread("adc-ready")
+        with self.lock:
+            if not self.running:
+                return
+            x = self.adc.get_last_result()
+        self.callback(x)
+
+    def stop(self):
+        """
+        Stop continuous conversions.
+        """
+        GPIO.remove_event_detect(self.line)
+        with self.lock:
+            self.running = False
+            self.adc.stop_adc()
+
+
+class AdcArbiter(object):
+    """
+    Class to share an Adafruit_ADS1x15 ADC between several consumers. The
+    arbiter owns the chip and converts the channels in use one at a time,
+    in turn, at a fixed conversion rate from its own thread (or a
+    scheduler task). It has the same interface as the ADC, so it can be
+    passed to PrSensor, Integrator and AnalogFlowMeter, and returns the
+    latest cached conversion of a channel instead of accessing the chip.
+    A channel is added to the schedule on its first read, which is a
+    direct conversion. This class is a Context Manager which starts the
+    conversions on entry and stops them on exit.
+    """
+    def __init__(self, adc: Any, rate: float, clock: Optional[Clock] = None,
+                 sched: Optional[Scheduler] = None):
+        """
+        :param adc: ADC object
+        :param rate: total conversions per second, each of N channels
+                     is converted rate/N times per second
+        :param clock: time source
+        :param sched: if specified, convert from this scheduler rather
+                      than a separate thread
+        """
+        self.adc = adc
+        self.rate = rate
+        self.clock = clock or get_clock()
+        self.sched = sched
+        self.logger = logging.getLogger("edna.adc")
+        self.lock = Lock()
+        self.gains: Dict[int, float] = OrderedDict()
+        self.values: Dict[int, Tuple[int, float]] = dict()
+        self.next = 0
+        self.conversions = 0
+        self.errors = 0
+        self.chan = -1
+        self.ev = Event()
+        self.tid: Any = None
+        self.task: Optional[Task] = None
+
+    def _convert(self, chan: int, gain: float) -> int:
+        with self.lock:
+            x = self.adc.read_adc(chan, gain=gain)
+        self.values[chan] = (x, self.clock.time())
+        self.conversions += 1
+        return x
+
+    def _step(self):
+        chans = list(self.gains.items())
+        if not chans:
+            return
+        chan, gain = chans[self.next % len(chans)]
+        self.next += 1
+        try:
+            self._convert(chan, gain)
+        except IOError:
+            self.errors += 1
+
+    def _run(self):
+        configure_thread("adc-arbiter")
+        for tick in Ticker(1./self.rate, clock=self.clock):
+            self._step()
+            if self.ev.is_set():
+                break
+
+    def start(self):
+        """
+        Start converting the channels.
+        """
+        if self.sched is not None:
+            self.task = self.sched.add(self._step, 1./self.rate,
+                                       name="adc-arbiter", priority=20)
+        else:
+            self.ev.clear()
+            self.tid = Thread(target=self._run, name="adc-arbiter", daemon=True)
+            self.clock.start_thread(self.tid)
+        self.logger.info("Start ADC arbiter; %.1f conversions/s", self.rate)
+
+    def stop(self):
+        """
+        Stop converting the channels.
+        """
+        if self.task is not None:
+            assert self.sched is not None
+            self.sched.remove(self.task)
+            self.task = None
+        if self.tid is not None:
+            self.ev.set()
+            self.clock.join(self.tid, timeout=2)
+            self.tid = None
+        self.logger.info("Stop ADC arbiter; %s",
+                         " ".join("{}={}".format(k, v) for k, v in self.stats().items()))
+
+    def latest(self, chan: int) -> Optional[Tuple[int, float]]:
+        """
+        Return the latest conversion of a channel and its time or None
+        if the channel has not been converted.
+        """
+        return self.values.get(chan)
+
+    def age(self, chan: int) -> float:
+        """
+        Return the age of the latest conversion of a channel in seconds.
+        """
+        val = self.values.get(chan)
+        if val is None:
+            return float("inf")
+        return self.clock.time() - val[1]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the conversion and error counts and the channels converted.
+        """
+        return OrderedDict(conversions=self.conversions,
+                           errors=self.errors,
+                           channels=",".join(str(c) for c in self.gains))
+
+    def read_adc(self, chan: int, gain: float = 1, data_rate: Any = None) -> int:
+        val = self.values.get(chan)
+        if val is not None:
+            return val[0]
+        self.gains[chan] = gain
+        self.logger.info("ADC channel %d added to the schedule", chan)
+        return self._convert(chan, gain)
+
+    def start_adc(self, chan: int, gain: float = 1, data_rate: Any = None) -> int:
+        self.chan = chan
+        return self.read_adc(chan, gain)
+
+    def get_last_result(self) -> int:
+        if self.chan == -1:
+            return 0
+        return self.read_adc(self.chan)
+
+    def stop_adc(self):
+        self.chan = -1
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.stop()
+        # Allow exceptions to propogate out
+        return False
 
 
 class PrSensor(object):
@@ -232,12 +757,18 @@ class PrSensor(object):
     vbase: float = 4.096
 
     def __init__(self, adc: Any, chan: int, gain: float,
-                 coeff: List[float] = [-10., 50.]):
+                 coeff: List[float] = [-10., 50.],
+                 clock: Optional[Clock] = None,
+                 rdy: int = 0, data_rate: int = 128):
         """
         :param adc: ADC object
         :param chan: channel number
         :param gain: gain value
         :param coeff: coefficients to convert volts to psi
+        :param clock: time source
+        :param rdy: GPIO line connected to the ADC ALERT/RDY pin, if
+                    non-zero read_burst uses every conversion
+        :param data_rate: ADC samples per second for read_burst with rdy
 
         The equation to convert volts to psi is:
 
@@ -248,6 +779,9 @@ class PrSensor(object):
         self.vmax = self.vbase/gain
         self.chan = chan
         self.coeff = coeff
+        self.clock = clock or get_clock()
+        self.rdy = rdy
+        self.data_rate = data_rate
 
     def read_volts(self) -> float:
         """
@@ -264,13 +798,17 @@ class PrSensor(object):
 
     def read_burst(self, n: int, interval: float) -> float:
         """
-        Return the mean of n values sampled interval seconds apart.
+        Return the mean of n values sampled interval seconds apart. If
+        the ALERT/RDY line is used, the mean of the next n conversions is
+        returned and interval is ignored.
         """
+        if self.rdy:
+            return self._read_ready(n)
         v = 0.
         self.adc.start_adc(self.chan, gain=self.gain)
         try:
             i = 0
-            for tick in ticker(interval):
+            for tick in ticker(interval, clock=self.clock):
                 alpha = 1./float(i + 1)
                 beta = 1. - alpha
                 x = self.adc.get_last_result()
@@ -282,10 +820,42 @@ class PrSensor(object):
             self.adc.stop_adc()
         return self.coeff[0] + v*self.coeff[1]
 
+    def _read_ready(self, n: int) -> float:
+        vals: List[int] = []
+        done = Event()
+
+        def take(x: int):
+            if len(vals) < n:
+                vals.append(x)
+                if len(vals) == n:
+                    done.set()
+
+        rs = ReadySampler(self.adc, self.rdy, self.chan, self.gain, self.data_rate, take)
+        rs.start()
+        try:
+            # Allow for twice the conversion time
+            with self.clock.waiting(done.is_set):
+                done.wait(timeout=1. + 2.*n/self.data_rate)
+        finally:
+            rs.stop()
+        if not vals:
+            raise IOError("no conversions from ADC channel {:d}".format(self.chan))
+        v = self.vmax*sum(vals)/len(vals)/32767.0
+        return self.coeff[0] + v*self.coeff[1]
+
 
 class Integrator(object):
     """
     Class to integrate an analog signal input to an an Adafruit_ADS1x15 A/D converter.
+
+    Each sample is stored, with its time since the start, in a
+    preallocated ring buffer and the signal is integrated with the
+    trapezoidal rule using the measured sample times, so late or missed
+    samples do not bias the integral. The sample times are taken from
+    the monotonic clock so a step of the system clock does not distort
+    the integral, only the reported elapsed time is wall-clock time.
+    The samples of the current run are available from the history
+    method.
     """
     adc: Any
     ev: Event
@@ -294,17 +864,30 @@ class Integrator(object):
     gain: float
     vmax: float
     t0: float = 0
+    m0: float = 0
     fncvt: Any
     vbase: float = 4.096
 
     def __init__(self, adc: Any, chan: int, gain: float,
-                 fncvt: Any):
+                 fncvt: Any, clock: Optional[Clock] = None,
+                 sched: Optional[Scheduler] = None,
+                 rdy: int = 0, data_rate: int = 128,
+                 size: int = 8192):
         """
         :param adc: ADC object
         :param chan: channel number
         :param gain: gain value
         :param fncvt: function to convert ADC voltage to
                       the value to integrate
+        :param clock: time source
+        :param sched: if specified, sample from this scheduler rather
+                      than a separate thread
+        :param rdy: GPIO line connected to the ADC ALERT/RDY pin, if
+                    non-zero every conversion is integrated as it
+                    completes and the sampling period is ignored
+        :param data_rate: ADC samples per second when rdy is used
+        :param size: number of samples kept in the history, older
+                     samples are overwritten
         """
         self.logger = logging.getLogger("integrator")
         self.adc = adc
@@ -314,16 +897,92 @@ class Integrator(object):
         self.vmax = self.vbase/gain
         self.ev = Event()
         self.tid = None
+        self.clock = clock or get_clock()
+        self.sched = sched
+        self.task: Optional[Task] = None
+        self.sum = 0.
+        self.rdy = rdy
+        self.data_rate = data_rate
+        self.rs: Optional[ReadySampler] = None
+        self.size = size
+        self.times = array("d", bytes(8*size))
+        self.values = array("d", bytes(8*size))
+        self.count = 0
+        self.lock = Lock()
+
+    def _add(self, q: deque, x: int):
+        y = self.fncvt(self.vmax*x/32767.0)
+        t = self.clock.monotonic() - self.m0
+        with self.lock:
+            if self.count == 0:
+                # The signal is assumed constant before the first sample
+                self.sum += y*t
+            else:
+                i = (self.count - 1) % self.size
+                self.sum += 0.5*(self.values[i] + y)*(t - self.times[i])
+            i = self.count % self.size
+            self.times[i] = t
+            self.values[i] = y
+            self.count += 1
+        q.appendleft((self.sum, self.clock.time() - self.t0))
+
+    def _step(self, q: deque):
+        self._add(q, self.adc.get_last_result())
+
+    def rate(self) -> float:
+        """
+        Return the latest value of the integrated signal (e.g. the flow
+        rate for a flow meter), zero if there are no samples.
+        """
+        with self.lock:
+            if self.count == 0:
+                return 0.
+            return self.values[(self.count - 1) % self.size]
+
+    def mean_rate(self, window: float) -> float:
+        """
+        Return the mean value of the integrated signal over the last
+        window seconds of samples, or over the samples in the history
+        if they span less time.
+        """
+        t, y = self.history()
+        n = len(t)
+        if n == 0:
+            return 0.
+        if n == 1:
+            return y[0]
+        start = t[-1] - window
+        i = max(bisect.bisect_left(t, start) - 1, 0)
+        area = 0.
+        for j in range(i, n-1):
+            t0, y0 = t[j], y[j]
+            if t0 < start:
+                # Interpolate the value at the start of the window
+                y0 = y0 + (y[j+1] - y0)*(start - t0)/(t[j+1] - t0)
+                t0 = start
+            area += 0.5*(y0 + y[j+1])*(t[j+1] - t0)
+        span = t[-1] - max(t[i], start)
+        return area/span if span > 0 else y[-1]
+
+    def history(self) -> Tuple[array, array]:
+        """
+        Return the times, in seconds since the start, and the values of
+        the samples in the history, oldest first.
+        """
+        with self.lock:
+            n = self.count
+            if n <= self.size:
+                return self.times[:n], self.values[:n]
+            j = n % self.size
+            return (self.times[j:] + self.times[:j],
+                    self.values[j:] + self.values[:j])
 
     def _integrate(self, interval: float, q: deque):
+        configure_thread("integrator")
         self.adc.start_adc(self.chan, gain=self.gain)
-        sum = float(0.)
         try:
-            for tick in ticker(interval):
-                x = self.adc.get_last_result()
-                v = self.vmax*x/32767.0
-                sum += (self.fncvt(v) * interval)
-                q.appendleft((sum, time.time() - self.t0))
+            for tick in ticker(interval, clock=self.clock):
+                self._step(q)
                 if self.ev.is_set():
                     break
         finally:
@@ -331,36 +990,66 @@ class Integrator(object):
 
     def start(self, period: float, q: deque):
         """
-        Start a thread to sample and integrate the signal at the specified
-        period and write the integral values to a Queue
+        Start a thread (or scheduler task) to sample and integrate the
+        signal at the specified period and write the integral values to
+        a Queue
         """
-        if self.tid is not None:
+        if self.tid is not None or self.task is not None or self.rs is not None:
             self.stop()
-        self.tid = Thread(target=self._integrate,
-                          args=(period, q), daemon=True)
-        self.ev.clear()
-        self.t0 = time.time()
-        self.tid.start()
+        self.sum = 0.
+        self.count = 0
+        self.t0 = self.clock.time()
+        self.m0 = self.clock.monotonic()
+        if self.rdy:
+            self.rs = ReadySampler(self.adc, self.rdy, self.chan, self.gain,
+                                   self.data_rate, partial(self._add, q))
+            self.rs.start()
+        elif self.sched is not None:
+            self.adc.start_adc(self.chan, gain=self.gain)
+            self.task = self.sched.add(partial(self._step, q), period,
+                                       name="integrator", priority=10)
+        else:
+            self.tid = Thread(target=self._integrate,
+                              args=(period, q), daemon=True)
+            self.ev.clear()
+            self.clock.start_thread(self.tid)
         self.logger.info("Start integrator; period = %.2fs", period)
 
     def stop(self):
+        if self.rs is not None:
+            self.rs.stop()
+            self.rs = None
+            self.logger.info("Stop integrator")
+        if self.task is not None:
+            assert self.sched is not None
+            self.sched.remove(self.task)
+            self.adc.stop_adc()
+            self.logger.info("Stop integrator; %s",
+                             " ".join("{}={}".format(k, v)
+                                      for k, v in self.task.stats().items()))
+            self.task = None
         if self.tid is not None:
             self.ev.set()
-            self.tid.join(timeout=2)
+            self.clock.join(self.tid, timeout=2)
             self.tid = None
             self.logger.info("Stop integrator")
 
 
 class AnalogFlowMeter(Integrator):
     """
-    Class to represent a Renesas FS2012 flow sensor interfaced to an ADC channel
+    Class to represent a Renesas FS2012 flow sensor interfaced to an ADC
+    channel. The flow rates returned by rate, mean_rate and history are
+    in cc/s.
     """
     def __init__(self, adc: Any, chan: int, gain: float,
-                 coeff: List[float]):
+                 coeff: List[float], clock: Optional[Clock] = None,
+                 sched: Optional[Scheduler] = None,
+                 rdy: int = 0, data_rate: int = 128):
         def cvt(v: float) -> float:
             return coeff[0] + coeff[1]*v
         self.period = 0.1
-        super().__init__(adc, chan, gain, cvt)
+        super().__init__(adc, chan, gain, cvt, clock=clock, sched=sched,
+                         rdy=rdy, data_rate=data_rate)
 
     def reset(self):
         self.q = deque([], 1)
@@ -374,7 +1063,9 @@ class AnalogFlowMeter(Integrator):
         if self.q is None:
             return (0., 0.)
         try:
-            rec = self.q.pop()
+            # Peek at the latest value, the integrator may not have
+            # produced a new one since the last call.
+            rec = self.q[0]
             # Convert cc to liters
             return (rec[0]/1000., rec[1])
         except IndexError:
@@ -424,8 +1115,18 @@ class LED(object):
     tid: Any
     ev: Event
 
-    def __init__(self, line: int):
+    def __init__(self, line: int, clock: Optional[Clock] = None,
+                 sched: Optional[Scheduler] = None):
+        """
+        :param line: GPIO line
+        :param clock: time source
+        :param sched: if specified, run the fader from this scheduler
+                      rather than a separate thread
+        """
         self.line = line
+        self.clock = clock or get_clock()
+        self.sched = sched
+        self.task: Optional[Task] = None
         GPIO.setup(self.line, GPIO.OUT)
         self.tid = None
         self.ev = Event()
@@ -454,13 +1155,16 @@ class LED(object):
             self.ctlr = None
             self.logger.info("Stop LED blinker")
 
+    def _fade_step(self, gen: Iterator[float]):
+        y = next(gen)
+        if self.ctlr is not None:
+            self.ctlr.ChangeDutyCycle(y*100)
+
     def _fader(self, period: float):
         rate = 0.1
         gen = sawtooth(int(period/rate))
-        for tick in ticker(0.1):
-            y = next(gen)
-            if self.ctlr is not None:
-                self.ctlr.ChangeDutyCycle(y*100)
+        for tick in ticker(rate, clock=self.clock):
+            self._fade_step(gen)
             if self.ev.is_set():
                 break
 
@@ -469,29 +1173,42 @@ class LED(object):
         Start LED fade in/out. For best results, the period should be at
         least 5 seconds long.
         """
-        if self.tid is not None:
+        if self.tid is not None or self.task is not None:
             self.stop_fade()
         if self.ctlr is not None:
             self.ctlr.stop()
         self.ctlr = GPIO.PWM(self.line, 50)
         self.ctlr.start(0)
-        self.tid = Thread(target=self._fader,
-                          args=(period,), daemon=True)
-        self.ev.clear()
-        self.tid.start()
+        if self.sched is not None:
+            rate = 0.1
+            self.task = self.sched.add(partial(self._fade_step,
+                                               sawtooth(int(period/rate))),
+                                       rate, name="led-fader", priority=-10)
+        else:
+            self.tid = Thread(target=self._fader,
+                              args=(period,), daemon=True)
+            self.ev.clear()
+            self.clock.start_thread(self.tid)
         self.logger.info("Start LED fader; period = %.2fs", period)
 
     def stop_fade(self):
         """
         Stop LED fade in/out
         """
-        if self.tid is not None:
+        if self.task is not None:
+            assert self.sched is not None
+            self.sched.remove(self.task)
+            self.task = None
+        elif self.tid is not None:
             self.ev.set()
-            self.tid.join(timeout=2)
+            self.clock.join(self.tid, timeout=2)
             self.tid = None
-            self.ctrl.stop()
-            self.ctrl = None
-            self.logger.info("Stop LED fader")
+        else:
+            return
+        if self.ctlr is not None:
+            self.ctlr.stop()
+            self.ctlr = None
+        self.logger.info("Stop LED fader")
 
 
 @contextmanager
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.replay
+     :platform: any
+     :synopsis: replay a recorded deployment through the sampling code
+
+The values logged during a deployment are fed back to
+:func:`edna.sample.seekdepth` and :func:`edna.sample.flow_monitor`
+through replay versions of the A/D converter and the Smart Battery
+SMBus interface. The logged depth, filter pressure and flow rate are
+converted back to A/D counts using the calibration coefficients from
+the deployment configuration, so the sensor classes from
+:mod:`edna.periph` are used unchanged. Each device returns the value
+logged at the current replay time, filter pressure and flow rate are
+replayed relative to the start of pumping. Replay time starts at the
+time of the first record and runs on a simulated clock (speed 0) or
+*speed* times faster than real time::
+
+    >>> rec = Recording("OUTBOX/edna_20210601T120000.tar.gz")
+    >>> r = Replay(rec, load_config("OUTBOX/edna_20210601T120000.tar.gz"))
+    >>> with open("replay.ndjson", "w") as f:
+    ...     results = r.run(Datafile(f))
+"""
+from . import periph
+from .archive import records
+from .clock import Clock, ScaledClock, SimClock
+from .timing import COALESCE
+from .config import Config
+from .sample import Datafile, FlowLimits, flow_monitor, seekdepth
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from array import array
+import bisect
+import datetime
+import io
+import logging
+import os.path
+import re
+import tarfile
+
+
+# Numbered sample events
+_sample = re.compile(r"^sample\.(\d+)$")
+# Battery events
+_battery = re.compile(r"^battery-(\d+)$")
+# Sample results
+_result = re.compile(r"^result\.(\d+)$")
+
+
+def timestamp(t: str) -> float:
+    """
+    Convert an ISO-8601 record time to seconds since the epoch.
+    """
+    return datetime.datetime.fromisoformat(t).timestamp()
+
+
+class Stream(object):
+    """
+    Time series of logged values. Values are looked up by time and each
+    value holds until the next one is logged.
+    """
+    def __init__(self, initial: Any = 0.):
+        self.initial = initial
+        self.t = array("d")
+        self.v: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def append(self, t: float, v: Any):
+        self.t.append(t)
+        self.v.append(v)
+
+    def at(self, t: float) -> Any:
+        """
+        Return the value logged at or before time t.
+        """
+        i = bisect.bisect_right(self.t, t)
+        return self.v[i-1] if i > 0 else self.initial
+
+
+class SampleTrack(object):
+    """
+    Filter pressure and flow rate logged during one sample. The times
+    are relative to the start of pumping.
+    """
+    def __init__(self, index: int, start: float, depth: float):
+        self.index = index
+        self.start = start
+        self.depth = depth
+        self.elapsed = 0.
+        self.amount = 0.
+        self.pr = Stream(0.)
+        # Flow rate in cc/s
+        self.flow = Stream(0.)
+
+    def add(self, elapsed: float, amount: float, pr: float):
+        if elapsed > self.elapsed:
+            rate = (amount - self.amount)*1000./(elapsed - self.elapsed)
+            self.flow.append(self.elapsed, rate)
+        self.pr.append(elapsed, pr)
+        self.elapsed = elapsed
+        self.amount = amount
+
+    def flow_rate(self, t: float) -> float:
+        """
+        Return the flow rate t seconds after the start of pumping, zero
+        after the end of the sample.
+        """
+        return self.flow.at(t) if t < self.elapsed else 0.
+
+
+class Recording(object):
+    """
+    Class to hold the logged sensor values from a deployment directory,
+    OUTBOX archive or data file. Depths and battery values are replayed
+    at the logged times, sample values relative to the start of each
+    sample so the replayed pumping always matches the recorded one.
+    The recorded result of each sample is kept for the values which are
+    not replayed (the ethanol flush).
+    """
+    depth: Stream
+    batteries: Dict[int, Stream]
+    samples: List[SampleTrack]
+    results: Dict[int, Dict[str, Any]]
+
+    def __init__(self, path: str):
+        """
+        :param path: deployment source
+        """
+        self.path = path
+        self.depth = Stream(0.)
+        self.batteries = dict()
+        self.samples = []
+        self.results = dict()
+        self.t0 = 0.
+        self.t1 = 0.
+        track: Optional[SampleTrack] = None
+        for t, event, data in records(path):
+            if not isinstance(data, dict):
+                continue
+            ts = timestamp(t)
+            if not self.t0:
+                self.t0 = ts
+            self.t1 = max(self.t1, ts)
+            if event == "depth":
+                self.depth.append(ts, data["depth"])
+                continue
+            m = _sample.match(event)
+            if m:
+                index = int(m.group(1))
+                self.depth.append(ts, data["depth"])
+                if track is None or track.index != index or data["elapsed"] < track.elapsed:
+                    track = SampleTrack(index, ts, data["depth"])
+                    self.samples.append(track)
+                track.add(data["elapsed"], data["amount"], data["pr"])
+                continue
+            m = _battery.match(event)
+            if m:
+                b = self.batteries.setdefault(int(m.group(1)), Stream((0., 0., 0)))
+                b.append(ts, (data["v"], data["a"], data["soc"]))
+                continue
+            m = _result.match(event)
+            if m:
+                self.results[int(m.group(1))] = data
+
+    def ethanol(self, index: int) -> Tuple[float, float]:
+        """
+        Return the recorded ethanol volume and pumping time of a sample,
+        zero if the sample has no recorded result. The pumping time is
+        the part of the result's elapsed time after the sample pumping.
+        """
+        result = self.results.get(index)
+        track = self.sample(index)
+        if result is None or track is None:
+            return 0., 0.
+        return (result.get("vethanol", 0.),
+                max(result.get("elapsed", 0.) - track.elapsed, 0.))
+
+    def sample(self, index: int) -> Optional[SampleTrack]:
+        """
+        Return the last recorded track of a sample.
+        """
+        for s in reversed(self.samples):
+            if s.index == index:
+                return s
+        return None
+
+
+def volts_to_counts(v: float, gain: float) -> int:
+    """
+    Convert a voltage to ADS1x15 counts, out of range values saturate.
+    """
+    x = int(round(v*32767.0*gain/periph.PrSensor.vbase))
+    return max(-32768, min(32767, x))
+
+
+class ReplayAdc(object):
+    """
+    Replay version of the Adafruit_ADS1x15 A/D converter interface.
+    """
+    def __init__(self, rec: Recording, cfg: Config, clock: Clock):
+        """
+        :param rec: deployment recording
+        :param cfg: deployment configuration
+        :param clock: replay clock
+        """
+        self.rec = rec
+        self.clock = clock
+        self.chan = -1
+        self.gain = 1.
+        self.track: Optional[SampleTrack] = None
+        self.t_start = 0.
+        self.volts: Dict[int, Callable[[float], float]] = dict()
+        c = cfg.get_array("Pressure.Env", "Coeff")
+        self.volts[cfg.get_int("Pressure.Env", "Chan")] = \
+            lambda t: (rec.depth.at(t)/periph.psi_to_dbar(1.) - c[0])/c[1]
+        f = cfg.get_array("Pressure.Filter", "Coeff")
+        self.volts[cfg.get_int("Pressure.Filter", "Chan")] = \
+            lambda t: (self._sample_pr(t) - f[0])/f[1]
+        a = cfg.get_array("AnalogFlowSensor", "Coeff")
+        self.volts[cfg.get_int("AnalogFlowSensor", "Chan")] = \
+            lambda t: (self._sample_flow(t) - a[0])/a[1]
+
+    def start_sample(self, index: int):
+        """
+        Start replaying the filter pressure and flow rate of a sample.
+        """
+        self.track = self.rec.sample(index)
+        self.t_start = self.clock.time()
+
+    def stop_sample(self):
+        self.track = None
+
+    def _sample_pr(self, t: float) -> float:
+        return self.track.pr.at(t - self.t_start) if self.track else 0.
+
+    def _sample_flow(self, t: float) -> float:
+        return self.track.flow_rate(t - self.t_start) if self.track else 0.
+
+    def read_adc(self, chan: int, gain: float = 1, data_rate: Any = None) -> int:
+        fv = self.volts.get(chan)
+        if fv is None:
+            return 0
+        return volts_to_counts(fv(self.clock.time()), gain)
+
+    def start_adc(self, chan: int, gain: float = 1, data_rate: Any = None) -> int:
+        self.chan = chan
+        self.gain = gain
+        return self.read_adc(self.chan, self.gain)
+
+    def get_last_result(self) -> int:
+        if self.chan == -1:
+            return 0
+        return self.read_adc(self.chan, self.gain)
+
+    def stop_adc(self):
+        self.chan = -1
+
+
+class ReplaySMBus(object):
+    """
+    Replay version of the SMBus interface to a Smart Battery.
+    """
+    def __init__(self, stream: Stream, clock: Clock):
+        """
+        :param stream: logged (voltage, current, charge) values
+        :param clock: replay clock
+        """
+        self.stream = stream
+        self.clock = clock
+
+    def read_i2c_block_data(self, addr: int, reg: int, n: int) -> List[int]:
+        v, a, soc = self.stream.at(self.clock.time())
+        if reg == periph.Battery.msgs["voltage"]:
+            x = int(round(v*1000.))
+        elif reg == periph.Battery.msgs["current"]:
+            x = int(round(a*1000.)) & 0xffff
+        elif reg == periph.Battery.msgs["charge"]:
+            x = int(soc)
+        else:
+            raise IOError("Unsupported register {:#x}".format(reg))
+        return [x & 0xff, (x >> 8) & 0xff] + [0] * (n - 2)
+
+
+class ReplayResult(NamedTuple):
+    """
+    Result of replaying one sample.
+    """
+    index: int
+    depth: float
+    amount: float
+    elapsed: float
+    overpressure: bool
+    outofrange: bool
+
+
+def load_config(path: str) -> Config:
+    """
+    Load the configuration saved with a deployment directory or OUTBOX
+    archive.
+    """
+    if os.path.isdir(path):
+        return Config(os.path.join(path, "deploy.cfg"))
+    with tarfile.open(path, "r:*") as tar:
+        for member in tar:
+            if os.path.basename(member.name) == "deploy.cfg":
+                fp = tar.extractfile(member)
+                if fp is not None:
+                    return Config(io.TextIOWrapper(fp, encoding="utf-8"))
+    raise FileNotFoundError("No deploy.cfg in " + path)
+
+
+class Replay(object):
+    """
+    Class to run the deployment sampling sequence against a recording.
+    """
+    def __init__(self, rec: Recording, cfg: Config, speed: float = 0.,
+                 prfilt: Optional[Callable[[float], float]] = None):
+        """
+        :param rec: deployment recording
+        :param cfg: deployment configuration
+        :param speed: time compression factor, 0 to simulate time
+        :param prfilt: depth filter, the logged depths are already
+                       filtered so the default is no filter.
+        """
+        self.rec = rec
+        self.cfg = cfg
+        self.prfilt = prfilt or (lambda x: x)
+        self.logger = logging.getLogger("edna.replay")
+        self.clock: Clock
+        if speed > 0:
+            self.clock = ScaledClock(speed, t0=rec.t0)
+        else:
+            self.clock = SimClock(t0=rec.t0)
+        self.adc = adc = ReplayAdc(rec, cfg, self.clock)
+        self.env = periph.PrSensor(adc,
+                                   cfg.get_int("Pressure.Env", "Chan"),
+                                   cfg.get_expr("Pressure.Env", "Gain"),
+                                   coeff=cfg.get_array("Pressure.Env", "Coeff"),
+                                   clock=self.clock)
+        self.filter = periph.PrSensor(adc,
+                                      cfg.get_int("Pressure.Filter", "Chan"),
+                                      cfg.get_expr("Pressure.Filter", "Gain"),
+                                      coeff=cfg.get_array("Pressure.Filter", "Coeff"),
+                                      clock=self.clock)
+        self.prmax = cfg.get_float("Pressure.Filter", "Max")
+        self.fm = periph.AnalogFlowMeter(adc,
+                                         cfg.get_int("AnalogFlowSensor", "Chan"),
+                                         cfg.get_expr("AnalogFlowSensor", "Gain"),
+                                         cfg.get_array("AnalogFlowSensor", "Coeff"),
+                                         clock=self.clock)
+        self.batts = [periph.Battery(ReplaySMBus(rec.batteries[i], self.clock))
+                      for i in sorted(rec.batteries)]
+
+    def checkpr(self) -> Tuple[float, bool]:
+        psi = self.filter.read()
+        return psi, psi < self.prmax
+
+    def checkdepth(self, limits: Tuple[float, float]) -> Tuple[float, bool]:
+        dbar = periph.psi_to_dbar(self.env.read())
+        return self.prfilt(dbar), limits[0] <= dbar <= limits[1]
+
+    def run(self, df: Optional[Datafile] = None) -> List[ReplayResult]:
+        """
+        Replay the deployment sampling sequence and return the result of
+        each sample. The ethanol flush is not replayed, the ethanol volume
+        and pumping time in the result records are the recorded ones.
+        """
+        cfg = self.cfg
+        seek_err = cfg.get_float("Deployment", "SeekErr")
+        depth_err = cfg.get_float("Deployment", "DepthErr")
+        pr_rate = cfg.get_float("Deployment", "PrRate")
+        seek_time = cfg.get_int("Deployment", "SeekTime")
+        downcast = cfg.get_bool("Deployment", "Downcast")
+        rate = cfg.get_float("FlowSensor", "Rate")
+        catchup = cfg.get_string("Timing", "CatchUp", COALESCE).lower()
+        trace = cfg.get_bool("Timing", "Trace")
+        blog = cfg.get_float("Battery", "LogInterval", 0.)
+        limit = FlowLimits(amount=cfg.get_float("Collect.Sample", "Amount"),
+                           time=cfg.get_float("Collect.Sample", "Time"))
+        depths = []
+        for i, key in enumerate(["Sample.1", "Sample.2", "Sample.3"]):
+            depths.append((cfg.get_float(key, "Depth"), i+1))
+        depths.sort(key=lambda e: e[0], reverse=not downcast)
+
+        results = []
+        for target, index in depths:
+            self.logger.info("Seeking depth for sample %d; %.2f +/- %.2f",
+                             index, target, seek_err)
+            drange = (target-seek_err, target+seek_err)
+            depth, status = seekdepth(df,
+                                      partial(self.checkdepth, drange),
+                                      pr_rate,
+                                      seek_time,
+                                      self.batts,
+                                      clock=self.clock,
+                                      catchup=catchup,
+                                      trace=trace,
+                                      blog=blog)
+            if not status:
+                self.logger.critical("Depth seek time limit expired")
+                break
+            drange = (depth-depth_err, depth+depth_err)
+            self.adc.start_sample(index)
+            amount, secs, ovp, oor = flow_monitor(df, "sample."+str(index),
+                                                  nullcontext(),  # type: ignore
+                                                  self.fm,
+                                                  rate,
+                                                  limit,
+                                                  self.checkpr,
+                                                  partial(self.checkdepth, drange),
+                                                  self.batts,
+                                                  clock=self.clock,
+                                                  catchup=catchup,
+                                                  trace=trace,
+                                                  blog=blog)
+            self.fm.stop()
+            self.adc.stop_sample()
+            results.append(ReplayResult(index, depth, amount, secs, ovp, oor))
+            if df is not None:
+                vethanol, e_secs = self.rec.ethanol(index)
+                df.add_record("result."+str(index),
+                              OrderedDict(elapsed=round(secs+e_secs, 3),
+                                          vwater=round(amount, 3),
+                                          vethanol=round(vethanol, 3),
+                                          overpressure=ovp,
+                                          deptherror=oor),
+                              ts=self.clock.time())
+        return results
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.rt
+     :platform: Linux
+     :synopsis: CPU affinity and real-time scheduling of sampling threads
+
+The threads which sample the sensors (flow sensor integrator, pulse
+counter callbacks, task scheduler and acquisition process) call
+:func:`configure_thread` when they start. If a policy has been set with
+:func:`set_policy`, the thread is pinned to the policy's CPUs and
+switched to the SCHED_FIFO scheduler at the policy's priority::
+
+    >>> set_policy(RtPolicy(cpus=(3,), priority=50))
+
+Real-time priorities need the CAP_SYS_NICE capability or an RLIMIT_RTPRIO
+limit (see runedna@.service), when they are not permitted a warning is
+logged and the thread runs with the normal scheduler. The scheduling
+achieved by each thread is logged.
+"""
+from typing import NamedTuple, Optional, Tuple
+import logging
+import os
+
+
+class RtPolicy(NamedTuple):
+    """
+    CPUs to run the sampling threads on (empty for any) and their
+    SCHED_FIFO priority (zero to keep the normal scheduler).
+    """
+    cpus: Tuple[int, ...] = ()
+    priority: int = 0
+
+
+# Process-wide sampling thread policy
+_policy: Optional[RtPolicy] = None
+
+
+def get_policy() -> Optional[RtPolicy]:
+    """
+    Return the sampling thread policy.
+    """
+    return _policy
+
+
+def set_policy(policy: Optional[RtPolicy]) -> Optional[RtPolicy]:
+    """
+    Set the sampling thread policy and return the previous one.
+    """
+    global _policy
+    prev, _policy = _policy, policy
+    return prev
+
+
+def describe() -> str:
+    """
+    Return the scheduling policy, priority and CPU affinity of the
+    calling thread.
+    """
+    names = dict()
+    for name in ("OTHER", "FIFO", "RR", "BATCH", "IDLE"):
+        if hasattr(os, "SCHED_"+name):
+            names[getattr(os, "SCHED_"+name)] = "SCHED_" + name
+    try:
+        policy = os.sched_getscheduler(0)
+        priority = os.sched_getparam(0).sched_priority
+        cpus = sorted(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return "unavailable"
+    return "policy={} priority={:d} cpus={}".format(names.get(policy, str(policy)),
+                                                   priority,
+                                                   ",".join(str(c) for c in cpus))
+
+
+def configure_thread(name: str, policy: Optional[RtPolicy] = None) -> str:
+    """
+    Apply a policy, by default the one set with set_policy, to the
+    calling thread. Return the scheduling achieved, or an empty string if
+    there is no policy.
+
+    :param name: thread name for the log
+    :param policy: policy to apply
+    """
+    policy = policy or _policy
+    if policy is None:
+        return ""
+    logger = logging.getLogger("edna.rt")
+    if policy.cpus:
+        try:
+            os.sched_setaffinity(0, policy.cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning("%s: cannot set CPU affinity %s; %s", name,
+                           ",".join(str(c) for c in policy.cpus), str(e))
+    if policy.priority > 0:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(policy.priority))
+        except (AttributeError, OSError) as e:
+            logger.warning("%s: cannot use SCHED_FIFO priority %d; %s", name,
+                           policy.priority, str(e))
+    desc = describe()
+    logger.info("%s thread scheduling: %s", name, desc)
+    return desc
@@ -4,12 +4,22 @@
      :platform: any
      :synopsis: eDNA data collection functions
 """
-from . import periph, ticker
+from . import periph
+from .clock import Clock, get_clock
+from .timing import Ticker, LATE_BINS, COALESCE
+from .trace import Tracer, NullTracer, PERCENTILES
 from collections import OrderedDict, namedtuple
 from typing import Mapping, Any, List, Callable, Tuple, \
-    Optional, Union
+    Optional, Union, NamedTuple, Dict, Iterator, Sequence
+from threading import Thread
+from fnmatch import fnmatch
+from array import array
+import bisect
+import heapq
 import datetime
 import json
+import os
+import queue
 import time
 import logging
 
@@ -25,65 +35,612 @@ class DepthError(Exception):
     pass
 
 
+# Field types for RecordEncoder
+FLOAT = "f"
+BOOL = "b"
+INT = "d"
+
+
+class TimeFormatter(object):
+    """
+    Format timestamps as ISO-8601 strings with millisecond resolution,
+    identical to the output of datetime.isoformat. The date and time of
+    the current second are cached so only the sub-second part is
+    computed for timestamps within the same second.
+    """
+    def __init__(self):
+        self.sec = -1
+        self.prefix = ""
+
+    def __call__(self, ts: float) -> str:
+        sec = int(ts)
+        # Round to microseconds like datetime.fromtimestamp
+        us = round((ts - sec)*1e6)
+        if us >= 1000000:
+            sec += 1
+            us -= 1000000
+        if sec != self.sec:
+            t = datetime.datetime.fromtimestamp(sec, tz=datetime.timezone.utc)
+            self.prefix = t.strftime("%Y-%m-%dT%H:%M:%S.")
+            self.sec = sec
+        return "%s%03d+00:00" % (self.prefix, us // 1000)
+
+
+class RecordEncoder(object):
+    """
+    Precompiled NDJSON encoder for records with a fixed event name and
+    set of data fields. Each field is described by a (name, type) tuple
+    where type is FLOAT (written with three decimal places), BOOL or INT.
+    Values are passed in field order. A record with a NaN or infinite
+    float is written by json.dumps, as by Datafile.add_record, since
+    the precompiled format would write them as bare nan or inf.
+    """
+    def __init__(self, event: str, fields: Tuple[Tuple[str, str], ...],
+                 tfmt: Optional[TimeFormatter] = None):
+        self.event = event
+        self.fields = fields
+        self.names = tuple(f[0] for f in fields)
+        self.tfmt = tfmt or TimeFormatter()
+        specs = {FLOAT: "%.3f", BOOL: "%s", INT: "%d"}
+        items = ", ".join(json.dumps(name).replace("%", "%%") + ": " + specs[kind]
+                          for name, kind in fields)
+        self.fmt = ('{"t": "%s", "event": ' + json.dumps(event).replace("%", "%%") +
+                    ', "data": {' + items + '}}\n')
+        # Indicies of the boolean and float fields
+        self.bools = tuple(i for i, f in enumerate(fields) if f[1] == BOOL)
+        self.floats = tuple(i for i, f in enumerate(fields) if f[1] == FLOAT)
+
+    def encode(self, values: Tuple[Any, ...], ts: float) -> str:
+        """
+        Return a data file line for the values and timestamp.
+        """
+        for i in self.floats:
+            x = values[i]
+            # False for NaN and infinity
+            if x - x != 0:
+                rec = OrderedDict(t=self.tfmt(ts), event=self.event,
+                                  data=self.asdict(values))
+                return json.dumps(rec) + "\n"
+        if self.bools:
+            vals = list(values)
+            for i in self.bools:
+                vals[i] = "true" if vals[i] else "false"
+            values = tuple(vals)
+        return self.fmt % ((self.tfmt(ts),) + tuple(values))
+
+    def asdict(self, values: Tuple[Any, ...]) -> Mapping[str, Any]:
+        """
+        Return the values as a data record.
+        """
+        data: Dict[str, Any] = OrderedDict()
+        for (name, kind), val in zip(self.fields, values):
+            if kind == FLOAT:
+                data[name] = round(val, 3)
+            elif kind == BOOL:
+                data[name] = bool(val)
+            else:
+                data[name] = int(val)
+        return data
+
+
+# Shared timestamp formatter and encoder registry
+_tfmt = TimeFormatter()
+_encoders: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], RecordEncoder] = dict()
+
+
+def register_event(event: str, fields: Tuple[Tuple[str, str], ...]) -> RecordEncoder:
+    """
+    Return the encoder for an event record shape, creating it on first use.
+    """
+    key = (event, fields)
+    enc = _encoders.get(key)
+    if enc is None:
+        enc = RecordEncoder(event, fields, _tfmt)
+        _encoders[key] = enc
+    return enc
+
+
+# Record shapes of the sampling functions
+SampleFields = (("elapsed", FLOAT), ("amount", FLOAT), ("pr", FLOAT),
+                ("pr_ok", BOOL), ("depth", FLOAT))
+BatteryFields = (("v", FLOAT), ("a", FLOAT), ("soc", INT))
+DepthFields = (("depth", FLOAT),)
+# Sampling loop timing summary, lateness in milliseconds. The hN fields
+# count ticks less than N ms late, hmax counts the rest.
+TimingFields = ((("rate", FLOAT), ("actual", FLOAT), ("ticks", INT), ("missed", INT),
+                 ("late_max", FLOAT), ("late_mean", FLOAT)) +
+                tuple(("h"+str(b), INT) for b in LATE_BINS) + (("hmax", INT),))
+# Ticks dropped by a sampling loop and the loop period in seconds
+GapFields = (("skipped", INT), ("interval", FLOAT))
+
+# Traced stages of the flow_monitor and seekdepth loop ticks
+FlowStages = ("amount", "pr", "depth", "write", "battery")
+DepthStages = ("depth", "write", "battery")
+
+
+def sbs_fields(regs: Sequence[str]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Return the record shape of a set of Smart Battery registers (see
+    periph.Battery.registers).
+    """
+    return tuple((name, FLOAT) for name in regs)
+
+
+def trace_fields(stages: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Return the record shape of a trace summary. For each stage there is
+    a field for each of the span duration percentiles and the maximum,
+    in milliseconds, named <stage>_pNN and <stage>_max.
+    """
+    fields: List[Tuple[str, str]] = [("ticks", INT)]
+    for stage in stages:
+        fields.extend((stage+"_p"+str(p), FLOAT) for p in PERCENTILES)
+        fields.append((stage+"_max", FLOAT))
+    return tuple(fields)
+
+
 class Datafile(object):
     """
     Class to implement a newline-delimited JSON data file.
     """
-    def __init__(self, file):
+    def __init__(self, file, index: Any = None):
+        """
+        :param file: output file
+        :param index: optional text file for the record index
+
+        Each line of the index contains the event name, byte offset, and
+        timestamp of a record, separated by tabs.
+        """
         self.file = file
+        self.index = index
+        self.offset = 0
+        if index is not None:
+            try:
+                self.offset = file.tell()
+            except (AttributeError, OSError):
+                pass
 
     def add_record(self, event: str, data: Record, ts: float = 0):
         """
         Append a record to the file. If the timestamp, ts, is zero, the
         current time is used.
         """
-        if ts == 0:
-            t = datetime.datetime.now(tz=datetime.timezone.utc)
-        else:
-            t = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+        ts = ts or get_clock().time()
+        t = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
         rec = OrderedDict(t=t.isoformat(sep='T', timespec='milliseconds'),
                           event=event, data=data)
-        self.file.write(json.dumps(rec) + "\n")
+        self._write(event, json.dumps(rec) + "\n", ts)
+
+    def add_values(self, enc: RecordEncoder, values: Tuple[Any, ...], ts: float = 0):
+        """
+        Append a record encoded from a sequence of values. If the
+        timestamp, ts, is zero, the current time is used.
+        """
+        ts = ts or get_clock().time()
+        self._write(enc.event, enc.encode(values, ts), ts)
+
+    def _write(self, event: str, line: str, ts: float):
+        self.file.write(line)
+        if self.index is not None:
+            self.index.write("{}\t{:d}\t{:.3f}\n".format(event, self.offset, ts))
+            # JSON output is pure ASCII, characters are bytes
+            self.offset += len(line)
+
+    def flush(self, sync: bool = False):
+        """
+        Flush buffered output to the operating system. If sync is True,
+        also force the data onto the storage device.
+        """
+        self.file.flush()
+        if self.index is not None:
+            self.index.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+            if self.index is not None:
+                os.fsync(self.index.fileno())
+
+    def close(self):
+        """
+        Flush all output to the storage device. The underlying file is
+        owned by the caller and is not closed.
+        """
+        self.flush(sync=True)
+
+
+class FlushPolicy(NamedTuple):
+    """
+    When a BufferedDatafile flushes its output. A flush is performed
+    after every *records* records or every *interval* seconds (zero
+    disables either criterion) and is followed by an fsync if *sync* is
+    True. Records whose event name matches one of the *events* patterns
+    (see fnmatch) are flushed and synced as soon as they are written.
+    """
+    records: int = 100
+    interval: float = 5.0
+    events: Tuple[str, ...] = ("result.*",)
+    sync: bool = False
+
+
+class BufferedDatafile(Datafile):
+    """
+    Wrap a Datafile so that records are written by a background thread
+    rather than by the caller. Records are passed to the writer through a
+    bounded queue, when the queue is full the caller blocks until space
+    is available so records are never discarded. The following
+    back-pressure counters are maintained:
+
+    - enqueued: records accepted from the caller
+    - written: records written to the Datafile
+    - stalls: number of times the caller blocked on a full queue
+    - stall_time: total time in seconds spent blocked
+    - hiwater: maximum queue depth
+    - flushes, syncs: number of flush and fsync operations
+    - errors: number of failed writes
+    """
+    _FLUSH = object()
+
+    def __init__(self, df: Datafile, maxsize: int = 1024,
+                 policy: FlushPolicy = FlushPolicy()):
+        """
+        :param df: Datafile to write
+        :param maxsize: maximum number of queued records
+        :param policy: flush and fsync policy
+        """
+        super().__init__(df.file)
+        self.df = df
+        self.policy = policy
+        self.logger = logging.getLogger("edna.datafile")
+        self.q: queue.Queue = queue.Queue(maxsize)
+        self.enqueued, self.written, self.errors = 0, 0, 0
+        self.stalls, self.stall_time, self.hiwater = 0, 0., 0
+        self.flushes, self.syncs = 0, 0
+        self.tid: Optional[Thread] = Thread(target=self._writer, daemon=True)
+        self.tid.start()
+
+    def _put(self, item: Any):
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            self.stalls += 1
+            t0 = time.perf_counter()
+            self.q.put(item)
+            self.stall_time += time.perf_counter() - t0
+        n = self.q.qsize()
+        if n > self.hiwater:
+            self.hiwater = n
+
+    def add_record(self, event: str, data: Record, ts: float = 0):
+        """
+        Queue a record for the writer thread. If the timestamp, ts, is
+        zero, the current time is used.
+        """
+        if self.tid is None:
+            raise ValueError("write to closed BufferedDatafile")
+        self._put((event, data, ts or get_clock().time()))
+        self.enqueued += 1
+
+    def add_values(self, enc: RecordEncoder, values: Tuple[Any, ...], ts: float = 0):
+        """
+        Queue a record encoded from a sequence of values. If the
+        timestamp, ts, is zero, the current time is used.
+        """
+        if self.tid is None:
+            raise ValueError("write to closed BufferedDatafile")
+        self._put((enc, values, ts or get_clock().time()))
+        self.enqueued += 1
+
+    def _sync(self, sync: bool):
+        try:
+            self.df.flush(sync=sync)
+        except Exception:
+            self.logger.exception("Data file flush failed")
+            self.errors += 1
+            return
+        self.flushes += 1
+        if sync:
+            self.syncs += 1
+
+    def _writer(self):
+        policy = self.policy
+        pending = 0
+        t_flush = time.monotonic() + policy.interval
+        while True:
+            timeout = None
+            if pending and policy.interval > 0:
+                timeout = max(t_flush - time.monotonic(), 0)
+            try:
+                item = self.q.get(timeout=timeout)
+            except queue.Empty:
+                self._sync(policy.sync)
+                pending = 0
+                t_flush = time.monotonic() + policy.interval
+                continue
+
+            try:
+                if item is None:
+                    self._sync(True)
+                    break
+                if item is self._FLUSH:
+                    self._sync(True)
+                    pending = 0
+                    continue
+                event, data, ts = item
+                try:
+                    if isinstance(event, RecordEncoder):
+                        self.df.add_values(event, data, ts=ts)
+                        event = event.event
+                    else:
+                        self.df.add_record(event, data, ts=ts)
+                    self.written += 1
+                    pending += 1
+                except Exception:
+                    self.logger.exception("Cannot write %s record", event)
+                    self.errors += 1
+                    continue
+                if any(fnmatch(event, pat) for pat in policy.events):
+                    self._sync(True)
+                elif policy.records > 0 and pending >= policy.records:
+                    self._sync(policy.sync)
+                elif policy.interval > 0 and time.monotonic() >= t_flush:
+                    self._sync(policy.sync)
+                else:
+                    continue
+                pending = 0
+                t_flush = time.monotonic() + policy.interval
+            finally:
+                self.q.task_done()
 
+    def flush(self, sync: bool = False):
+        """
+        Wait for all queued records to be written then flush and sync
+        the Datafile.
+        """
+        if self.tid is not None:
+            self._put(self._FLUSH)
+            self.q.join()
+
+    def close(self):
+        """
+        Write all queued records, sync the Datafile and stop the writer
+        thread.
+        """
+        if self.tid is not None:
+            self._put(None)
+            self.tid.join()
+            self.tid = None
+
+    def stats(self) -> Mapping[str, Any]:
+        """
+        Return the back-pressure counters.
+        """
+        return OrderedDict(enqueued=self.enqueued,
+                           written=self.written,
+                           stalls=self.stalls,
+                           stall_time=round(self.stall_time, 3),
+                           hiwater=self.hiwater,
+                           flushes=self.flushes,
+                           syncs=self.syncs,
+                           errors=self.errors)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.close()
+        # Allow exceptions to propogate out
+        return False
+
+
+class IndexedDatafile(object):
+    """
+    Class to provide random access to the records of an NDJSON data file
+    using the index written alongside it by a Datafile. Records are
+    returned as (timestamp, event, data) tuples.
+    """
+    offsets: Dict[str, array]
+    times: Dict[str, array]
+
+    def __init__(self, path: str, index: str = ""):
+        """
+        :param path: data file name
+        :param index: index file name, defaults to path + ".idx"
+        """
+        self.path = path
+        self.offsets, self.times = dict(), dict()
+        with open(index or path + ".idx", "r") as f:
+            for line in f:
+                fields = line.split("\t")
+                if len(fields) != 3 or not line.endswith("\n"):
+                    # Partial entry
+                    continue
+                if fields[0] not in self.offsets:
+                    self.offsets[fields[0]] = array("q")
+                    self.times[fields[0]] = array("d")
+                self.offsets[fields[0]].append(int(fields[1]))
+                self.times[fields[0]].append(float(fields[2]))
+        self.file = open(path, "rb")
 
-def read_battery(b: periph.Battery, tries: int = 4) -> Tuple[float, float, int]:
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.close()
+        return False
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self.offsets.values())
+
+    def events(self) -> List[str]:
+        """
+        Return the names of all indexed events.
+        """
+        return sorted(self.offsets.keys())
+
+    def count(self, pattern: str = "*") -> int:
+        """
+        Return the number of records whose event name matches pattern.
+        """
+        return sum(len(v) for k, v in self.offsets.items() if fnmatch(k, pattern))
+
+    def read(self, offset: int) -> Tuple[float, str, Record]:
+        """
+        Read the record at the specified byte offset.
+        """
+        self.file.seek(offset)
+        rec = json.loads(self.file.readline())
+        t = datetime.datetime.fromisoformat(rec["t"])
+        return t.timestamp(), rec["event"], rec["data"]
+
+    def records(self, pattern: str = "*",
+                start: Optional[float] = None,
+                end: Optional[float] = None) -> Iterator[Tuple[float, str, Record]]:
+        """
+        Generate the records whose event name matches pattern (see fnmatch)
+        and whose timestamp, t, satisfies start <= t < end. The records are
+        returned in file order.
+        """
+        ranges = []
+        for event, times in self.times.items():
+            if not fnmatch(event, pattern):
+                continue
+            i = 0 if start is None else bisect.bisect_left(times, start)
+            j = len(times) if end is None else bisect.bisect_left(times, end)
+            ranges.append(self.offsets[event][i:j])
+        for offset in heapq.merge(*ranges):
+            yield self.read(offset)
+
+
+def read_battery(b: periph.Battery, tries: int = 4,
+                 clock: Optional[Clock] = None) -> Tuple[float, float, int]:
     """
     Return voltage, current, and state of charge from a Smart Battery. Multiple
     read attempts are made because the battery will return a NAK on the I2C
     bus if it is busy (rather than simply delaying its response).
     """
+    clock = clock or get_clock()
     v, a, soc = float(0), float(0), int(0)
     for i in range(tries):
         try:
             v = b.voltage()
             break
         except IOError:
-            time.sleep(0.1)
+            clock.sleep(0.1)
 
     for i in range(tries):
         try:
             a = b.current()
             break
         except IOError:
-            time.sleep(0.1)
+            clock.sleep(0.1)
 
     for i in range(tries):
         try:
             soc = b.charge()
             break
         except IOError:
-            time.sleep(0.1)
+            clock.sleep(0.1)
 
     return v, a, soc
 
 
+def split_registers(b: periph.Battery, vals: Dict[str, float]) -> \
+        Tuple[Tuple[float, float, int], Tuple[float, ...]]:
+    """
+    Split the result of Battery.read_registers into the battery-N
+    values, voltage, current and state of charge, and the sbs-N values
+    of the extra registers.
+    """
+    return ((vals["voltage"], vals["current"], int(vals["charge"])),
+            tuple(vals[name] for name in b.regs))
+
+
+def read_sbs(b: periph.Battery, tries: int = 4, clock: Optional[Clock] = None) -> \
+        Tuple[Tuple[float, float, int], Tuple[float, ...]]:
+    """
+    Return the battery-N and sbs-N values of a Smart Battery (see
+    split_registers). A battery with extra registers is read in one
+    read_registers pass, the sbs-N values of one without are empty.
+    """
+    if b.regs:
+        return split_registers(b, b.read_registers(tries, clock=clock))
+    return read_battery(b, tries, clock=clock), ()
+
+
+def write_batteries(df: Datafile, batts: List[periph.Battery], ts: float,
+                    clock: Optional[Clock] = None):
+    """
+    Write a battery-N record for each battery and, if extra registers
+    are selected for the battery, an sbs-N record of their values.
+    """
+    for i, b in enumerate(batts):
+        bvals, svals = read_sbs(b, clock=clock)
+        df.add_values(register_event("battery-"+str(i), BatteryFields),
+                      bvals, ts=ts)
+        if b.regs:
+            df.add_values(register_event("sbs-"+str(i), sbs_fields(b.regs)),
+                          svals, ts=ts)
+
+
+class StreamRate(object):
+    """
+    Schedule the updates of a low-rate data stream, such as the battery
+    records, within a sampling loop. The stream is due every *interval*
+    seconds, on every tick if the interval is zero. A due update is
+    deferred while, judging by the duration of the previous update, it
+    would run past the loop's next tick, but for no longer than an
+    interval.
+    """
+    def __init__(self, interval: float, clock: Optional[Clock] = None):
+        """
+        :param interval: minimum time between updates in seconds
+        :param clock: time source
+        """
+        self.interval = interval
+        self.clock = clock or get_clock()
+        self.t_next = float("-inf")
+        self.cost = 0.
+        self.updates = 0
+        self.deferred = 0
+
+    def ready(self, tick: float, deadline: Optional[float] = None) -> bool:
+        """
+        Return True if the stream should be updated on this tick.
+
+        :param tick: time of the current tick
+        :param deadline: time of the next tick, if specified the update
+                         is deferred when it would not finish in time
+        """
+        if tick < self.t_next:
+            return False
+        if (deadline is not None and tick - self.t_next < self.interval and
+                self.clock.time() + self.cost > deadline):
+            self.deferred += 1
+            return False
+        return True
+
+    def updated(self, tick: float, t0: float):
+        """
+        Record an update of the stream, started at t0, on a tick.
+        """
+        self.cost = self.clock.time() - t0
+        self.t_next = tick + self.interval
+        self.updates += 1
+
+
 def flow_monitor(df: Optional[Datafile], event: str,
                  pump: periph.Pump,
                  fm: periph.AnalogFlowMeter,
                  rate: float, stop: FlowLimits,
                  checkpr: Callable[[], Tuple[float, bool]],
                  checkdepth: Callable[[], Tuple[float, bool]],
-                 batts: List[periph.Battery] = []) -> Tuple[float, float, bool, bool]:
+                 batts: List[periph.Battery] = [],
+                 clock: Optional[Clock] = None,
+                 catchup: str = COALESCE,
+                 trace: bool = False,
+                 blog: float = 0.) -> Tuple[float, float, bool, bool]:
     """
 
     Monitor a flow meter until the requested amount of fluid is collected
@@ -101,42 +658,103 @@ def flow_monitor(df: Optional[Datafile], event: str,
     :param stop: sampling stop criteria
     :param checkpr: function to check the pressure across the filter
     :param checkdepth: function to check the depth
+    :param batts: batteries to monitor
+    :param clock: time source, defaults to the edna.clock default
+    :param catchup: sampling loop catch-up policy (see edna.timing)
+    :param trace: if True, time each stage of the loop ticks
+    :param blog: if greater than zero, the batteries are also logged
+                 every blog seconds while pumping (see StreamRate)
 
+    Dropped sampling ticks are recorded in gap.<event> records and the
+    stage timing summary, if enabled, in a trace.<event> record.
     """
-    logger = logging.getLogger("edna.sample")
+    clock = clock or get_clock()
     period = 1./rate
     overpressure, outofrange = False, False
-    t_stop = time.time() + stop.time
+    m_stop = clock.monotonic() + stop.time
+    if df is not None:
+        enc = register_event(event, SampleFields)
+        genc = register_event("gap."+event, GapFields)
+    tkr = Ticker(period, clock=clock, catchup=catchup)
+    tr = Tracer(FlowStages) if trace else NullTracer()
+    brate = StreamRate(blog, clock=clock)
     fm.reset()
     with pump:
-        for tick in ticker(period):
+        for tick, skipped, mtick in tkr:
+            t = tr.mark()
             amount, secs = fm.amount()
+            t = tr.lap("amount", t)
             pr, pr_ok = checkpr()
+            t = tr.lap("pr", t)
             depth, depth_ok = checkdepth()
+            t = tr.lap("depth", t)
             if df is not None:
-                df.add_record(event, OrderedDict(elapsed=round(secs, 3),
-                                                 amount=round(amount, 3),
-                                                 pr=round(pr, 3),
-                                                 pr_ok=pr_ok,
-                                                 depth=round(depth, 3)), ts=tick)
+                if skipped:
+                    df.add_values(genc, (skipped, period), ts=tick)
+                df.add_values(enc, (secs, amount, pr, pr_ok, depth), ts=tick)
+                t = tr.lap("write", t)
+                if batts and blog > 0 and brate.ready(tick, tick+period):
+                    tb0 = clock.time()
+                    write_batteries(df, batts, tick, clock=clock)
+                    brate.updated(tick, tb0)
+                    tr.lap("battery", t)
             if not overpressure:
                 overpressure = not pr_ok
             if not outofrange:
                 outofrange = not depth_ok
             if amount >= stop.amount:
                 break
-            if tick > t_stop:
+            if mtick > m_stop:
                 break
-        if df is not None:
-            for i, b in enumerate(batts):
-                v, a, soc = read_battery(b)
-                df.add_record("battery-"+str(i),
-                              OrderedDict(v=round(v, 3),
-                                          a=round(a, 3), soc=soc), ts=tick)
+        if df is not None and batts:
+            t = tr.mark()
+            write_batteries(df, batts, tick, clock=clock)
+            tr.lap("battery", t)
 
+    report_timing(df, event, rate, tkr, tick)
+    if tr:
+        report_trace(df, event, tr, tick)
     return amount, secs, overpressure, outofrange
 
 
+def report_timing(df: Optional[Datafile], event: str, rate: float,
+                  tkr: Ticker, ts: float):
+    """
+    Log the timing statistics of a sampling loop and, if df is not None,
+    write them to a timing.<event> record.
+    """
+    logger = logging.getLogger("edna.sample")
+    st = tkr.stats()
+    logger.info("Sampling rate %.2f Hz (%.2f Hz requested); %d ticks, %d missed, "
+                "max late %.1f ms", st["rate"], rate, st["ticks"], st["missed"],
+                st["late_max"]*1000.)
+    if df is not None:
+        df.add_values(register_event("timing."+event, TimingFields),
+                      (rate, st["rate"], st["ticks"], st["missed"],
+                       st["late_max"]*1000., st["late_mean"]*1000.) + tuple(st["hist"]),
+                      ts=ts)
+
+
+def report_trace(df: Optional[Datafile], event: str, tr: Tracer, ts: float):
+    """
+    Log the stage timing summary of a sampling loop and, if df is not
+    None, write it to a trace.<event> record.
+    """
+    logger = logging.getLogger("edna.sample")
+    summary = tr.summary()
+    values: List[Any] = [tr.counts[0]]
+    for stage, st in summary.items():
+        values.extend(st["p"+str(p)]*1000. for p in PERCENTILES)
+        values.append(st["max"]*1000.)
+    logger.info("Stage timing %s: %s", event,
+                "; ".join("{} n={:d} p50={:.3f} max={:.3f} ms".format(
+                    stage, st["n"], st["p50"]*1000., st["max"]*1000.)
+                          for stage, st in summary.items()))
+    if df is not None:
+        df.add_values(register_event("trace."+event, trace_fields(tr.stages)),
+                      tuple(values), ts=ts)
+
+
 SampleIdx: int = 0
 EthanolIdx: int = 1
 
@@ -149,14 +767,25 @@ def collect(df: Datafile, index: int,
             checkpr: Callable[[], Tuple[float, bool]],
             checkdepth: Callable[[], Tuple[float, bool]],
             batts: List[periph.Battery] = [],
-            bphold: float = 5.0) -> bool:
+            bphold: float = 5.0,
+            clock: Optional[Clock] = None,
+            catchup: str = COALESCE,
+            trace: bool = False,
+            blog: float = 0.,
+            phase: Optional[Callable[[str], None]] = None) -> bool:
     """
-    Run a complete eDNA sample sequence.
+    Run a complete eDNA sample sequence. If specified, the phase
+    function is called with the name of each step of the sequence as it
+    starts; "sample", "ethanol", "hold" and finally "idle" (see
+    edna.energy).
     """
     logger = logging.getLogger("edna.sample")
+    clock = clock or get_clock()
+    setphase = phase or (lambda name: None)
     logger.info("Starting sample %d", index)
     # Valve key
     vkey = str(index)
+    setphase("sample")
     try:
         with valves[vkey]:
             vwater, w_secs, w_ovp, oor = flow_monitor(df, "sample."+str(index),
@@ -165,7 +794,11 @@ def collect(df: Datafile, index: int,
                                                       rate,
                                                       limits[SampleIdx],
                                                       checkpr,
-                                                      checkdepth, batts)
+                                                      checkdepth, batts,
+                                                      clock=clock,
+                                                      catchup=catchup,
+                                                      trace=trace,
+                                                      blog=blog)
 
         if w_ovp:
             logger.warning("Overpressure event during sample pumping")
@@ -173,8 +806,10 @@ def collect(df: Datafile, index: int,
             logger.warning("Depth out of range during sample")
     except Exception:
         logger.exception("Error during sample collection")
+        setphase("idle")
         return False
 
+    setphase("ethanol")
     with valves[vkey]:
         with valves["Ethanol"]:
             vethanol, e_secs, e_ovp, _ = flow_monitor(None, "",
@@ -183,17 +818,21 @@ def collect(df: Datafile, index: int,
                                                       rate,
                                                       limits[EthanolIdx],
                                                       checkpr,
-                                                      lambda: (0.0, True), batts)
+                                                      lambda: (0.0, True), batts,
+                                                      clock=clock,
+                                                      catchup=catchup)
             # Open all valves to relieve back-pressure
+            setphase("hold")
             for key, obj in valves.items():
                 if not obj.isopened():
                     obj.open()
-            time.sleep(bphold)
+            clock.sleep(bphold)
             for key, obj in valves.items():
                 if (key == vkey) or (key == "Ethanol"):
                     continue
                 obj.close()
 
+    setphase("idle")
     if e_ovp:
         logger.warning("Overpressure event during ethanol pumping")
 
@@ -210,25 +849,48 @@ def seekdepth(df: Optional[Datafile],
               chkdepth: Callable[[], Tuple[float, bool]],
               rate: float,
               tlimit: float,
-              batts: List[periph.Battery] = []) -> Tuple[float, bool]:
+              batts: List[periph.Battery] = [],
+              clock: Optional[Clock] = None,
+              catchup: str = COALESCE,
+              trace: bool = False,
+              blog: float = 0.) -> Tuple[float, bool]:
     """
     Wait for the system to reach a specified depth band. Return (depth,
     True) if the target depth was reached or (depth, False) if the time
-    limit was exceeded. A time limit of 0 means wait forever.
+    limit was exceeded. A time limit of 0 means wait forever. Dropped
+    ticks are recorded in gap.depth records. If trace is True, the
+    stage timing summary of the loop is written to a trace.depth record.
+    The batteries are logged every blog seconds, or on every tick if
+    blog is 0, between the depth ticks (see StreamRate).
     """
-    t0 = time.time()
+    clock = clock or get_clock()
+    m0 = clock.monotonic()
     period = 1./rate
-    for tick in ticker(period):
+    if df is not None:
+        denc = register_event("depth", DepthFields)
+        genc = register_event("gap.depth", GapFields)
+    tr = Tracer(DepthStages) if trace else NullTracer()
+    brate = StreamRate(blog, clock=clock)
+    reached = True
+    for tick, skipped, mtick in Ticker(period, clock=clock, catchup=catchup):
+        t = tr.mark()
         depth, ok = chkdepth()
+        t = tr.lap("depth", t)
         if df is not None:
-            df.add_record("depth", OrderedDict(depth=round(depth, 3)), ts=tick)
-            for i, b in enumerate(batts):
-                v, a, soc = read_battery(b)
-                df.add_record("battery-"+str(i),
-                              OrderedDict(v=round(v, 3),
-                                          a=round(a, 3), soc=soc), ts=tick)
+            if skipped:
+                df.add_values(genc, (skipped, period), ts=tick)
+            df.add_values(denc, (depth,), ts=tick)
+            t = tr.lap("write", t)
+            if batts and brate.ready(tick, tick+period):
+                tb0 = clock.time()
+                write_batteries(df, batts, tick, clock=clock)
+                brate.updated(tick, tb0)
+                tr.lap("battery", t)
         if ok:
             break
-        if tlimit > 0 and (tick - t0) > tlimit:
-            return depth, False
-    return depth, True
+        if tlimit > 0 and (mtick - m0) > tlimit:
+            reached = False
+            break
+    if tr:
+        report_trace(df, "depth", tr, tick)
+    return depth, reached
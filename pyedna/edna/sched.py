@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.sched
+     :platform: any
+     :synopsis: single-threaded multi-rate task scheduler
+
+A :class:`Scheduler` runs periodic tasks from one timing thread instead
+of one sleeper thread per activity. Each task has a period, a priority
+and a deadline (by default its period). Tasks which are due at the same
+time run in priority order, highest first, and a task which finishes
+after its deadline is counted as an overrun. Periods which are
+multiples of each other (harmonic rates) keep the due times of the
+tasks aligned::
+
+    >>> with Scheduler() as sched:
+    ...     sched.add(integrate, 0.1, name="adc", priority=10)
+    ...     sched.add(fade, 0.1, name="led")
+    ...     sched.add(poll_battery, 10.)
+    ...     run_deployment()
+
+The schedule is kept on the clock's monotonic time. When a task
+overruns by more than a period the missed runs are dropped and counted,
+as with the COALESCE policy of :class:`edna.timing.Ticker`.
+"""
+from .clock import Clock, get_clock
+from .rt import configure_thread
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from threading import Event, Lock, Thread
+import logging
+
+
+class Task(object):
+    """
+    Periodic task registered with a Scheduler.
+    """
+    def __init__(self, fn: Callable[[], Any], period: float, name: str,
+                 priority: int, deadline: float):
+        self.fn = fn
+        self.name = name
+        self.priority = priority
+        self.period = int(round(period*1e9))
+        self.deadline = int(round(deadline*1e9))
+        self.due = 0
+        self.active = True
+        self.runs = 0
+        self.missed = 0
+        self.overruns = 0
+        self.errors = 0
+        self.max_runtime = 0
+
+    def __str__(self):
+        return "Task({}, {:.3f}s)".format(self.name, self.period/1e9)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the run count, missed runs, deadline overruns, errors and
+        maximum run time in seconds.
+        """
+        return OrderedDict(name=self.name,
+                           runs=self.runs,
+                           missed=self.missed,
+                           overruns=self.overruns,
+                           errors=self.errors,
+                           max_runtime=self.max_runtime/1e9)
+
+
+class Scheduler(object):
+    """
+    Class to run periodic tasks from a single timing thread. Tasks can
+    be added and removed at any time, from any thread.
+    """
+    # Longest sleep of the timing thread, so newly added tasks start
+    # promptly.
+    max_sleep: float = 0.1
+
+    def __init__(self, clock: Optional[Clock] = None):
+        """
+        :param clock: time source, defaults to the edna.clock default
+        """
+        self.clock = clock or get_clock()
+        self.logger = logging.getLogger("edna.sched")
+        self.tasks: List[Task] = []
+        self.lock = Lock()
+        self.ev = Event()
+        self.tid: Any = None
+
+    def add(self, fn: Callable[[], Any], period: float, name: str = "",
+            priority: int = 0, deadline: Optional[float] = None,
+            delay: float = 0.) -> Task:
+        """
+        Register a periodic task.
+
+        :param fn: function to call
+        :param period: time between calls in seconds
+        :param name: task name for the log and statistics
+        :param priority: tasks with higher values run first
+        :param deadline: time after the due time by which the task
+                         must finish, defaults to the period
+        :param delay: time before the first call
+        """
+        if period <= 0:
+            raise ValueError("task period must be positive")
+        task = Task(fn, period, name or getattr(fn, "__name__", "task"),
+                    priority, period if deadline is None else deadline)
+        task.due = self.clock.monotonic_ns() + int(round(delay*1e9))
+        with self.lock:
+            self.tasks.append(task)
+        self.logger.info("Add %s", str(task))
+        return task
+
+    def remove(self, task: Task):
+        """
+        Unregister a task, it will not run again.
+        """
+        task.active = False
+        with self.lock:
+            if task in self.tasks:
+                self.tasks.remove(task)
+                self.logger.info("Remove %s", str(task))
+
+    def _run_task(self, task: Task):
+        start = self.clock.monotonic_ns()
+        try:
+            task.fn()
+        except Exception:
+            task.errors += 1
+            self.logger.exception("Error in %s", str(task))
+        end = self.clock.monotonic_ns()
+        task.runs += 1
+        task.max_runtime = max(task.max_runtime, end - start)
+        if end > task.due + task.deadline:
+            task.overruns += 1
+        task.due += task.period
+        if end >= task.due + task.period:
+            n = (end - task.due)//task.period
+            task.missed += n
+            task.due += n*task.period
+
+    def run_pending(self) -> float:
+        """
+        Run all of the tasks which are due and return the time in
+        seconds until the next one is due.
+        """
+        now = self.clock.monotonic_ns()
+        with self.lock:
+            due = [t for t in self.tasks if t.due <= now]
+        due.sort(key=lambda t: (-t.priority, t.due))
+        for task in due:
+            if task.active:
+                self._run_task(task)
+        with self.lock:
+            if not self.tasks:
+                return self.max_sleep
+            t_next = min(t.due for t in self.tasks)
+        return max(t_next - self.clock.monotonic_ns(), 0)/1e9
+
+    def _loop(self):
+        configure_thread("edna-sched")
+        while not self.ev.is_set():
+            dt = self.run_pending()
+            if dt > 0:
+                self.clock.sleep(min(dt, self.max_sleep))
+
+    def start(self):
+        """
+        Start the timing thread.
+        """
+        if self.tid is not None:
+            return
+        self.ev.clear()
+        self.tid = Thread(target=self._loop, name="edna-sched", daemon=True)
+        self.clock.start_thread(self.tid)
+        self.logger.info("Scheduler started")
+
+    def stop(self):
+        """
+        Stop the timing thread, the tasks remain registered.
+        """
+        if self.tid is not None:
+            self.ev.set()
+            self.clock.join(self.tid, timeout=2)
+            self.tid = None
+            self.logger.info("Scheduler stopped")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Return the statistics of every registered task.
+        """
+        with self.lock:
+            return [t.stats() for t in self.tasks]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, etype, val, traceback):
+        self.stop()
+        # Allow exceptions to propogate out
+        return False
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.segment
+     :platform: any
+     :synopsis: crash-safe segmented NDJSON data files
+
+A segmented data file is a series of NDJSON files named
+``<base>.<NNN>.ndjson``. When a segment is complete, a footer line is
+appended which contains the segment number, record count, data size and
+CRC32 of the data which precedes it::
+
+    #edna-segment {"segment": 3, "records": 1200, "bytes": 98765, "crc32": 305419896}
+
+The footer is not valid JSON so record readers skip it. A segment
+without a footer is the last one written before a power loss; its
+complete records can be recovered.
+"""
+from collections import OrderedDict
+from typing import Callable, Iterable, List, NamedTuple, Optional, IO
+import json
+import logging
+import os
+import os.path
+import re
+import time
+import zlib
+
+
+FOOTER = b"#edna-segment "
+
+# Segment file name pattern
+_segname = re.compile(r".*\.(\d{3,})\.ndjson$")
+
+
+class SegmentedFile(object):
+    """
+    File-like object which writes NDJSON data to a series of segment
+    files. A new segment is started after *maxbytes* bytes or *maxage*
+    seconds, whichever comes first (zero disables either limit). Segments
+    are only rolled between calls to write, so they always contain
+    whole records.
+    """
+    file: Optional[IO[bytes]]
+
+    def __init__(self, base: str, maxbytes: int = 0, maxage: float = 0,
+                 callback: Optional[Callable[[str], None]] = None):
+        """
+        :param base: segment name prefix
+        :param maxbytes: maximum segment size
+        :param maxage: maximum segment age in seconds
+        :param callback: function called with the name of each completed
+                         segment
+        """
+        self.base = base
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.callback = callback
+        self.logger = logging.getLogger("edna.segment")
+        self.index = -1
+        self.file = None
+        self.names: List[str] = []
+        self._open()
+
+    def _open(self):
+        self.index += 1
+        name = "{}.{:03d}.ndjson".format(self.base, self.index)
+        self.file = open(name, "wb")
+        self.names.append(name)
+        self.records = 0
+        self.size = 0
+        self.crc = 0
+        self.t0 = time.monotonic()
+
+    def _close(self):
+        if self.file is None:
+            return
+        footer = OrderedDict(segment=self.index, records=self.records,
+                             bytes=self.size, crc32=self.crc)
+        self.file.write(FOOTER + json.dumps(footer).encode("utf-8") + b"\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        name = self.names[-1]
+        self.logger.info("Segment %s closed; %d records", name, self.records)
+        if self.callback is not None:
+            self.callback(name)
+
+    def write(self, s: str) -> int:
+        if self.file is None:
+            raise ValueError("write to closed SegmentedFile")
+        b = s.encode("utf-8")
+        self.file.write(b)
+        self.records += b.count(b"\n")
+        self.size += len(b)
+        self.crc = zlib.crc32(b, self.crc)
+        if ((self.maxbytes > 0 and self.size >= self.maxbytes) or
+                (self.maxage > 0 and time.monotonic() - self.t0 >= self.maxage)):
+            self._close()
+            self._open()
+        return len(s)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def fileno(self) -> int:
+        if self.file is None:
+            raise ValueError("SegmentedFile is closed")
+        return self.file.fileno()
+
+    def close(self):
+        """
+        Write the footer of the last segment and close it.
+        """
+        self._close()
+
+
+class SegmentStatus(NamedTuple):
+    """
+    Result of checking a segment. If the segment has no footer,
+    *complete* is False and *records* and *bytes* describe the data up
+    to the end of the last complete record.
+    """
+    name: str
+    records: int
+    bytes: int
+    complete: bool
+    ok: bool
+
+
+def check_segment(name: str) -> SegmentStatus:
+    """
+    Validate a segment against its footer.
+    """
+    with open(name, "rb") as f:
+        return _check(name, f.read())
+
+
+def _check(name: str, buf: bytes) -> SegmentStatus:
+    i = buf.rfind(b"\n" + FOOTER)
+    if i >= 0 or buf.startswith(FOOTER):
+        i += 1
+        data = buf[:i]
+        try:
+            footer = json.loads(buf[i+len(FOOTER):].decode("utf-8"))
+        except ValueError:
+            # Partial footer, the data is intact but unverified.
+            return SegmentStatus(name, data.count(b"\n"), i, False, True)
+        ok = (len(data) == footer["bytes"] and
+              data.count(b"\n") == footer["records"] and
+              zlib.crc32(data) == footer["crc32"])
+        return SegmentStatus(name, footer["records"], footer["bytes"], True, ok)
+    # Unterminated segment, keep all of the complete records.
+    n = buf.rfind(b"\n") + 1
+    return SegmentStatus(name, buf.count(b"\n", 0, n), n, False, True)
+
+
+def segments(path: str) -> List[str]:
+    """
+    Return the segment files in a deployment directory in order.
+    """
+    names = []
+    for name in os.listdir(path):
+        m = _segname.match(name)
+        if m:
+            names.append((int(m.group(1)), os.path.join(path, name)))
+    return [name for i, name in sorted(names)]
+
+
+def recover(names: Iterable[str], out: IO[bytes]) -> List[SegmentStatus]:
+    """
+    Validate a series of segments and write the data of each valid
+    segment to out. Returns the status of every segment.
+    """
+    result = []
+    for name in names:
+        with open(name, "rb") as f:
+            buf = f.read()
+        status = _check(name, buf)
+        result.append(status)
+        if status.ok and status.bytes > 0:
+            out.write(memoryview(buf)[:status.bytes])
+    return result
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.timing
+     :platform: any
+     :synopsis: drift-free periodic timing with statistics
+
+A :class:`Ticker` keeps an absolute schedule on the monotonic clock,
+tick k is due at start + k*interval, so wall clock steps (NTP) do not
+affect it and lateness does not accumulate. When the loop body overruns
+by more than a period, the catch-up policy decides what happens to the
+ticks which are past due:
+
+* SKIP - drop them and wait for the next scheduled tick
+* COALESCE - drop them and tick once immediately
+* BURST - deliver all of them immediately, one after the other
+
+Each tick is a :class:`Tick` with the wall clock time, the number of
+ticks dropped just before it and the monotonic time. Time limits and
+durations should use the monotonic time, the wall clock time is for
+timestamps::
+
+    >>> t = Ticker(0.1, catchup=SKIP)
+    >>> for tick in t:
+    ...     work(tick.t, tick.skipped)
+    >>> t.stats()
+
+A Ticker can also be used with ``async for`` in a coroutine, the waits
+then use the clock's *asleep* so other tasks run in the meantime.
+"""
+from .clock import Clock, get_clock
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, \
+    Optional, Tuple
+import bisect
+
+
+# Catch-up policies
+SKIP = "skip"
+COALESCE = "coalesce"
+BURST = "burst"
+POLICIES = (SKIP, COALESCE, BURST)
+
+
+# Upper bounds of the lateness histogram bins in milliseconds, the
+# last bin counts all later ticks.
+LATE_BINS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Tick(NamedTuple):
+    """
+    Wall clock time of a tick, the number of ticks skipped before it and
+    the clock's monotonic time of the tick.
+    """
+    t: float
+    skipped: int
+    m: float
+
+
+class Ticker(object):
+    """
+    Iterable timer which yields a Tick for every scheduled tick. The
+    statistics can be read at any time, including from another thread.
+    """
+    def __init__(self, interval: float, clock: Optional[Clock] = None,
+                 catchup: str = COALESCE):
+        """
+        :param interval: time between ticks in seconds, if zero or less
+                         there is a single tick
+        :param clock: time source, defaults to the edna.clock default
+        :param catchup: catch-up policy; SKIP, COALESCE or BURST
+        """
+        if catchup not in POLICIES:
+            raise ValueError("'{}': invalid catch-up policy".format(catchup))
+        self.interval = interval
+        self.catchup = catchup
+        self.clock = clock or get_clock()
+        self.period = int(round(interval*1e9))
+        self.bounds = [b*1000000 for b in LATE_BINS]
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the statistics.
+        """
+        self.ticks = 0
+        self.missed = 0
+        self.late_max = 0
+        self.late_total = 0
+        self.hist = [0] * (len(LATE_BINS) + 1)
+        # Monotonic times of the first and latest ticks
+        self.first = 0.
+        self.last = 0.
+
+    def _record(self, late: int):
+        self.ticks += 1
+        if late > self.late_max:
+            self.late_max = late
+        self.late_total += late
+        self.hist[bisect.bisect_left(self.bounds, late)] += 1
+
+    def _tick(self, due: int, skipped: int) -> Tick:
+        now = self.clock.monotonic_ns()
+        self._record(max(now - due, 0))
+        m = now/1e9
+        if self.ticks == 1:
+            self.first = m
+        self.last = m
+        return Tick(self.clock.time(), skipped, m)
+
+    def _next(self, due: int) -> Tuple[int, int, float]:
+        # Return the next due time, the number of ticks dropped and the
+        # time to wait in seconds.
+        due += self.period
+        skipped = 0
+        now = self.clock.monotonic_ns()
+        if now >= due + self.period and self.catchup != BURST:
+            # Drop the ticks which are already past due, SKIP
+            # also drops the current one.
+            n = (now - due)//self.period
+            if self.catchup == SKIP:
+                n += 1
+            skipped = n
+            self.missed += n
+            due += n*self.period
+        return due, skipped, max(due - now, 0)/1e9
+
+    def __iter__(self) -> Iterator[Tick]:
+        due = self.clock.monotonic_ns()
+        skipped = 0
+        while True:
+            yield self._tick(due, skipped)
+            if self.period <= 0:
+                break
+            due, skipped, wait = self._next(due)
+            if wait > 0:
+                self.clock.sleep(wait)
+
+    async def __aiter__(self) -> AsyncIterator[Tick]:
+        due = self.clock.monotonic_ns()
+        skipped = 0
+        while True:
+            yield self._tick(due, skipped)
+            if self.period <= 0:
+                break
+            due, skipped, wait = self._next(due)
+            if wait > 0:
+                await self.clock.asleep(wait)
+
+    def rate(self) -> float:
+        """
+        Return the achieved tick rate in Hz.
+        """
+        if self.ticks < 2 or self.last <= self.first:
+            return 0.
+        return (self.ticks - 1)/(self.last - self.first)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the tick count, number of skipped ticks, maximum and mean
+        lateness in seconds, and the lateness histogram.
+        """
+        hist: List[int] = list(self.hist)
+        return OrderedDict(ticks=self.ticks,
+                           missed=self.missed,
+                           late_max=self.late_max/1e9,
+                           late_mean=self.late_total/1e9/self.ticks if self.ticks else 0.,
+                           rate=self.rate(),
+                           hist=hist)
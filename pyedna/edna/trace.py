@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: edna.trace
+     :platform: any
+     :synopsis: lightweight timing spans for sampling loops
+
+A :class:`Tracer` measures the time spent in each stage of a loop with
+perf_counter_ns. The span durations of each stage are kept in a
+preallocated ring buffer, so tracing a long loop does not allocate
+memory, and are summarized as percentiles when the loop finishes::
+
+    >>> tr = Tracer(("read", "write"))
+    >>> for tick in ticker:
+    ...     t = tr.mark()
+    ...     x = read()
+    ...     t = tr.lap("read", t)
+    ...     write(x)
+    ...     tr.lap("write", t)
+    >>> tr.summary()
+
+A :class:`NullTracer` has the same interface and records nothing, it is
+used when tracing is disabled so the loop code is unchanged.
+"""
+from array import array
+from collections import OrderedDict
+from time import perf_counter_ns
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+# Percentiles reported for each stage
+PERCENTILES = (50, 90, 99)
+
+
+class Tracer(object):
+    """
+    Record span durations for a fixed set of named stages.
+    """
+    def __init__(self, stages: Sequence[str], size: int = 1024):
+        """
+        :param stages: stage names
+        :param size: number of spans kept for each stage, older spans
+                     are overwritten
+        """
+        self.stages = tuple(stages)
+        self.size = size
+        self.index = dict((name, i) for i, name in enumerate(self.stages))
+        self.bufs = [array("q", bytes(8*size)) for _ in self.stages]
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all spans.
+        """
+        self.counts = [0] * len(self.stages)
+        self.max = [0] * len(self.stages)
+
+    def mark(self) -> int:
+        """
+        Return the start time of a span.
+        """
+        return perf_counter_ns()
+
+    def lap(self, stage: str, t0: int) -> int:
+        """
+        End the span of a stage which started at t0 and return the end
+        time, which can be used as the start of the next span.
+        """
+        t = perf_counter_ns()
+        i = self.index[stage]
+        n = self.counts[i]
+        self.bufs[i][n % self.size] = t - t0
+        self.counts[i] = n + 1
+        if t - t0 > self.max[i]:
+            self.max[i] = t - t0
+        return t
+
+    def spans(self, stage: str) -> List[int]:
+        """
+        Return the recorded span durations of a stage in nanoseconds,
+        oldest first.
+        """
+        i = self.index[stage]
+        n = self.counts[i]
+        buf = self.bufs[i]
+        if n <= self.size:
+            return buf[:n].tolist()
+        j = n % self.size
+        return (buf[j:] + buf[:j]).tolist()
+
+    def percentiles(self, stage: str) -> Tuple[float, ...]:
+        """
+        Return the PERCENTILES of the recorded span durations of a stage
+        in seconds (nearest rank).
+        """
+        vals = sorted(self.spans(stage))
+        if not vals:
+            return tuple(0. for p in PERCENTILES)
+        n = len(vals)
+        return tuple(vals[min(max((p*n + 99)//100 - 1, 0), n-1)]/1e9
+                     for p in PERCENTILES)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the span count, percentiles and maximum duration in
+        seconds of each stage. The maximum covers all spans, including
+        those overwritten in the ring buffer.
+        """
+        result: Dict[str, Dict[str, Any]] = OrderedDict()
+        for i, name in enumerate(self.stages):
+            st: Dict[str, Any] = OrderedDict(n=self.counts[i])
+            for p, val in zip(PERCENTILES, self.percentiles(name)):
+                st["p"+str(p)] = val
+            st["max"] = self.max[i]/1e9
+            result[name] = st
+        return result
+
+    def __bool__(self) -> bool:
+        return True
+
+
+class NullTracer(Tracer):
+    """
+    Tracer which records nothing.
+    """
+    def __init__(self, stages: Sequence[str] = (), size: int = 0):
+        super().__init__(stages, size=0)
+
+    def mark(self) -> int:
+        return 0
+
+    def lap(self, stage: str, t0: int) -> int:
+        return 0
+
+    def __bool__(self) -> bool:
+        return False
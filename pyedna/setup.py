@@ -21,6 +21,10 @@ setup(name="edna",
       install_requires=[
           'importlib-metadata ~= 1.0 ; python_version < "3.8"'
       ],
+      extras_require={
+          "zstd": ["zstandard"],
+          "data": ["numpy"]
+      },
       python_requires="~=3.7",
       entry_points = {
           "console_scripts": [
@@ -29,7 +33,11 @@ setup(name="edna",
               "prtest=edna.apps.prtest:main",
               "flowtest=edna.apps.flowtest:main",
               "installcfg=edna.apps.installcfg:main",
-              "installsvc=edna.apps.installsvc:main"
+              "installsvc=edna.apps.installsvc:main",
+              "bin2ndjson=edna.apps.bin2ndjson:main",
+              "ednacsv=edna.apps.ednacsv:main",
+              "ednarecover=edna.apps.recover:main",
+              "ednareplay=edna.apps.replay:main"
           ]
       },
       zip_safe=False)
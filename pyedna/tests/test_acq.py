@@ -0,0 +1,69 @@
+"""
+Tests for the edna.acq module
+"""
+from edna.mockpr import Adc
+from edna.mocksmbus import SMBus
+from edna.periph import Battery, PrSensor
+from edna.sample import read_battery
+import sys
+import time
+import unittest
+
+if sys.version_info >= (3, 8):
+    from edna.acq import SampleRing, Acquisition, battery_reads
+
+
+@unittest.skipIf(sys.version_info < (3, 8), "requires multiprocessing.shared_memory")
+class SampleRingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ring = SampleRing(channels=2, size=8)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_latest(self):
+        self.assertIsNone(self.ring.latest(0))
+        self.ring.append(0, 100., 1.5)
+        self.ring.append(1, 101., 2.5)
+        self.ring.append(0, 102., 3.5)
+        self.assertEqual(self.ring.latest(0), (102., 3.5))
+        self.assertEqual(self.ring.latest(1), (101., 2.5))
+        reader = SampleRing(self.ring.name)
+        self.assertEqual(reader.latest(1), (101., 2.5))
+        self.assertEqual(reader.count, 3)
+        reader.close()
+
+    def test_read(self):
+        for i in range(5):
+            self.ring.append(i % 2, float(i), float(i*10))
+        recs, n, dropped = self.ring.read(0)
+        self.assertEqual((len(recs), n, dropped), (5, 5, 0))
+        self.assertEqual(recs[4], (4., 0, 40.))
+        for i in range(5, 20):
+            self.ring.append(0, float(i), 0.)
+        recs, n, dropped = self.ring.read(n)
+        # Only the last 8 records are kept
+        self.assertEqual((len(recs), n, dropped), (8, 20, 7))
+        self.assertEqual(recs[0][0], 12.)
+
+
+@unittest.skipIf(sys.version_info < (3, 8), "requires multiprocessing.shared_memory")
+class AcquisitionTestCase(unittest.TestCase):
+    def test_process(self):
+        acq = Acquisition(50., adc=Adc, adc_chans=[(0, 2./3), (1, 2./3)],
+                          smbus=SMBus, smbus_reads=battery_reads([0]),
+                          smbus_interval=0.05)
+        with acq:
+            pr = PrSensor(acq.adc(), 1, 2./3, coeff=[-10., 50.])
+            # Mock sensor is approximately 10 psi
+            self.assertAlmostEqual(pr.read(), 10., delta=5.)
+            time.sleep(0.5)
+            v, a, soc = read_battery(Battery(acq.smbus(0)))
+            self.assertEqual(soc, 257)
+            st = acq.stats()
+            self.assertGreater(st["samples"], 20)
+        self.assertFalse(acq.proc.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
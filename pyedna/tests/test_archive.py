@@ -0,0 +1,70 @@
+"""
+Tests for the edna.archive module
+"""
+from edna.sample import Datafile
+from edna.binrec import BinaryDatafile
+from edna.archive import records, deployment_id, ArchiveWriter
+import unittest
+import tarfile
+import tempfile
+import os
+import os.path
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self.tmpdir.name, "edna_20200913T122640")
+        os.makedirs(self.dir)
+        with open(os.path.join(self.dir, "edna_20200913T122640.ndjson"), "w") as f:
+            df = Datafile(f)
+            for i in range(10):
+                df.add_record("depth", {"depth": float(i)}, ts=1600000000+i)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_id(self):
+        self.assertEqual(deployment_id("/x/edna_20200913T122640.tar.gz"),
+                         "20200913T122640")
+        self.assertEqual(deployment_id(self.dir + "/"), "20200913T122640")
+
+    def test_directory(self):
+        recs = list(records(self.dir))
+        self.assertEqual(len(recs), 10)
+        self.assertEqual(recs[-1][1:], ("depth", {"depth": 9.0}))
+
+    def test_tarfile(self):
+        path = os.path.join(self.tmpdir.name, "edna_20200913T122640.tar.gz")
+        with tarfile.open(path, "w:gz") as tar:
+            tar.add(self.dir, arcname=os.path.basename(self.dir))
+        recs = list(records(path))
+        self.assertEqual(len(recs), 10)
+        self.assertEqual(recs[0][0], "2020-09-13T12:26:40.000+00:00")
+
+    def test_writer(self):
+        path = os.path.join(self.tmpdir.name, "edna_20200913T122640.tar.gz")
+        name = os.path.join(self.dir, "edna_20200913T122640.ndjson")
+        aw = ArchiveWriter(path, os.path.basename(self.dir))
+        aw.add(name)
+        # The archive is readable before it is closed
+        self.assertEqual(len(list(records(path))), 10)
+        aw.close()
+        with tarfile.open(path, "r:gz") as tar:
+            self.assertEqual(tar.getnames(),
+                             ["edna_20200913T122640",
+                              "edna_20200913T122640/edna_20200913T122640.ndjson"])
+        self.assertEqual(len(list(records(path))), 10)
+
+    def test_binary(self):
+        path = os.path.join(self.tmpdir.name, "edna_20200913T122640.bin")
+        with open(path, "wb") as f:
+            df = BinaryDatafile(f)
+            df.add_record("depth", {"depth": 1.5}, ts=1600000000)
+        self.assertEqual(list(records(path)),
+                         [("2020-09-13T12:26:40.000+00:00", "depth",
+                           {"depth": 1.5})])
+
+
+if __name__ == '__main__':
+    unittest.main()
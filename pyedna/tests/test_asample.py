@@ -0,0 +1,131 @@
+"""
+Tests for the edna.asample module
+"""
+from edna.clock import SimClock
+from edna.sample import Datafile, FlowLimits
+from edna.timing import Ticker
+from edna import asample
+from contextlib import nullcontext
+from io import StringIO
+import asyncio
+import json
+import unittest
+
+
+class FlowMeter(object):
+    """
+    Flow meter which delivers 1 cc per second.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+
+    def reset(self):
+        self.t0 = self.clock.time()
+
+    def amount(self):
+        secs = self.clock.time() - self.t0
+        return secs/1000., secs
+
+
+class Battery(object):
+    """
+    Battery which NAKs every other request.
+    """
+    regs = ()
+
+    def __init__(self):
+        self.calls = 0
+
+    def _read(self, val):
+        self.calls += 1
+        if self.calls % 2:
+            raise IOError("busy")
+        return val
+
+    def voltage(self):
+        return self._read(14.5)
+
+    def current(self):
+        return self._read(-1.25)
+
+    def charge(self):
+        return self._read(80)
+
+
+class AsyncSampleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock(t0=1600000000.)
+
+    def records(self, buf):
+        return [json.loads(line) for line in buf.getvalue().splitlines()]
+
+    def test_ticker(self):
+        async def run():
+            ticks = []
+            async for tick in Ticker(0.5, clock=self.clock):
+                ticks.append(tick.t - 1600000000.)
+                if len(ticks) == 4:
+                    break
+            return ticks
+        self.assertEqual(asyncio.run(run()), [0., 0.5, 1., 1.5])
+
+    def test_read_battery(self):
+        vals = asyncio.run(asample.read_battery(Battery(), clock=self.clock))
+        self.assertEqual(vals, (14.5, -1.25, 80))
+
+    def test_flow_monitor(self):
+        buf = StringIO()
+
+        async def checkdepth():
+            return 10., True
+
+        amount, secs, ovp, oor = asyncio.run(
+            asample.flow_monitor(Datafile(buf), "sample.1",
+                                 nullcontext(),  # type: ignore
+                                 FlowMeter(self.clock),  # type: ignore
+                                 10., FlowLimits(time=60, amount=0.002),
+                                 lambda: (50., False), checkdepth,
+                                 [Battery()],  # type: ignore
+                                 clock=self.clock))
+        self.assertAlmostEqual(secs, 2.)
+        self.assertTrue(ovp)
+        self.assertFalse(oor)
+        recs = self.records(buf)
+        self.assertEqual([r["event"] for r in recs[-2:]], ["battery-0", "timing.sample.1"])
+        self.assertEqual(recs[-1]["data"]["ticks"], 21)
+        self.assertEqual(recs[-2]["data"], {"v": 14.5, "a": -1.25, "soc": 80})
+
+    def test_seekdepth(self):
+        buf = StringIO()
+        depths = iter([1., 2., 3., 4., 5.])
+
+        def chkdepth():
+            d = next(depths)
+            return d, d >= 4.
+
+        depth, ok = asyncio.run(asample.seekdepth(Datafile(buf), chkdepth, 1., 60.,
+                                                  [Battery()],  # type: ignore
+                                                  clock=self.clock))
+        self.assertEqual((depth, ok), (4., True))
+        recs = self.records(buf)
+        self.assertEqual(len([r for r in recs if r["event"] == "depth"]), 4)
+        self.assertEqual(len([r for r in recs if r["event"] == "battery-0"]), 4)
+
+    def test_seekdepth_rate(self):
+        buf = StringIO()
+        depths = iter([1., 2., 3., 4., 5.])
+
+        def chkdepth():
+            d = next(depths)
+            return d, d >= 5.
+
+        asyncio.run(asample.seekdepth(Datafile(buf), chkdepth, 1., 60.,
+                                      [Battery()],  # type: ignore
+                                      clock=self.clock, blog=2.))
+        recs = self.records(buf)
+        self.assertEqual(len([r for r in recs if r["event"] == "depth"]), 5)
+        self.assertEqual(len([r for r in recs if r["event"] == "battery-0"]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Tests for the edna.binrec module
+"""
+from edna.sample import Datafile, register_event, SampleFields
+from edna.binrec import BinaryDatafile, to_ndjson, FormatError
+from collections import OrderedDict
+import unittest
+from io import StringIO, BytesIO
+
+
+RECORDS = [
+    ("metadata", ["name", "test", "site", "dock"], 1600000000.1234),
+    ("depth", OrderedDict(depth=24.125), 1600000000.25),
+    ("sample.1", OrderedDict(elapsed=0.1, amount=-0.0, pr=4.321,
+                             pr_ok=True, depth=24.5), 1600000000.3501),
+    ("sample.1", OrderedDict(elapsed=0.2, amount=0.001, pr=4.3,
+                             pr_ok=False, depth=-1.5), 1600000000.4509),
+    ("battery-0", OrderedDict(v=14.2, a=-0.5, soc=97), 1600000001.999),
+    ("sample.1", OrderedDict(elapsed=0.3, amount=1.23456, pr=4.3,
+                             pr_ok=True, depth=24.5), 1600000002.0),
+    ("result.1", OrderedDict(elapsed=12.5, vwater=0.2, vethanol=0.01,
+                             overpressure=False, deptherror=False), 1600000003.5),
+]
+
+
+class BinaryDatafileTestCase(unittest.TestCase):
+    def test_roundtrip(self):
+        text = StringIO()
+        df = Datafile(text)
+        binary = BytesIO()
+        bdf = BinaryDatafile(binary)
+        for event, data, ts in RECORDS:
+            df.add_record(event, data, ts=ts)
+            bdf.add_record(event, data, ts=ts)
+        out = StringIO()
+        binary.seek(0)
+        self.assertEqual(to_ndjson(binary, out), len(RECORDS))
+        self.assertEqual(out.getvalue(), text.getvalue())
+        self.assertLess(len(binary.getvalue()), len(text.getvalue()))
+
+    def test_values(self):
+        enc = register_event("sample.2", SampleFields)
+        binary = BytesIO()
+        bdf = BinaryDatafile(binary)
+        bdf.add_values(enc, (1.2345678, 0.1, 4.3, True, 24.0), ts=1600000000.25)
+        bdf.add_values(enc, (1.3, float("nan"), 4.3, True, 24.0), ts=1600000000.35)
+        out = StringIO()
+        binary.seek(0)
+        self.assertEqual(to_ndjson(binary, out), 2)
+        lines = out.getvalue().splitlines()
+        self.assertIn('"elapsed": 1.235, "amount": 0.1', lines[0])
+        self.assertIn('"amount": NaN', lines[1])
+
+    def test_truncated(self):
+        binary = BytesIO()
+        bdf = BinaryDatafile(binary)
+        for event, data, ts in RECORDS:
+            bdf.add_record(event, data, ts=ts)
+        buf = binary.getvalue()
+        out = StringIO()
+        self.assertEqual(to_ndjson(BytesIO(buf[:-3]), out), len(RECORDS) - 1)
+
+    def test_bad_file(self):
+        self.assertRaises(FormatError, to_ndjson, BytesIO(b"{}\n"), StringIO())
+
+
+if __name__ == '__main__':
+    unittest.main()
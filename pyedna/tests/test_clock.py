@@ -0,0 +1,104 @@
+"""
+Tests for the edna.clock module
+"""
+from edna import ticker
+from edna.clock import SimClock, ScaledClock, get_clock, set_clock
+from edna.sample import Datafile, seekdepth
+from io import StringIO
+import asyncio
+import threading
+import unittest
+import time
+
+
+class ClockTestCase(unittest.TestCase):
+    def test_ticker(self):
+        clock = SimClock(t0=1000.)
+        t0 = time.monotonic()
+        ticks = []
+        for tick in ticker(60., clock=clock):
+            ticks.append(tick)
+            if len(ticks) == 5:
+                break
+        self.assertEqual(ticks, [1000., 1060., 1120., 1180., 1240.])
+        self.assertLess(time.monotonic() - t0, 1.)
+
+    def test_threads(self):
+        clock = SimClock(t0=0.)
+        wakes = []
+
+        def worker():
+            for i in range(3):
+                clock.sleep(10.)
+                wakes.append(("worker", clock.time()))
+
+        th = threading.Thread(target=worker)
+        th.start()
+        for i in range(2):
+            clock.sleep(12.)
+            wakes.append(("main", clock.time()))
+        clock.join(th)
+        self.assertEqual(wakes, [("worker", 10.), ("main", 12.), ("worker", 20.),
+                                 ("main", 24.), ("worker", 30.)])
+
+    def test_waiting(self):
+        clock = SimClock(t0=0.)
+        done = threading.Event()
+
+        def worker():
+            clock.sleep(5.)
+            done.set()
+            clock.sleep(5.)
+
+        th = threading.Thread(target=worker)
+        clock.start_thread(th)
+        with clock.waiting(done.is_set):
+            done.wait()
+        self.assertEqual(clock.time(), 5.)
+        clock.join(th)
+        self.assertEqual(clock.time(), 10.)
+
+    def test_asleep(self):
+        clock = SimClock(t0=0.)
+        wakes = []
+
+        def job():
+            clock.sleep(4.)
+            wakes.append(("job", clock.time()))
+
+        async def run():
+            await clock.asleep(1.)
+            fut = asyncio.get_running_loop().run_in_executor(None, job)
+            for i in range(3):
+                await clock.asleep(2.)
+                wakes.append(("coro", clock.time()))
+            await fut
+
+        t0 = time.monotonic()
+        asyncio.run(run())
+        self.assertEqual(wakes, [("coro", 3.), ("job", 5.), ("coro", 5.), ("coro", 7.)])
+        self.assertLess(time.monotonic() - t0, 1.)
+
+    def test_scaled(self):
+        clock = ScaledClock(100., t0=0.)
+        clock.sleep(5.)
+        self.assertGreaterEqual(clock.time(), 5.)
+        self.assertLess(clock.time(), 10.)
+
+    def test_default(self):
+        prev = set_clock(SimClock(t0=1600000000.))
+        try:
+            buf = StringIO()
+            depths = iter([0., 5., 10., 15.])
+            depth, ok = seekdepth(Datafile(buf),
+                                  lambda: (next(depths), False),
+                                  1., 2.)
+            self.assertFalse(ok)
+            self.assertEqual(get_clock().time(), 1600000003.)
+            self.assertIn('"t": "2020-09-13T12:26:42.000+00:00"', buf.getvalue())
+        finally:
+            set_clock(prev)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+"""
+Tests for the edna.compress module
+"""
+from edna.sample import Datafile
+from edna.compress import GzipBlockWriter
+from edna.archive import read_records
+import unittest
+import gzip
+from io import BytesIO, StringIO
+
+
+class BlockWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.raw = BytesIO()
+        self.text = StringIO()
+        self.writer = GzipBlockWriter(self.raw, blocksize=1024)
+        df, tdf = Datafile(self.writer), Datafile(self.text)
+        for i in range(200):
+            df.add_record("depth", {"depth": float(i)}, ts=1600000000+i)
+            tdf.add_record("depth", {"depth": float(i)}, ts=1600000000+i)
+        df.flush()
+
+    def test_stream(self):
+        self.assertGreater(self.writer.blocks, 1)
+        self.assertGreater(self.writer.ratio(), 1.)
+        data = gzip.decompress(self.raw.getvalue())
+        self.assertEqual(data.decode("utf-8"), self.text.getvalue())
+
+    def test_truncated(self):
+        buf = self.raw.getvalue()
+        fp = gzip.GzipFile(fileobj=BytesIO(buf[:-10]), mode="rb")
+        recs = list(read_records("edna_x.ndjson.gz", fp))
+        # Only the final block is lost
+        self.assertGreater(len(recs), 150)
+        self.assertLess(len(recs), 200)
+        self.assertEqual(recs[0][2], {"depth": 0.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
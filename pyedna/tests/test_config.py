@@ -83,6 +83,15 @@ class ConfigTestCase(unittest.TestCase):
         x = self.cfg.get_bool('Foo', 'NotFound')
         self.assertEqual(x, False)
 
+    def test_fallback(self):
+        self.assertEqual(self.cfg.get_int('Foo', 'NotFound', 7), 7)
+        self.assertEqual(self.cfg.get_float('Bar', 'NotFound', 1.5), 1.5)
+        self.assertEqual(self.cfg.get_int('Foo', 'Baz', 7), 43)
+
+    def test_get_list(self):
+        x = self.cfg.get_list('Foo', 'Array')
+        self.assertEqual(x, ["5", "6", "7", "8"])
+
 
 class ValidationTest(unittest.TestCase):
     def setUp(self):
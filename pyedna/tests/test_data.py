@@ -0,0 +1,74 @@
+"""
+Tests for the edna.data module
+"""
+from edna.sample import Datafile
+import unittest
+import tempfile
+import os
+import os.path
+try:
+    import numpy as np  # type: ignore
+    from edna.data import load, cache_name
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class DataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "edna_x.ndjson")
+        with open(self.path, "w") as f:
+            df = Datafile(f)
+            df.add_record("metadata", ["name", "test"], ts=1600000000)
+            for i in range(50):
+                df.add_record("sample.{:d}".format(i//25 + 1),
+                              {"amount": i*0.01, "pr_ok": i != 3}, ts=1600000000+i)
+            df.add_record("result.1", {"vwater": 0.2}, ts=1600000100)
+            df.add_record("result.2", {"vwater": 0.3, "deptherror": True},
+                          ts=1600000200)
+            for i in (1, 2):
+                df.add_record("timing.sample.{:d}".format(i), {"ticks": 25*i},
+                              ts=1600000200+i)
+            df.add_record("status", {"state": "seek", "depth": 1.5}, ts=1600000210)
+            df.add_record("status", {"depth": 2.5}, ts=1600000211)
+            df.add_record("config", {"chans": [1, 2]}, ts=1600000212)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_arrays(self):
+        d = load(self.path)
+        self.assertEqual(sorted(d), ["result", "sample", "status", "timing.sample"])
+        s = d["sample"]
+        self.assertEqual(len(s), 50)
+        self.assertEqual(s["index"][-1], 2)
+        self.assertFalse(s["pr_ok"][3])
+        self.assertEqual(s["t"][1], np.datetime64("2020-09-13T12:26:41.000"))
+        r = d["result"]
+        self.assertFalse(r["deptherror"][0])
+        self.assertTrue(r["deptherror"][1])
+        self.assertEqual(list(d["timing.sample"]["index"]), [1, 2])
+        self.assertEqual(list(d["timing.sample"]["ticks"]), [25, 50])
+        self.assertEqual(list(d["status"]["state"]), ["seek", ""])
+        self.assertEqual(d.misc, [["2020-09-13T12:26:40.000+00:00", "metadata",
+                                   ["name", "test"]],
+                                  ["2020-09-13T12:30:12.000+00:00", "config",
+                                   {"chans": [1, 2]}]])
+
+    def test_cache(self):
+        amount = load(self.path)["sample"]["amount"]
+        self.assertTrue(os.path.isfile(cache_name(self.path)))
+        d = load(self.path)
+        self.assertTrue(np.array_equal(d["sample"]["amount"], amount))
+        self.assertEqual(len(d.misc), 2)
+        self.assertEqual(list(d["status"]["state"]), ["seek", ""])
+        # Modifying the source invalidates the cache
+        with open(self.path, "a") as f:
+            Datafile(f).add_record("sample.3", {"amount": 1.0, "pr_ok": True},
+                                   ts=1600000300)
+        self.assertEqual(len(load(self.path)["sample"]), 51)
+
+
+if __name__ == '__main__':
+    unittest.main()
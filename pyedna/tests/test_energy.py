@@ -0,0 +1,172 @@
+"""
+Tests for the edna.energy module
+"""
+from edna.energy import EnergyAccountant, EnergyFields
+from edna.clock import SimClock
+import edna.periph as periph
+from edna.sched import Scheduler
+from edna.sample import Datafile
+from io import StringIO
+import json
+import threading
+import time
+import unittest
+
+
+class Battery(object):
+    """
+    12 volt battery with a discharge current set by the test.
+    """
+    regs = ()
+
+    def __init__(self):
+        self.amps = 1.
+        self.reads = 0
+        # If set, reads wait for this Event
+        self.gate = None
+
+    def voltage(self):
+        self.reads += 1
+        if self.gate is not None:
+            self.gate.wait()
+        return 12.
+
+    def current(self):
+        return -self.amps
+
+    def charge(self):
+        return 50
+
+
+class SbsBus(object):
+    """
+    SMBus of a 12 volt battery discharging at 1 amp.
+    """
+    vals = {0x09: 12000, 0x0a: 0x10000-1000, 0x0e: 50}
+
+    def read_i2c_block_data(self, addr, reg, n):
+        x = self.vals[reg]
+        return [x & 0xff, (x >> 8) & 0xff]
+
+
+class EnergyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock(t0=0.)
+        self.batt = Battery()
+        self.acct = EnergyAccountant([self.batt], 10., clock=self.clock)
+
+    def test_trapezoid(self):
+        acct = self.acct
+        acct.set_phase("seek")
+        acct.update()
+        # Current ramps from 1 A to 3 A over an hour
+        self.clock.advance(3600.)
+        self.batt.amps = 3.
+        acct.update()
+        s, mah, wh = acct.snapshot()["seek"]
+        self.assertAlmostEqual(s, 3600.)
+        self.assertAlmostEqual(mah, 2000.)
+        self.assertAlmostEqual(wh, 24.)
+
+    def test_phases(self):
+        acct = self.acct
+        acct.update()
+        self.clock.advance(100.)
+        acct.set_phase("sample")
+        self.clock.advance(300.)
+        acct.set_phase("idle")
+        self.clock.advance(200.)
+        self.batt.amps = 7.
+        acct.update()
+        snap = acct.snapshot()
+        # The interval is split at the phase changes, the current at
+        # each change is interpolated
+        self.assertAlmostEqual(snap["idle"][0], 300.)
+        self.assertAlmostEqual(snap["sample"][0], 300.)
+        self.assertAlmostEqual(snap["sample"][1], 0.5*(2. + 5.)*300./3.6)
+        self.assertAlmostEqual(snap["idle"][1],
+                               (0.5*(1. + 2.)*100. + 0.5*(5. + 7.)*200.)/3.6)
+        self.assertEqual(snap["hold"], (0., 0., 0.))
+        with self.assertRaises(ValueError):
+            acct.set_phase("bogus")
+
+    def test_write(self):
+        buf = StringIO()
+        df = Datafile(buf)
+        acct = self.acct
+        acct.update()
+        self.clock.advance(36.)
+        acct.update()
+        acct.write(df, "energy.1", since_mark=True)
+        self.clock.advance(36.)
+        acct.update()
+        acct.write(df, "energy.2", since_mark=True)
+        acct.write(df, "energy.deployment")
+        recs = [json.loads(line) for line in buf.getvalue().splitlines()]
+        self.assertEqual([r["event"] for r in recs],
+                         ["energy.1", "energy.2", "energy.deployment"])
+        self.assertEqual(list(recs[0]["data"]), [f[0] for f in EnergyFields])
+        self.assertAlmostEqual(recs[1]["data"]["idle_mah"], 10.)
+        self.assertAlmostEqual(recs[2]["data"]["idle_mah"], 20.)
+        self.assertAlmostEqual(recs[2]["data"]["idle_wh"], 0.24)
+
+    def test_concurrent(self):
+        acct = self.acct
+        acct.update()
+        self.batt.gate = threading.Event()
+        # Release the reads if the test fails
+        self.addCleanup(self.batt.gate.set)
+        first = threading.Thread(target=acct.update, daemon=True)
+        first.start()
+        while self.batt.reads < 2:
+            time.sleep(0.001)
+        self.clock.advance(10.)
+        second = threading.Thread(target=acct.update, daemon=True)
+        second.start()
+        time.sleep(0.05)
+        # The second reading waits for the first to finish
+        self.assertEqual(self.batt.reads, 2)
+        self.batt.gate.set()
+        first.join()
+        second.join()
+        self.assertEqual(acct.readings, 2)
+        self.assertAlmostEqual(acct.snapshot()["idle"][0], 10.)
+
+    def test_cached(self):
+        mon = periph.BatteryMonitor([periph.Battery(SbsBus())], clock=self.clock)
+        acct = EnergyAccountant(mon.batteries(), 10., clock=self.clock)
+        mon.poll(0)
+        self.clock.advance(5.)
+        acct.update()
+        self.clock.advance(3.)
+        mon.poll(0)
+        self.clock.advance(4.)
+        acct.update()
+        # The readings are timed by the polls
+        self.assertEqual(acct.readings, 1)
+        s, mah, wh = acct.snapshot()["idle"]
+        self.assertAlmostEqual(s, 8.)
+        self.assertAlmostEqual(mah, 8./3.6)
+
+    def test_scheduler(self):
+        sched = Scheduler(clock=self.clock)
+        acct = EnergyAccountant([self.batt], 10., clock=self.clock, sched=sched)
+        with acct:
+            self.assertIsNone(acct.tid)
+            with sched:
+                self.clock.sleep(35.)
+        self.assertEqual(sched.stats(), [])
+        self.assertEqual(acct.readings, 4)
+        self.assertAlmostEqual(acct.snapshot()["idle"][0], 35.)
+
+    def test_thread(self):
+        with self.acct:
+            self.acct.set_phase("seek")
+            self.clock.sleep(35.)
+        # Readings every 10 seconds plus the final one
+        self.assertEqual(self.acct.readings, 4)
+        self.assertAlmostEqual(self.acct.snapshot()["seek"][0], 35., delta=0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
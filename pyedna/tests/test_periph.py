@@ -2,6 +2,13 @@
 Tests for the edna.periph module
 """
 import edna.periph
+import edna.sample
+import edna.mockgpio as mockgpio
+from edna.mockpr import Adc
+from edna.clock import RealClock, SimClock
+from edna.sched import Scheduler
+from collections import deque
+import time
 import unittest
 
 
@@ -15,5 +22,294 @@ class PeriphTestCase(unittest.TestCase):
         self.assertAlmostEqual(integral, float(l)/2.)
 
 
+class ReadyTestCase(unittest.TestCase):
+    line = 26
+
+    def setUp(self):
+        mockgpio.edge_freq[self.line] = 100.
+
+    def tearDown(self):
+        del mockgpio.edge_freq[self.line]
+
+    def test_sampler(self):
+        vals = []
+        rs = edna.periph.ReadySampler(Adc(), self.line, 2, 2./3, 128, vals.append)
+        rs.start()
+        time.sleep(0.25)
+        rs.stop()
+        n = len(vals)
+        self.assertGreater(n, 10)
+        time.sleep(0.05)
+        self.assertEqual(len(vals), n)
+
+    def test_burst(self):
+        adc = ReadyAdc()
+        pr = edna.periph.PrSensor(adc, 1, 1, coeff=[0., 1.], rdy=self.line)
+        self.assertAlmostEqual(pr.read_burst(8, 1.), 4.096*1000/32767)
+        # Conversions after the eighth are not used
+        self.assertGreaterEqual(adc.results, 8)
+        self.assertEqual(adc.chan, -1)
+
+    def test_integrator(self):
+        # Constant input of 1 unit/s
+        fm = edna.periph.Integrator(Adc(), 2, 2./3, lambda v: 1.,
+                                    clock=RealClock(), rdy=self.line)
+        q: deque = deque([], 1)
+        fm.start(0.1, q)
+        time.sleep(0.5)
+        fm.stop()
+        total, secs = q[0]
+        self.assertAlmostEqual(total, secs, delta=0.02)
+
+
+class FakeAdc(object):
+    """
+    ADC which only supports single-shot conversions, the result is the
+    channel number times 1000.
+    """
+    def __init__(self):
+        self.reads = []
+
+    def read_adc(self, chan, gain=1, data_rate=None):
+        self.reads.append(chan)
+        return chan*1000
+
+
+class ReadyAdc(FakeAdc):
+    """
+    FakeAdc which also supports continuous conversions, every result is
+    the channel number times 1000.
+    """
+    def __init__(self):
+        super().__init__()
+        self.chan = -1
+        self.results = 0
+
+    def start_adc_comparator(self, chan, high_threshold, low_threshold, **kw):
+        self.chan = chan
+
+    def get_last_result(self):
+        self.results += 1
+        return self.chan*1000
+
+    def stop_adc(self):
+        self.chan = -1
+
+
+class ArbiterTestCase(unittest.TestCase):
+    def test_poll_registers(self):
+        clock = SimClock(t0=0.)
+        bus = FakeBus(fails=5)
+        mon = edna.periph.BatteryMonitor([edna.periph.Battery(bus, ["temperature"])],
+                                         backoff=0.05, clock=clock)
+        # Every register fails in the first pass, the voltage again in
+        # the second, the passes use the same backoff as the other reads
+        self.assertTrue(mon.poll(0))
+        self.assertAlmostEqual(clock.time(), 0.15)
+        self.assertEqual(mon.latest(0).v, 1.)
+
+    def test_schedule(self):
+        clock = SimClock(t0=0.)
+        adc = FakeAdc()
+        arb = edna.periph.AdcArbiter(adc, 30., clock=clock)
+        pr = edna.periph.PrSensor(arb, 1, 1, coeff=[0., 1.])
+        fm = edna.periph.Integrator(arb, 2, 1, lambda v: v, clock=clock)
+        q: deque = deque([], 1)
+        with arb:
+            # First reads are direct conversions
+            pr.read()
+            fm.start(0.1, q)
+            clock.sleep(1.)
+            fm.stop()
+        self.assertEqual(adc.reads[:2], [1, 2])
+        # Channels are converted in turn
+        self.assertEqual(adc.reads[2:12], [1, 2]*5)
+        self.assertEqual(arb.stats()["conversions"], len(adc.reads))
+        # 30 conversions/s for at least 1 second plus the direct ones
+        self.assertGreaterEqual(len(adc.reads), 33)
+        self.assertAlmostEqual(pr.read_volts(), 4.096*1000/32767)
+        self.assertEqual(arb.latest(1)[0], 1000)
+        self.assertLess(arb.age(2), 0.1)
+        self.assertEqual(arb.age(3), float("inf"))
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock(t0=0.)
+        # Integrate the raw ADC value
+        self.fm = edna.periph.Integrator(FakeAdc(), 1, 1, lambda v: v*32767/4.096,
+                                         clock=self.clock, size=4)
+        self.q: deque = deque([], 1)
+
+    def add(self, t, x):
+        self.clock.advance(t - self.clock.time())
+        self.fm._add(self.q, x)
+
+    def test_trapezoid(self):
+        self.add(0., 0)
+        self.add(1., 10)
+        # A late sample is weighted by the measured interval
+        self.add(3., 10)
+        total, secs = self.q[0]
+        self.assertAlmostEqual(total, 25.)
+        self.assertEqual(secs, 3.)
+        self.assertAlmostEqual(self.fm.rate(), 10.)
+
+    def test_history(self):
+        for i in range(6):
+            self.add(float(i), i*10)
+        t, y = self.fm.history()
+        # Only the latest samples are kept
+        self.assertEqual(list(t), [2., 3., 4., 5.])
+        self.assertEqual([round(v) for v in y], [20, 30, 40, 50])
+        self.assertAlmostEqual(self.q[0][0], 125.)
+        self.assertAlmostEqual(self.fm.mean_rate(1.), 45.)
+        self.assertAlmostEqual(self.fm.mean_rate(2.5), 37.5)
+        self.assertAlmostEqual(self.fm.mean_rate(10.), 35.)
+
+    def test_clock_step(self):
+        clock = StepClock(t0=0.)
+        fm = edna.periph.Integrator(FakeAdc(), 1, 1, lambda v: v*32767/4.096,
+                                    clock=clock)
+        fm._add(self.q, 10)
+        clock.advance(1.)
+        # The system clock is set back while sampling
+        clock.offset = -3600.
+        fm._add(self.q, 10)
+        total, secs = self.q[0]
+        self.assertAlmostEqual(total, 10.)
+        self.assertAlmostEqual(secs, -3599.)
+        self.assertEqual(list(fm.history()[0]), [0., 1.])
+
+
+class StepClock(SimClock):
+    """
+    SimClock whose wall-clock time can be stepped, as by an NTP
+    correction, without changing the monotonic time.
+    """
+    offset = 0.
+
+    def time(self):
+        return super().time() + self.offset
+
+
+class FakeBus(object):
+    """
+    SMBus which NAKs the next *fails* reads, the register value is 1000.
+    """
+    def __init__(self, fails=0):
+        self.fails = fails
+        self.reads = 0
+
+    def read_i2c_block_data(self, addr, reg, n):
+        self.reads += 1
+        if self.fails > 0:
+            self.fails -= 1
+            raise IOError()
+        return [0xe8, 0x03]
+
+
+class SbsBus(object):
+    """
+    SMBus with a value for each register, the registers in *busy* NAK
+    their first read.
+    """
+    def __init__(self, vals, busy=()):
+        self.vals = vals
+        self.busy = set(busy)
+        self.reads = []
+
+    def read_i2c_block_data(self, addr, reg, n):
+        self.reads.append(reg)
+        if reg in self.busy:
+            self.busy.remove(reg)
+            raise IOError()
+        x = self.vals[reg]
+        return [x & 0xff, (x >> 8) & 0xff]
+
+
+class BatteryTestCase(unittest.TestCase):
+    def test_decode(self):
+        bus = SbsBus({0x09: 14500, 0x0a: 0x10000-1250, 0x0e: 80})
+        b = edna.periph.Battery(bus)
+        self.assertEqual((b.voltage(), b.current(), b.charge()), (14.5, -1.25, 80))
+
+    def test_read_registers(self):
+        clock = SimClock(t0=0.)
+        bus = SbsBus({0x08: 2982, 0x09: 14500, 0x0a: 0x10000-1250, 0x0b: 0x10000-500,
+                      0x0e: 80, 0x0f: 6000, 0x11: 0xffff},
+                     busy=(0x0b,))
+        b = edna.periph.Battery(bus, ["temperature", "avg_current", "current",
+                                      "remaining", "time_to_empty"])
+        vals = b.read_registers(clock=clock)
+        self.assertEqual([(k, round(v, 2)) for k, v in vals.items()],
+                         [("voltage", 14.5), ("current", -1.25), ("charge", 80.),
+                          ("temperature", 25.05), ("avg_current", -0.5),
+                          ("remaining", 6.), ("time_to_empty", 65535.)])
+        # Each register is read once in the first pass, the busy one is
+        # read again in a second pass
+        self.assertEqual(bus.reads, [0x09, 0x0a, 0x0e, 0x08, 0x0b, 0x0f, 0x11, 0x0b])
+        self.assertAlmostEqual(clock.time(), 0.1)
+        self.assertEqual(edna.sample.split_registers(b, vals)[0], (14.5, -1.25, 80))
+        self.assertEqual([round(v, 2) for v in edna.sample.split_registers(b, vals)[1]],
+                         [25.05, -0.5, -1.25, 6., 65535.])
+        with self.assertRaises(ValueError):
+            edna.periph.Battery(bus, ["bogus"])
+
+
+class MonitorTestCase(unittest.TestCase):
+    def test_poll(self):
+        clock = SimClock(t0=0.)
+        bus = FakeBus(fails=2)
+        mon = edna.periph.BatteryMonitor([edna.periph.Battery(bus)],
+                                         clock=clock)
+        b = mon.batteries()[0]
+        self.assertEqual(b.voltage(), 0.)
+        self.assertEqual(mon.latest(0).age, float("inf"))
+        # Two retries, with backoff, then success
+        self.assertTrue(mon.poll(0))
+        self.assertEqual(mon.retries, 2)
+        self.assertAlmostEqual(clock.time(), 0.3)
+        self.assertEqual((b.voltage(), b.current(), b.charge()), (1., 1., 1000))
+        # Every attempt fails, the previous reading is kept
+        bus.fails = 4
+        clock.advance(1.)
+        self.assertFalse(mon.poll(0))
+        st = mon.latest(0)
+        self.assertEqual((st.v, st.errors), (1., 1))
+        self.assertAlmostEqual(st.t, 0.3)
+        self.assertAlmostEqual(st.age, 1.7)
+
+    def test_schedule(self):
+        clock = SimClock(t0=0.)
+        buses = [FakeBus(), FakeBus()]
+        mon = edna.periph.BatteryMonitor([edna.periph.Battery(b) for b in buses],
+                                         interval=2., clock=clock)
+        with mon:
+            clock.sleep(9.5)
+        # Each battery is polled every 2 seconds, three reads per poll
+        self.assertEqual([b.reads for b in buses], [15, 15])
+        self.assertEqual(mon.stats()["polls"], 10)
+        # Polls are staggered
+        self.assertAlmostEqual(mon.latest(0).t, 8., delta=0.3)
+        self.assertAlmostEqual(mon.latest(1).t, 9., delta=0.3)
+
+    def test_scheduler(self):
+        clock = SimClock(t0=0.)
+        buses = [FakeBus(), FakeBus()]
+        sched = Scheduler(clock=clock)
+        mon = edna.periph.BatteryMonitor([edna.periph.Battery(b) for b in buses],
+                                         interval=2., clock=clock, sched=sched)
+        with sched, mon:
+            self.assertIsNone(mon.tid)
+            clock.sleep(9.5)
+            self.assertEqual([st["runs"] for st in sched.stats()], [5, 5])
+        # The polls are removed from the scheduler on exit
+        self.assertEqual(sched.stats(), [])
+        self.assertEqual([b.reads for b in buses], [15, 15])
+        self.assertAlmostEqual(mon.latest(0).t, 8.)
+        self.assertAlmostEqual(mon.latest(1).t, 9.)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for the edna.replay module
+"""
+from edna.sample import Datafile
+from edna.config import Config
+from edna.periph import Battery, PrSensor, psi_to_dbar
+from edna.clock import SimClock
+from edna.replay import Recording, ReplayAdc, ReplaySMBus, Replay
+from collections import OrderedDict
+from io import StringIO
+import json
+import unittest
+import tempfile
+import os.path
+
+
+CONFIG = """
+[Pressure.Env]
+Chan=0
+Gain=2/3
+Coeff = -120.0, 250.0
+[Pressure.Filter]
+Chan=1
+Gain=2/3
+Coeff = -187.5, 74.7
+Max=12
+[AnalogFlowSensor]
+Chan=2
+Gain=2/3
+Coeff = -0.15, 2.22223
+[FlowSensor]
+Rate=10
+[Collect.Sample]
+Amount=0.01
+Time=4
+[Deployment]
+SeekErr=2
+DepthErr=5
+PrRate=4
+SeekTime=30
+Downcast=yes
+[Sample.1]
+Depth=10
+[Sample.2]
+Depth=20
+[Sample.3]
+Depth=30
+"""
+
+
+def sample_record(elapsed, amount, depth):
+    return OrderedDict(elapsed=elapsed, amount=amount, pr=5.0,
+                       pr_ok=True, depth=depth)
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "edna_20200913T122640.ndjson")
+        self.cfg = Config(self.tmpdir.name + "/none")
+        self.cfg.read_string(CONFIG)
+        t = 1600000000.
+        with open(self.path, "w") as f:
+            df = Datafile(f)
+            # Descend at 1 dbar/s, stop for 2 seconds at each sample depth
+            depth = 0.
+            for target in (10., 20., 30.):
+                while depth < target:
+                    depth += 1.
+                    t += 1.
+                    df.add_record("depth", {"depth": depth}, ts=t)
+                index = int(target/10)
+                for i in range(21):
+                    df.add_record("sample."+str(index),
+                                  sample_record(i*0.1, i*0.0005, depth), ts=t)
+                    t += 0.1
+                df.add_record("battery-0", OrderedDict(v=14.8, a=-0.25, soc=90), ts=t)
+                if index == 1:
+                    df.add_record("result.1",
+                                  OrderedDict(elapsed=5.0, vwater=0.01, vethanol=0.05,
+                                              overpressure=False, deptherror=False),
+                                  ts=t)
+        self.rec = Recording(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_recording(self):
+        self.assertEqual([s.index for s in self.rec.samples], [1, 2, 3])
+        s = self.rec.sample(2)
+        self.assertAlmostEqual(s.amount, 0.01)
+        self.assertAlmostEqual(s.flow_rate(1.0), 5.0)
+        self.assertEqual(s.flow_rate(3.0), 0.)
+
+    def test_devices(self):
+        clock = SimClock(t0=self.rec.t0 + 4.5)
+        adc = ReplayAdc(self.rec, self.cfg, clock)
+        env = PrSensor(adc, 0, 2./3, coeff=[-120., 250.])
+        self.assertAlmostEqual(psi_to_dbar(env.read()), 5., delta=0.05)
+        clock.advance(self.rec.t1 - clock.time())
+        batt = Battery(ReplaySMBus(self.rec.batteries[0], clock))
+        self.assertEqual((batt.voltage(), batt.current(), batt.charge()),
+                         (14.8, -0.25, 90))
+
+    def test_replay(self):
+        replay = Replay(self.rec, self.cfg)
+        results = replay.run()
+        self.assertEqual([r.index for r in results], [1, 2, 3])
+        for r, target in zip(results, (10., 20., 30.)):
+            self.assertAlmostEqual(r.depth, target, delta=2.)
+            self.assertAlmostEqual(r.amount, 0.01, delta=0.002)
+            self.assertFalse(r.overpressure)
+
+    def test_results(self):
+        self.assertEqual(self.rec.ethanol(1), (0.05, 3.0))
+        self.assertEqual(self.rec.ethanol(2), (0., 0.))
+        buf = StringIO()
+        Replay(self.rec, self.cfg).run(Datafile(buf))
+        recs = [json.loads(line) for line in buf.getvalue().splitlines()]
+        results = [r["data"] for r in recs if r["event"].startswith("result.")]
+        # Same record shape as edna.sample.collect
+        self.assertEqual([list(r) for r in results],
+                         [["elapsed", "vwater", "vethanol", "overpressure", "deptherror"]]*3)
+        self.assertEqual(results[0]["vethanol"], 0.05)
+        self.assertAlmostEqual(results[0]["elapsed"] - results[1]["elapsed"], 3.0, delta=0.2)
+        self.assertEqual(results[1]["vethanol"], 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Tests for the edna.rt module
+"""
+from edna.rt import RtPolicy, configure_thread, get_policy, set_policy
+from threading import Thread
+import os
+import unittest
+
+
+@unittest.skipUnless(hasattr(os, "sched_setaffinity"), "requires Linux scheduling calls")
+class RtTestCase(unittest.TestCase):
+    def run_thread(self, policy=None):
+        result = []
+        t = Thread(target=lambda: result.append(configure_thread("test", policy)))
+        t.start()
+        t.join()
+        return result[0]
+
+    def test_affinity(self):
+        cpus = os.sched_getaffinity(0)
+        desc = self.run_thread(RtPolicy(cpus=(min(cpus),)))
+        self.assertTrue(desc.endswith("cpus={:d}".format(min(cpus))))
+        # The calling thread is not affected
+        self.assertEqual(os.sched_getaffinity(0), cpus)
+
+    def test_default(self):
+        self.assertEqual(self.run_thread(), "")
+        prev = set_policy(RtPolicy(cpus=(min(os.sched_getaffinity(0)),)))
+        try:
+            self.assertTrue(self.run_thread().startswith("policy="))
+        finally:
+            set_policy(prev)
+        self.assertIsNone(get_policy())
+
+    def test_fallback(self):
+        with self.assertLogs("edna.rt", level="WARNING") as cm:
+            desc = self.run_thread(RtPolicy(cpus=(100000,)))
+        self.assertIn("cannot set CPU affinity", cm.output[0])
+        self.assertTrue(desc.startswith("policy="))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Tests for the edna.sample module
+"""
+from edna.sample import Datafile, BufferedDatafile, FlushPolicy, \
+    IndexedDatafile, TimeFormatter, register_event, SampleFields, \
+    StreamRate, seekdepth
+from edna.clock import SimClock
+import unittest
+import datetime
+import json
+import math
+import tempfile
+import os.path
+from io import StringIO
+
+
+class BufferedDatafileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "data.ndjson")
+        self.fp = open(self.path, "w")
+
+    def tearDown(self):
+        self.fp.close()
+        self.tmpdir.cleanup()
+
+    def read(self):
+        with open(self.path, "r") as f:
+            return [json.loads(line) for line in f]
+
+    def test_write(self):
+        with BufferedDatafile(Datafile(self.fp), maxsize=4) as df:
+            for i in range(20):
+                df.add_record("sample.1", {"amount": i}, ts=1600000000+i)
+        recs = self.read()
+        self.assertEqual(len(recs), 20)
+        self.assertEqual([r["data"]["amount"] for r in recs], list(range(20)))
+        self.assertEqual(recs[0]["t"], "2020-09-13T12:26:40.000+00:00")
+        self.assertEqual(df.written, 20)
+        self.assertEqual(df.errors, 0)
+        self.assertLessEqual(df.hiwater, 4)
+
+    def test_sync_event(self):
+        policy = FlushPolicy(records=0, interval=0, events=("result.*",))
+        df = BufferedDatafile(Datafile(self.fp), policy=policy)
+        df.add_record("sample.1", {"amount": 1})
+        df.add_record("result.1", {"vwater": 1})
+        df.flush()
+        self.assertEqual(len(self.read()), 2)
+        self.assertGreaterEqual(df.syncs, 2)
+        df.close()
+        self.assertRaises(ValueError, df.add_record, "depth", {})
+
+
+class EncoderTestCase(unittest.TestCase):
+    def test_timestamp(self):
+        tfmt = TimeFormatter()
+        for ts in (1600000000.0, 1600000000.0004, 1600000000.9995,
+                   1600000000.9999996, 1600000001.123):
+            t = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+            self.assertEqual(tfmt(ts), t.isoformat(sep='T', timespec='milliseconds'))
+
+    def test_encode(self):
+        enc = register_event("sample.1", SampleFields)
+        self.assertIs(enc, register_event("sample.1", SampleFields))
+        values = (1.2345678, 0.1, 4.3, False, 24.0)
+        f = StringIO()
+        Datafile(f).add_record("sample.1", enc.asdict(values), ts=1600000000.25)
+        self.assertEqual(json.loads(enc.encode(values, 1600000000.25)),
+                         json.loads(f.getvalue()))
+        rec = json.loads(enc.encode((1.2, float("nan"), float("inf"), True, 24.0),
+                                    1600000000.25))
+        self.assertTrue(math.isnan(rec["data"]["amount"]))
+        self.assertEqual(rec["data"]["pr"], float("inf"))
+        self.assertEqual(rec["data"]["pr_ok"], True)
+        self.assertEqual(rec["t"], "2020-09-13T12:26:40.250+00:00")
+
+
+class IndexedDatafileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "data.ndjson")
+        with open(self.path, "w") as f, open(self.path + ".idx", "w") as idx:
+            df = Datafile(f, index=idx)
+            df.add_record("metadata", ["name", "caf\u00e9"], ts=1600000000)
+            for i in range(100):
+                df.add_record("sample.1", {"amount": i}, ts=1600000001+i)
+                if i % 10 == 0:
+                    df.add_record("battery-0", {"soc": i}, ts=1600000001+i)
+            df.add_record("result.1", {"vwater": 0.2}, ts=1600000200)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_select(self):
+        with IndexedDatafile(self.path) as idf:
+            self.assertEqual(len(idf), 112)
+            self.assertEqual(idf.count("battery-*"), 10)
+            recs = list(idf.records("result.*"))
+            self.assertEqual(recs, [(1600000200.0, "result.1", {"vwater": 0.2})])
+            recs = list(idf.records("battery-*"))
+            self.assertEqual([r[2]["soc"] for r in recs], list(range(0, 100, 10)))
+
+    def test_time_range(self):
+        with IndexedDatafile(self.path) as idf:
+            recs = list(idf.records(start=1600000011, end=1600000013))
+            self.assertEqual([r[1] for r in recs],
+                             ["sample.1", "battery-0", "sample.1"])
+            self.assertEqual(recs[-1][2], {"amount": 11})
+
+
+class Battery(object):
+    """
+    Battery which takes 0.1 seconds to read.
+    """
+    regs = ()
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def voltage(self):
+        self.clock.sleep(0.1)
+        return 14.5
+
+    def current(self):
+        return -1.25
+
+    def charge(self):
+        return 80
+
+
+class StreamRateTestCase(unittest.TestCase):
+    def test_ready(self):
+        clock = SimClock(t0=0.)
+        rate = StreamRate(5., clock=clock)
+        self.assertTrue(rate.ready(0., 1.))
+        clock.advance(0.8)
+        rate.updated(0., 0.)
+        self.assertFalse(rate.ready(4., 5.))
+        # Deferred while the update would overrun the next tick
+        clock.advance(4.7)
+        self.assertFalse(rate.ready(5., 6.))
+        self.assertEqual(rate.deferred, 1)
+        self.assertTrue(rate.ready(6., 7.))
+        # but for no longer than an interval
+        clock.advance(4.5)
+        self.assertTrue(rate.ready(10., 10.1))
+
+    def test_seekdepth(self):
+        clock = SimClock(t0=1600000000.)
+        buf = StringIO()
+        depths = iter(range(1, 20))
+
+        def chkdepth():
+            d = float(next(depths))
+            return d, d >= 10.
+
+        depth, ok = seekdepth(Datafile(buf), chkdepth, 1., 60.,
+                              [Battery(clock)],  # type: ignore
+                              clock=clock, blog=4.)
+        self.assertEqual((depth, ok), (10., True))
+        recs = [json.loads(line) for line in buf.getvalue().splitlines()]
+        self.assertEqual(len([r for r in recs if r["event"] == "depth"]), 10)
+        self.assertEqual([r["t"][17:19] for r in recs if r["event"] == "battery-0"],
+                         ["40", "44", "48"])
+
+    def test_seekdepth_limit(self):
+        clock = SimClock(t0=1600000000.)
+        buf = StringIO()
+        for blog in (0., 2.):
+            depth, ok = seekdepth(Datafile(buf), lambda: (0., False), 4., 5.,
+                                  [Battery(clock)],  # type: ignore
+                                  clock=clock, blog=blog)
+            self.assertEqual((depth, ok), (0., False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Tests for the edna.sched module
+"""
+from edna.clock import SimClock
+from edna.sched import Scheduler
+from edna.periph import AnalogFlowMeter
+from edna.mockpr import Adc
+from collections import deque
+import unittest
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimClock(t0=0.)
+        self.sched = Scheduler(clock=self.clock)
+        self.log = []
+
+    def task(self, name, runtime=0.):
+        def fn():
+            self.log.append((name, round(self.clock.time(), 3)))
+            self.clock.advance(runtime)
+        return fn
+
+    def run_for(self, secs):
+        t_end = self.clock.time() + secs
+        while self.clock.time() < t_end:
+            dt = self.sched.run_pending()
+            self.clock.sleep(min(dt, t_end - self.clock.time()) or 1e-3)
+
+    def test_rates(self):
+        self.sched.add(self.task("fast"), 0.1)
+        self.sched.add(self.task("slow"), 0.3, priority=1)
+        self.run_for(0.95)
+        self.assertEqual([t for n, t in self.log if n == "slow"], [0., 0.3, 0.6, 0.9])
+        self.assertEqual(len([n for n, t in self.log if n == "fast"]), 10)
+        # Coincident tasks run in priority order
+        self.assertEqual(self.log[:2], [("slow", 0.), ("fast", 0.)])
+
+    def test_overrun(self):
+        self.sched.add(self.task("slow", runtime=0.25), 0.1, name="slow")
+        self.run_for(1.)
+        st = self.sched.stats()[0]
+        self.assertEqual(st["name"], "slow")
+        self.assertEqual(st["runs"], 4)
+        self.assertEqual(st["overruns"], 4)
+        self.assertEqual(st["missed"], 6)
+        self.assertAlmostEqual(st["max_runtime"], 0.25)
+
+    def test_error(self):
+        def fail():
+            raise RuntimeError("task failure")
+        task = self.sched.add(fail, 0.5)
+        self.run_for(1.)
+        self.assertEqual((task.runs, task.errors), (2, 2))
+        self.sched.remove(task)
+        self.assertEqual(self.sched.stats(), [])
+
+    def test_integrator(self):
+        fm = AnalogFlowMeter(Adc(), 2, 2./3, [1000., 0.], clock=self.clock,
+                             sched=self.sched)
+        fm.reset()
+        with self.sched:
+            self.clock.sleep(2.)
+            amount, secs = fm.amount()
+            fm.stop()
+        # 1 liter/s for 2 seconds
+        self.assertAlmostEqual(amount, 2., delta=0.15)
+        self.assertAlmostEqual(secs, 2., delta=0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
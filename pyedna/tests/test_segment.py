@@ -0,0 +1,54 @@
+"""
+Tests for the edna.segment module
+"""
+from edna.sample import Datafile
+from edna.segment import SegmentedFile, segments, check_segment, recover
+import unittest
+import tempfile
+import os.path
+from io import BytesIO
+
+
+class SegmentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.tmpdir.name, "edna_x")
+        self.closed = []
+        sf = SegmentedFile(self.base, maxbytes=1000, callback=self.closed.append)
+        df = Datafile(sf)
+        for i in range(100):
+            df.add_record("depth", {"depth": float(i)}, ts=1600000000+i)
+        sf.close()
+        self.names = segments(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roll(self):
+        self.assertGreater(len(self.names), 5)
+        self.assertEqual(self.closed, self.names)
+        status = [check_segment(name) for name in self.names]
+        self.assertTrue(all(s.ok and s.complete for s in status))
+        self.assertEqual(sum(s.records for s in status), 100)
+
+    def test_recover(self):
+        # Simulate a torn record in the last segment and a corrupted one
+        with open(self.names[-1], "r+b") as f:
+            buf = f.read()
+            f.seek(0)
+            f.truncate()
+            f.write(buf[:buf.index(b"#edna")-5])
+        with open(self.names[1], "r+b") as f:
+            f.seek(10)
+            f.write(b"X")
+        out = BytesIO()
+        status = recover(self.names, out)
+        self.assertFalse(status[1].ok)
+        self.assertFalse(status[-1].complete)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), sum(s.records for s in status if s.ok))
+        self.assertEqual(len(lines), 100 - status[1].records - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
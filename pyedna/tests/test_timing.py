@@ -0,0 +1,161 @@
+"""
+Tests for the edna.timing module
+"""
+from edna.clock import SimClock
+from edna.timing import Ticker, Tick, SKIP, COALESCE, BURST
+from edna.sample import Datafile, FlowLimits, flow_monitor, seekdepth
+from contextlib import nullcontext
+from io import StringIO
+import json
+import unittest
+
+
+class FlowMeter(object):
+    """
+    Flow meter which delivers 1 cc per second.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+
+    def reset(self):
+        self.t0 = self.clock.time()
+
+    def amount(self):
+        secs = self.clock.time() - self.t0
+        return secs/1000., secs
+
+
+class StepClock(SimClock):
+    """
+    SimClock whose wall clock time can be stepped, as by an NTP
+    correction, without changing the monotonic time.
+    """
+    offset = 0.
+
+    def time(self):
+        return super().time() + self.offset
+
+
+class TickerTestCase(unittest.TestCase):
+    def test_schedule(self):
+        clock = SimClock(t0=100.)
+        tkr = Ticker(0.5, clock=clock)
+        ticks = []
+        for tick in tkr:
+            ticks.append(tick.t)
+            if len(ticks) == 4:
+                break
+        self.assertEqual(ticks, [100., 100.5, 101., 101.5])
+        st = tkr.stats()
+        self.assertEqual((st["ticks"], st["missed"], st["late_max"]), (4, 0, 0.))
+        self.assertAlmostEqual(st["rate"], 2.)
+
+    def overrun(self, catchup):
+        clock = SimClock(t0=0.)
+        tkr = Ticker(1., clock=clock, catchup=catchup)
+        ticks = []
+        for tick in tkr:
+            ticks.append(tick)
+            if len(ticks) == 2:
+                # Overrun by 2.5 periods
+                clock.advance(3.5)
+            if len(ticks) == 5:
+                break
+        return ticks, tkr.stats()
+
+    def test_coalesce(self):
+        ticks, st = self.overrun(COALESCE)
+        # Ticks 2 and 3 are dropped, tick 4 is half a period late
+        self.assertEqual(ticks, [Tick(0., 0, 0.), Tick(1., 0, 1.), Tick(4.5, 2, 4.5),
+                                 Tick(5., 0, 5.), Tick(6., 0, 6.)])
+        self.assertEqual(st["missed"], 2)
+        self.assertAlmostEqual(st["late_max"], 0.5)
+        self.assertEqual(st["hist"][-1], 1)
+        self.assertEqual(sum(st["hist"]), 5)
+
+    def test_skip(self):
+        ticks, st = self.overrun(SKIP)
+        self.assertEqual(ticks, [Tick(0., 0, 0.), Tick(1., 0, 1.), Tick(5., 3, 5.),
+                                 Tick(6., 0, 6.), Tick(7., 0, 7.)])
+        self.assertEqual((st["missed"], st["late_max"]), (3, 0.))
+
+    def test_burst(self):
+        ticks, st = self.overrun(BURST)
+        self.assertEqual(ticks, [Tick(0., 0, 0.), Tick(1., 0, 1.), Tick(4.5, 0, 4.5),
+                                 Tick(4.5, 0, 4.5), Tick(4.5, 0, 4.5)])
+        self.assertEqual(st["missed"], 0)
+        self.assertAlmostEqual(st["late_max"], 2.5)
+
+    def test_clock_step(self):
+        clock = StepClock(t0=100.)
+        tkr = Ticker(1., clock=clock)
+        ticks = []
+        for tick in tkr:
+            ticks.append(tick)
+            if len(ticks) == 2:
+                clock.offset = -3600.
+            if len(ticks) == 4:
+                break
+        self.assertEqual([t.m for t in ticks], [0., 1., 2., 3.])
+        self.assertEqual(ticks[2].t, 102. - 3600.)
+        self.assertAlmostEqual(tkr.stats()["rate"], 1.)
+
+    def test_seek_clock_step(self):
+        clock = StepClock(t0=100.)
+        calls = []
+
+        def chkdepth():
+            calls.append(1)
+            if len(calls) == 1:
+                clock.offset = 3600.
+            return 10., len(calls) == 4
+
+        # The seek is not cut short by the wall clock step
+        self.assertEqual(seekdepth(None, chkdepth, 1., 10., clock=clock), (10., True))
+
+    def test_policy(self):
+        with self.assertRaises(ValueError):
+            Ticker(1., catchup="wait")
+
+    def test_flow_monitor(self):
+        clock = SimClock(t0=1600000000.)
+        buf = StringIO()
+        amount, secs, ovp, oor = flow_monitor(Datafile(buf), "sample.1",
+                                              nullcontext(),  # type: ignore
+                                              FlowMeter(clock),  # type: ignore
+                                              10., FlowLimits(time=60, amount=0.005),
+                                              lambda: (1., True),
+                                              lambda: (10., True),
+                                              clock=clock)
+        self.assertAlmostEqual(secs, 5.)
+        rec = json.loads(buf.getvalue().splitlines()[-1])
+        self.assertEqual(rec["event"], "timing.sample.1")
+        self.assertEqual(rec["data"]["ticks"], 51)
+        self.assertEqual(rec["data"]["missed"], 0)
+        self.assertEqual(rec["data"]["actual"], 10.)
+
+    def test_gap(self):
+        clock = SimClock(t0=1600000000.)
+        buf = StringIO()
+        calls = []
+
+        def checkdepth():
+            calls.append(1)
+            if len(calls) == 5:
+                clock.advance(0.35)
+            return 10., True
+
+        flow_monitor(Datafile(buf), "sample.2",
+                     nullcontext(),  # type: ignore
+                     FlowMeter(clock),  # type: ignore
+                     10., FlowLimits(time=60, amount=0.001),
+                     lambda: (1., True), checkdepth, clock=clock)
+        gaps = [json.loads(line) for line in buf.getvalue().splitlines()
+                if "gap." in line]
+        self.assertEqual(len(gaps), 1)
+        self.assertEqual(gaps[0]["event"], "gap.sample.2")
+        self.assertEqual(gaps[0]["data"], {"skipped": 2, "interval": 0.1})
+
+
+if __name__ == '__main__':
+    unittest.main()
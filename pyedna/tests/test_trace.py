@@ -0,0 +1,63 @@
+"""
+Tests for the edna.trace module
+"""
+from edna.clock import SimClock
+from edna.trace import Tracer, NullTracer
+from edna.sample import Datafile, seekdepth
+from io import StringIO
+import json
+import unittest
+
+
+class TracerTestCase(unittest.TestCase):
+    def test_spans(self):
+        tr = Tracer(("a", "b"), size=4)
+        for i in range(6):
+            tr.lap("a", tr.mark())
+        self.assertEqual(tr.counts, [6, 0])
+        self.assertEqual(len(tr.spans("a")), 4)
+        self.assertEqual(tr.spans("b"), [])
+        st = tr.summary()
+        self.assertEqual(list(st.keys()), ["a", "b"])
+        self.assertEqual(list(st["a"].keys()), ["n", "p50", "p90", "p99", "max"])
+        self.assertEqual(st["a"]["n"], 6)
+        self.assertLessEqual(st["a"]["p50"], st["a"]["max"])
+        self.assertEqual(st["b"]["max"], 0.)
+
+    def test_percentiles(self):
+        tr = Tracer(("a",), size=100)
+        # Durations of 1 to 100 us in an arbitrary order
+        for i in range(100):
+            tr.bufs[0][i] = ((i*37) % 100 + 1)*1000
+        tr.counts[0] = 100
+        self.assertEqual(tr.percentiles("a"), (50e-6, 90e-6, 99e-6))
+        # After wrapping, only the latest spans are kept
+        tr.lap("a", tr.mark())
+        self.assertEqual(len(tr.spans("a")), 100)
+        self.assertEqual(tr.spans("a")[0], tr.bufs[0][1])
+
+    def test_null(self):
+        tr = NullTracer(("a",))
+        self.assertFalse(tr)
+        self.assertEqual(tr.lap("a", tr.mark()), 0)
+        self.assertEqual(tr.spans("a"), [])
+
+    def test_seekdepth(self):
+        clock = SimClock(t0=1600000000.)
+        buf = StringIO()
+        depths = iter([1., 2., 3.])
+
+        def chkdepth():
+            d = next(depths)
+            return d, d >= 3.
+
+        seekdepth(Datafile(buf), chkdepth, 1., 0, clock=clock, trace=True)
+        rec = json.loads(buf.getvalue().splitlines()[-1])
+        self.assertEqual(rec["event"], "trace.depth")
+        self.assertEqual(rec["data"]["ticks"], 3)
+        self.assertIn("write_p99", rec["data"])
+        self.assertEqual(rec["data"]["battery_max"], 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()